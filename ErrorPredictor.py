@@ -15,7 +15,7 @@ def main():
                                      epilog="v0.0.1")
     parser.add_argument("infolder",
                         action="store",
-                        help="input folder name full of pdbs or path to a single pdb")
+                        help="input folder name full of pdbs (.pdb, .pdb.gz or silent files), path to a single pdb or multi-structure file, a quoted glob pattern (** for subfolders) or a file listing input paths or patterns, one per line")
     parser.add_argument("outfolder",
                         action="store", nargs=argparse.REMAINDER,
                         help="output folder name. If a pdb path is passed this needs to be a .npz file. Can also be empty. Default is current folder or pdbname.npz")
@@ -24,6 +24,14 @@ def main():
                         action="store_true",
                         default=False,
                         help="Running on a single pdb file instead of a folder (Default: False)")
+    parser.add_argument("--models",
+                        action="store_true",
+                        default=False,
+                        help="predicting every MODEL of multi-model .pdb files instead of the first one, named <file>.model<serial> (Default: False)")
+    parser.add_argument("--shard",
+                        action="store",
+                        default="",
+                        help="i/n, only working on the decoys of shard i (0 <= i < n) of n, e.g. for cluster array jobs. Decoys are assigned to shards by their names (Default: all decoys)")
     parser.add_argument("--multiDecoy",
                         "-mm",
                         action="store_true",
@@ -53,7 +61,26 @@ def main():
                         "-p", action="store",
                         type=int,
                         default=1,
-                        help="# of cpus to use for featurization (Default: 1)")
+                        help="# of cpus to use for featurization. With fewer decoys than cpus, each decoy is split across them (Default: 1)")
+    parser.add_argument("--timeout",
+                        action="store",
+                        type=int,
+                        default=0,
+                        help="seconds after which featurizing a decoy fails when using multiple processes, 0 for no limit (Default: 0)")
+    parser.add_argument("--maxTasks",
+                        action="store",
+                        type=int,
+                        default=100,
+                        help="decoys a featurization process handles before it is replaced, 0 for no limit (Default: 100)")
+    parser.add_argument("--pipeline",
+                        action="store_true",
+                        default=False,
+                        help="predicting decoys as soon as they are featurized, by networks loaded once, and removing their features right after. Unless features are kept (--leavetemp, --store) or refreshed, they are handed over in shared memory and never written to disk. Not available with --multiDecoy (Default: False)")
+    parser.add_argument("--queueDepth",
+                        action="store",
+                        type=int,
+                        default=0,
+                        help="decoys featurized ahead of the prediction in the pipeline mode, which bounds the feature files on disk, 0 for twice the # of cpus (Default: 0)")
     parser.add_argument("--gpu",
                         "-g", action="store",
                         type=int,
@@ -64,10 +91,35 @@ def main():
                         action="store_true",
                         default=False,
                         help="running only featurization (Default: False)")
+    parser.add_argument("--fixedChains",
+                        "-fc", action="store",
+                        default="",
+                        help="chains that are identical in every decoy, e.g. A for a binder design target. Their intra-chain features are computed once (Default: none)")
+    parser.add_argument("--store",
+                        "-s", action="store_true",
+                        default=False,
+                        help="keeping features of all decoys in one memory mappable feature store (outfolder/features.store) instead of a .features.npz file per decoy (Default: False)")
+    parser.add_argument("--compact",
+                        "-c", action="store_true",
+                        default=False,
+                        help="saving features in the compact encoding: sparse pair channels, bitset hbonds and float16 distances (Default: False)")
+    parser.add_argument("--cache",
+                        action="store",
+                        default="",
+                        help="folder of a cache of features and predictions shared across runs. Structures with the same coordinates are taken from it instead of being featurized and predicted again (Default: none)")
+    parser.add_argument("--cacheSize",
+                        action="store",
+                        type=int,
+                        default=10000,
+                        help="size of the cache in MB, least recently used entries are removed beyond it, 0 for no limit (Default: 10000)")
     parser.add_argument("--reprocess",
                         "-r", action="store_true",
                         default=False,
                         help="reprocessing all feature files (Default: False)")
+    parser.add_argument("--refresh",
+                        "-u", action="store_true",
+                        default=False,
+                        help="recomputing only the feature groups that are missing or come from an older extractor version (Default: False)")
     args = parser.parse_args()
 
     ################################
@@ -84,11 +136,12 @@ def main():
         args.outfolder = args.outfolder[0]
 
 
-    if args.infolder.endswith('.pdb'):
+    if args.infolder.endswith('.pdb') and not args.models:
         args.pdb = True
     
     if not args.pdb:
-        if not isdir(args.infolder):
+        # Multi-structure files, list files and patterns are read like a folder holding the structures
+        if not isdir(args.infolder) and not isfile(args.infolder) and not any([c in args.infolder for c in "*?["]):
             print("Input folder does not exist.", file=sys.stderr)
             return -1
         
@@ -97,7 +150,8 @@ def main():
             args.outfolder='.'
         if not isdir(args.outfolder):
             print("Creating output folder:", args.outfolder)
-            os.mkdir(args.outfolder)
+            # Shards of an array job may create it at the same time
+            os.makedirs(args.outfolder, exist_ok=True)
     else:
         if not isfile(args.infolder):
             print("Input file does not exist.", file=sys.stderr)
@@ -144,44 +198,196 @@ def main():
     num_process = 1
     if args.process > 1:
         num_process = args.process
+    
+    if args.compact:
+        pyErrorPred.set_encoding(pyErrorPred.compact_encoding)
+
+    # Only compute the features the selected network reads
+    spec = pyErrorPred.getModelSpec(multimodel=args.multiDecoy, reference=args.reference)
+    # The reference network only reads distances, which are computed without pyrosetta
+    if all([s in pyErrorPred.pdb_feature_kinds for s in spec]):
+        featurizer = pyErrorPred.process_pdb
+    else:
+        featurizer = pyErrorPred.process
         
+    # Results of structures seen before are taken from the cache
+    cache = None
+    if args.cache != "":
+        cache = pyErrorPred.ResultCache(args.cache, args.cacheSize*2**20 if args.cacheSize > 0 else None)
+        model_identity = pyErrorPred.get_model_identity(modelpath, 2 if args.noEnsemble else 5)
+
     #########################
     # Getting samples names #
     #########################
     if not args.pdb:
-        samples = [i[:-4] for i in os.listdir(args.infolder) if isfile(args.infolder+"/"+i) and i[-4:] == ".pdb" and i[0]!="."]
-        ignored = [i[:-4] for i in os.listdir(args.infolder) if not(isfile(args.infolder+"/"+i) and i[-4:] == ".pdb" and i[0]!=".")]
+        shard = None
+        store = args.store
+        if args.pipeline and args.multiDecoy:
+            print("The multi-model option needs all decoys featurized before predicting and cannot be pipelined.", file=sys.stderr)
+            return -1
+        if args.shard != "":
+            shard = pyErrorPred.parse_shard(args.shard)
+            if args.multiDecoy:
+                print("The multi-model option needs all decoys and cannot be sharded.", file=sys.stderr)
+                return -1
+            # Every shard writes its own feature store
+            if store:
+                store = "features.shard%dof%d.store" % shard
+        files, ignored = pyErrorPred.enumerate_inputs(args.infolder)
+        # Structures are references to the models in the files, which are read when featurized
+        named = []
+        for f in files:
+            named += list(pyErrorPred.iterate_structures(f, args.models))
+        # Names are made unique before sharding, so that every shard names decoys the same way
+        try:
+            named = pyErrorPred.get_unique_names(named)
+        except ValueError as inst:
+            print(inst, file=sys.stderr)
+            return -1
+        samples = []
+        structures = {}
+        for name, structure in named:
+            if shard is None or pyErrorPred.in_shard(name, shard):
+                samples.append(name)
+                structures[name] = structure
+        # Only rosetta reads silent files
+        if any([not isinstance(x, str) and x[2] == "silent" for x in structures.values()]):
+            featurizer = pyErrorPred.process
         if args.verbose: 
             print("# samples:", len(samples))
             if len(ignored) > 0:
                 print("# files ignored:", len(ignored))
+        # Decoys with saved features, checked by one listing of the output
+        existing = pyErrorPred.list_features(args.outfolder, store)
+
+        if cache is not None:
+            feature_keys = dict([(s, cache.get_feature_key(structures[s], spec)) for s in samples])
+            prediction_keys = dict([(s, cache.get_prediction_key(feature_keys[s], model_identity)) for s in samples])
+            # Predictions of the multi-model network depend on the whole set of decoys
+            if not args.featurize and not args.multiDecoy and not args.reprocess:
+                cached = [s for s in samples if cache.fetch(prediction_keys[s], pyErrorPred.prediction_entry, join(args.outfolder, s+".npz"))]
+                samples = [s for s in samples if not s in cached]
+                if args.verbose:
+                    print("# predictions taken from the cache:", len(cached))
+            if not args.reprocess:
+                restored = [s for s in samples if not (s in existing and pyErrorPred.has_features(pyErrorPred.get_feature_path(args.outfolder, s, store), spec))
+                            and cache.fetch(feature_keys[s], pyErrorPred.feature_entry, pyErrorPred.get_feature_path(args.outfolder, s, store))]
+                existing.update(restored)
+                if args.verbose:
+                    print("# features taken from the cache:", len(restored))
 
         ##############################
         # Featurization happens here #
         ##############################
-        inputs = [join(args.infolder, s)+".pdb" for s in samples]
-        tmpoutputs = [join(args.outfolder, s)+".features.npz" for s in samples]
-        if not args.reprocess:
-            arguments = [(inputs[i], tmpoutputs[i], args.verbose) for i in range(len(inputs)) if not isfile(tmpoutputs[i])]
-            already_processed = [(inputs[i], tmpoutputs[i], args.verbose) for i in range(len(inputs)) if isfile(tmpoutputs[i])]
+        inputs = [structures[s] for s in samples]
+        tmpoutputs = [pyErrorPred.get_feature_path(args.outfolder, s, store) for s in samples]
+        sample_names = dict(zip(tmpoutputs, samples))
+        if args.refresh and not args.reprocess:
+            arguments = [(inputs[i], tmpoutputs[i], args.verbose, spec) for i in range(len(inputs)) if len(pyErrorPred.get_stale_groups(tmpoutputs[i], spec)) > 0]
+            if args.verbose: 
+                print("Refreshing", len(arguments), "samples.", len(inputs)-len(arguments), "are up to date.")
+            # Distance maps alone are recomputed in full
+            if featurizer != pyErrorPred.process_pdb:
+                featurizer = pyErrorPred.refresh
+        elif not args.reprocess:
+            processed = [samples[i] in existing and pyErrorPred.has_features(tmpoutputs[i], spec) for i in range(len(inputs))]
+            arguments = [(inputs[i], tmpoutputs[i], args.verbose, spec) for i in range(len(inputs)) if not processed[i]]
             if args.verbose: 
-                print("Featurizing", len(arguments), "samples.", len(already_processed), "are already processed.")
+                print("Featurizing", len(arguments), "samples.", sum(processed), "are already processed.")
         else:
-            arguments = [(inputs[i], tmpoutputs[i], args.verbose) for i in range(len(inputs))]
-            already_processed = [(inputs[i], tmpoutputs[i], args.verbose) for i in range(len(inputs)) if isfile(tmpoutputs[i])]
+            arguments = [(inputs[i], tmpoutputs[i], args.verbose, spec) for i in range(len(inputs))]
             if args.verbose: 
-                print("Featurizing", len(arguments), "samples.", len(already_processed), "are re-processed.")
+                print("Featurizing", len(arguments), "samples.", len([s for s in samples if s in existing]), "are re-processed.")
+
+        if featurizer != pyErrorPred.process_pdb and len(arguments) > 0:
+            # Initialize once here instead of in every worker
+            pyErrorPred.init_rosetta()
+        fixed_chains = list(args.fixedChains)
+
+        ###########################################
+        # Pipelined featurization and prediction #
+        ###########################################
+        if args.pipeline and not args.featurize:
+            queued = [sample_names[a[1]] for a in arguments]
+            # Features of the decoys featurized here are handed over in shared memory instead of
+            # files, unless they are kept or refreshed in place
+            if not args.leavetemp and not store and not (args.refresh and not args.reprocess):
+                arguments = [(a[0], pyErrorPred.get_feature_path(args.outfolder, s, pyErrorPred.memory_name))+a[2:] for a, s in zip(arguments, queued)]
+            # Workers start before the networks are loaded, which then overlaps with featurizing.
+            # They and those replacing recycled ones (--maxTasks) come from a fork server,
+            # since this process runs the threads of the tensorflow sessions by then.
+            stream = pyErrorPred.FeaturizationStream(featurizer,
+                                                     [a+(1, fixed_chains) for a in arguments],
+                                                     num_process,
+                                                     depth=args.queueDepth if args.queueDepth > 0 else 2*num_process,
+                                                     timeout=args.timeout if args.timeout > 0 else None,
+                                                     maxtasks=args.maxTasks if args.maxTasks > 0 else None,
+                                                     rosetta=featurizer != pyErrorPred.process_pdb,
+                                                     context=pyErrorPred.get_worker_context())
+            predictor = pyErrorPred.Predictor(modelpath,
+                                              noEnsemble=args.noEnsemble,
+                                              reference=args.reference,
+                                              verbose=args.verbose)
+
+            def finish(s, tmp, featurized=False):
+                try:
+                    if cache is not None and featurized:
+                        cache.put(feature_keys[s], pyErrorPred.feature_entry, tmp)
+                    predictor.predict_sample(tmp, join(args.outfolder, s+".npz"))
+                    if cache is not None:
+                        cache.put(prediction_keys[s], pyErrorPred.prediction_entry, join(args.outfolder, s+".npz"))
+                finally:
+                    if pyErrorPred.is_memory_path(tmp):
+                        pyErrorPred.release_shared(tmp)
+                # Entries of a feature store are removed with the store at the end
+                if not pyErrorPred.is_memory_path(tmp) and not args.leavetemp and not store:
+                    if args.verbose: print("Removing", tmp)
+                    os.remove(tmp)
+
+            # Decoys featurized before are predicted while the workers start on the others
+            pending = set(queued)
+            for s in samples:
+                if s in existing and not s in pending:
+                    finish(s, pyErrorPred.get_feature_path(args.outfolder, s, store))
+            for index, success in stream:
+                if success:
+                    existing.add(queued[index])
+                    finish(queued[index], arguments[index][1], featurized=True)
+            stream.report(args.verbose)
+
+            if store and not args.leavetemp:
+                pyErrorPred.clean([], args.outfolder, verbose=args.verbose, store=store)
+            return 0
 
         if num_process == 1:
-            for a in arguments:
-                pyErrorPred.process(a)
+            out = [featurizer(a+(1, fixed_chains)) for a in arguments]
+        elif len(arguments) < num_process:
+            # Fewer decoys than cpus, split each decoy across the cpus instead
+            out = [featurizer(a+(num_process, fixed_chains)) for a in arguments]
         else:
-            pool = multiprocessing.Pool(num_process)
-            out = pool.map(pyErrorPred.process, arguments)
+            out = pyErrorPred.run_featurization(featurizer,
+                                                [a+(1, fixed_chains) for a in arguments],
+                                                num_process,
+                                                timeout=args.timeout if args.timeout > 0 else None,
+                                                maxtasks=args.maxTasks if args.maxTasks > 0 else None,
+                                                rosetta=featurizer != pyErrorPred.process_pdb,
+                                                verbose=args.verbose)
+        featurized = [sample_names[arguments[i][1]] for i in range(len(arguments)) if out[i]]
+        # A decoy whose featurization failed has no usable features, even if an older file is listed
+        failed = set([sample_names[arguments[i][1]] for i in range(len(arguments)) if not out[i]])
+        existing.update(featurized)
+        if cache is not None:
+            for s in featurized:
+                cache.put(feature_keys[s], pyErrorPred.feature_entry, pyErrorPred.get_feature_path(args.outfolder, s, store))
 
         # Get distribution features
+        distribution = None
         if args.multiDecoy:
-            pyErrorPred.getDistribution(args.outfolder)
+            try:
+                distribution = pyErrorPred.getDistribution(args.outfolder, store=store, processes=num_process)
+            except ValueError as inst:
+                print(inst, file=sys.stderr)
+                return -1
 
 
         print(modelpath)
@@ -192,26 +398,38 @@ def main():
         ###########################
         # Prediction happens here #
         ###########################
-        samples = [s for s in samples if isfile(join(args.outfolder, s+".features.npz"))]
+        skipped = [s for s in samples if not s in existing or s in failed]
+        if len(skipped) > 0:
+            print("Skipping", len(skipped), "samples without features:", ", ".join(skipped[:10])+(", ..." if len(skipped) > 10 else ""), file=sys.stderr)
+        samples = [s for s in samples if s in existing and not s in failed]
+        if len(samples) == 0:
+            return 0
         pyErrorPred.predict(samples,
                             modelpath,
                             args.outfolder,
                             verbose=args.verbose,
                             multimodel=args.multiDecoy,
                             noEnsemble=args.noEnsemble,
-                            reference=args.reference)
+                            reference=args.reference,
+                            store=store,
+                            distribution=distribution)
 
         if not args.noEnsemble:
             pyErrorPred.merge(samples,
                               args.outfolder,
                               verbose=args.verbose)
 
+        if cache is not None and not args.multiDecoy:
+            for s in samples:
+                cache.put(prediction_keys[s], pyErrorPred.prediction_entry, join(args.outfolder, s+".npz"))
+
         if not args.leavetemp:
             pyErrorPred.clean(samples,
                               args.outfolder,
                               verbose=args.verbose,
                               multimodel=args.multiDecoy,
-                              noEnsemble=args.noEnsemble)
+                              noEnsemble=args.noEnsemble,
+                              store=store)
             
     # Processing for single sample
     else:
@@ -221,35 +439,56 @@ def main():
         insamplename = infilepath.split("/")[-1][:-4]
         outfolder = "/".join(outfilepath.split("/")[:-1])
         outsamplename = outfilepath.split("/")[-1][:-4]
-        feature_file_name = join(outfolder, outsamplename+".features.npz")
+        feature_file_name = pyErrorPred.get_feature_path(outfolder, outsamplename, args.store)
         if args.verbose: 
             print("only working on a file:", outfolder, outsamplename)
         # Process if file does not exists or reprocess flag is set
         
-        if (not isfile(feature_file_name)) or args.reprocess:
-            pyErrorPred.process((join(infolder, insamplename+".pdb"),
-                                feature_file_name,
-                                args.verbose))   
-        if isfile(feature_file_name):
+        if cache is not None:
+            feature_key = cache.get_feature_key(infilepath, spec)
+            prediction_key = cache.get_prediction_key(feature_key, model_identity)
+            if not args.reprocess:
+                if cache.fetch(prediction_key, pyErrorPred.prediction_entry, outfilepath):
+                    if args.verbose: print("Prediction taken from the cache")
+                    return 0
+                if not pyErrorPred.has_features(feature_file_name, spec):
+                    cache.fetch(feature_key, pyErrorPred.feature_entry, feature_file_name)
+
+        if args.refresh and not args.reprocess and featurizer != pyErrorPred.process_pdb:
+            featurizer = pyErrorPred.refresh
+        if (not pyErrorPred.has_features(feature_file_name, spec)) or args.reprocess or (args.refresh and len(pyErrorPred.get_stale_groups(feature_file_name, spec)) > 0):
+            featurizer((infilepath,
+                        feature_file_name,
+                        args.verbose,
+                        spec,
+                        num_process))
+            if cache is not None:
+                cache.put(feature_key, pyErrorPred.feature_entry, feature_file_name)
+        if pyErrorPred.feature_exists(feature_file_name):
             pyErrorPred.predict([outsamplename],
                     modelpath,
                     outfolder,
                     verbose=args.verbose,
                     multimodel=False,
                     noEnsemble=args.noEnsemble,
-                    reference=args.reference)
+                    reference=args.reference,
+                    store=args.store)
             
             if not args.noEnsemble:
                 pyErrorPred.merge([outsamplename],
                                   outfolder,
                                   verbose=False)
 
+            if cache is not None:
+                cache.put(prediction_key, pyErrorPred.prediction_entry, outfilepath)
+
             if not args.leavetemp:
                 pyErrorPred.clean([outsamplename],
                                   outfolder,
                                   verbose=args.verbose,
                                   multimodel=False,
-                                  noEnsemble=args.noEnsemble)
+                                  noEnsemble=args.noEnsemble,
+                                  store=args.store)
         else:
             print(f"Feature file does not exist: {feature_file_name}", file=sys.stderr)
 if __name__== "__main__":
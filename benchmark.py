@@ -0,0 +1,150 @@
+import argparse
+import time
+import tracemalloc
+import numpy as np
+
+import sys
+sys.path.insert(0, "./")
+import pyErrorPred
+
+# Runs f and returns its output and wall clock time in seconds
+def timed(f, *args, **kwargs):
+    start_time = time.time()
+    output = f(*args, **kwargs)
+    return output, time.time()-start_time
+
+# Runs f and returns its output, wall clock time and peak traced memory in MB
+def profiled(f, *args, **kwargs):
+    tracemalloc.start()
+    output, seconds = timed(f, *args, **kwargs)
+    peak = tracemalloc.get_traced_memory()[1]/2**20
+    tracemalloc.stop()
+    return output, seconds, peak
+
+# Vectorized euler orientations against the get_residue_pair_rt6 loop
+def bench_euler(filename, pose, pdict):
+    new, t_new = timed(pyErrorPred.getEulerOrientation, pose, pdict['atoms'], use_rt6=False)
+    old, t_old = timed(pyErrorPred.getEulerOrientation, pose, pdict['atoms'], use_rt6=True)
+    # The network only sees sin and cos of these values
+    diff = max(np.max(np.abs(np.sin(new)-np.sin(old))), np.max(np.abs(np.cos(new)-np.cos(old))))
+    print("  euler: rt6 %0.3fs, vectorized %0.3fs, max sin/cos difference %0.2e" % (t_old, t_new, diff))
+
+# One body energies parsed from energy strings (the previous featurization path)
+def one_body_from_strings(pose, score_terms):
+    energy_obj = pose.energies()
+    output = []
+    for pos in range(1, len(pose.sequence())+1):
+        energy_dict = pyErrorPred.energy_string_to_dict(pyErrorPred.get_energy_string_quick(energy_obj, pos))
+        output.append([energy_dict[term] for term in score_terms])
+    return np.array(output).T
+
+# Direct energy map access against the energy string round trip
+def bench_onebody(filename, pose, pdict):
+    score_terms = ["p_aa_pp", "rama_prepro", "omega", "fa_dun"]
+    new, t_new = timed(pyErrorPred.get_one_body_energies, pose, score_terms)
+    old, t_old = timed(one_body_from_strings, pose, score_terms)
+    print("  onebody: strings %0.3fs, direct %0.3fs, max difference %0.2e" % (t_old, t_new, np.max(np.abs(new-old))))
+
+# Time and peak memory of the neighbor searches and the 3D voxelization
+def bench_neighbors(filename, pose, pdict):
+    _, t_6d, m_6d = profiled(pyErrorPred.set_neighbors6D, pdict)
+    _, t_3d, m_3d = profiled(pyErrorPred.set_neighbors3D, pdict)
+    print("  neighbors6D: %0.3fs, peak %0.1f MB" % (t_6d, m_6d))
+    print("  neighbors3D: %0.3fs, peak %0.1f MB, %d voxel entries" % (t_3d, m_3d, pdict['idx'].shape[0]))
+
+# Rosetta free pdb featurization against process(), channel by channel
+def bench_pdb(filename, pose, pdict):
+    atoms, t_parse = timed(pyErrorPred.read_pdb, filename)
+    new, t_new = timed(pyErrorPred.featurize_pdb, atoms)
+    old, t_old = timed(pyErrorPred.featurize, pose, pyErrorPred.pdb_feature_kinds)
+    names = pdict['atoms']['rname']
+    if atoms['nres'] != len(names):
+        print("  pdb: %d residues, pose has %d" % (atoms['nres'], len(names)))
+        return
+    mismatches = [(i, names[i], atoms['rname'][i]) for i in range(len(names)) if names[i] != atoms['rname'][i]]
+    print("  pdb: rosetta %0.3fs, numpy %0.3fs (parsing %0.3fs), %d residue names differ" % (t_old, t_parse+t_new, t_parse, len(mismatches)))
+    for i, a, b in mismatches:
+        print("    residue %d: %s / %s" % (i+1, a, b))
+    print("    tbt distance: max difference %0.2e" % np.max(np.abs(new['tbt'][0]-old['tbt'][0])))
+    for c, channel in enumerate(["CB-CB", "tip-tip", "CA-tip", "tip-CA"]):
+        print("    maps %s: max difference %0.2e" % (channel, np.max(np.abs(new['maps'][:,:,c]-old['maps'][:,:,c]))))
+
+# Incremental featurization of a point mutant against featurizing it from scratch
+def bench_refeaturize(filename, pose, pdict, position=None):
+    parent = pyErrorPred.featurize(pose)
+    position = pose.size()//2 if position is None else position
+    mutant = pose.clone()
+    pyErrorPred.pyrosetta.rosetta.protocols.simple_moves.MutateResidue(position, "ALA").apply(mutant)
+    new, t_new = timed(pyErrorPred.refeaturize, parent, [position-1], mutant.clone())
+    old, t_old = timed(pyErrorPred.featurize, mutant.clone())
+    print("  refeaturize: full %0.3fs, incremental %0.3fs (residue %d to ALA)" % (t_old, t_new, position))
+    for k in sorted(old.keys()):
+        if k == "idx" or k == "val":
+            continue
+        print("    %s: max difference %0.2e" % (k, np.max(np.abs(new[k]-old[k]))))
+    print("    voxels: %d incremental, %d full entries, value sums differ by %0.2e" % (new['val'].shape[0], old['val'].shape[0],
+          abs(np.sum(new['val'], dtype=np.float64)-np.sum(old['val'], dtype=np.float64))))
+
+# Dense float64 pair maps against the blocked float32 ones of the large structure mode
+def bench_large(filename, pose, pdict):
+    dense, t_dense, m_dense = profiled(pyErrorPred.featurize, pose.clone())
+    blocked, t_blocked, m_blocked = profiled(pyErrorPred.featurize, pose.clone(), block=pyErrorPred.large_block)
+    diff = max([np.max(np.abs(dense[k]-blocked[k])) for k in dense.keys() if k != "idx" and k != "val"])
+    print("  large: dense %0.3fs, peak %0.1f MB; blocked %0.3fs, peak %0.1f MB; max difference %0.2e" % (t_dense, m_dense, t_blocked, m_blocked, diff))
+
+# One decoy featurized by one process against splitting its pair features across processes
+def bench_parallel(filename, pose, pdict, processes=4):
+    serial, t_serial = timed(pyErrorPred.featurize, pose.clone())
+    parallel, t_parallel = timed(pyErrorPred.featurize, pose.clone(), processes=processes)
+    same = all([np.array_equal(serial[k], parallel[k]) for k in serial.keys() if k != "idx" and k != "val"])
+    print("  parallel: 1 process %0.3fs, %d processes %0.3fs, identical pair maps: %s" % (t_serial, processes, t_parallel, same))
+
+# Second decoy with the same first chain against featurizing it from scratch
+def bench_fixed(filename, pose, pdict):
+    chains = list(dict.fromkeys(pdict['atoms']['chain']))
+    if len(chains) < 2:
+        print("  fixed: needs a complex with more than one chain")
+        return
+    pyErrorPred.featurize_fixed(pose.clone(), chains[:1])
+    new, t_new = timed(pyErrorPred.featurize_fixed, pose.clone(), chains[:1])
+    old, t_old = timed(pyErrorPred.featurize, pose.clone())
+    diff = max([np.max(np.abs(new[k]-old[k])) for k in old.keys() if k != "idx" and k != "val"])
+    print("  fixed: full %0.3fs, chain %s cached %0.3fs, max difference %0.2e" % (t_old, chains[0], t_new, diff))
+
+benchmarks = {"euler": bench_euler,
+              "neighbors": bench_neighbors,
+              "onebody": bench_onebody,
+              "parallel": bench_parallel,
+              "fixed": bench_fixed,
+              "large": bench_large,
+              "pdb": bench_pdb,
+              "refeaturize": bench_refeaturize}
+
+def main():
+    parser = argparse.ArgumentParser(description="Error predictor featurization benchmarks",
+                                     epilog="v0.0.1")
+    parser.add_argument("pdbs",
+                        action="store",
+                        nargs="+",
+                        help="pdb files to run the benchmarks on")
+    parser.add_argument("--benchmark",
+                        "-b",
+                        action="append",
+                        choices=sorted(benchmarks.keys()),
+                        help="benchmark to run, can be given multiple times (Default: all)")
+    args = parser.parse_args()
+    names = args.benchmark if args.benchmark else sorted(benchmarks.keys())
+
+    pyErrorPred.init_rosetta()
+    for filename in args.pdbs:
+        pose = pyErrorPred.Pose()
+        pyErrorPred.pose_from_file(pose, filename)
+        pyErrorPred.get_scorefxn()(pose)
+        pdict = pyErrorPred.init_pose(pose)
+        print(filename, "(%d residues)" % pose.size())
+        for name in names:
+            benchmarks[name](filename, pose, pdict)
+    return 0
+
+if __name__== "__main__":
+    main()
@@ -1,9 +1,22 @@
 from .analyze import *
-from .dataProcessingUtils import *
+from .conversion import *
+from .featureIO import *
+from .geometry import *
+from .pdbUtils import *
+from .resultCache import *
+from .structureIO import *
+from .featurePool import *
+try:
+    from .dataProcessingUtils import *
+    from .pyprotein import *
+    from .featurize import *
+except ImportError as e:
+    # pyrosetta is not installed, only rosetta free featurization (pdbUtils) is available.
+    # Any other import error is a broken install and is raised.
+    if (e.name or "").split(".")[0] != "pyrosetta":
+        raise
 from .deepLearningUtils import *
 from .resnet import *
 from .model import *
-from .pyprotein import *
-from .featurize import *
 from .predict import*
 from .layers import*
\ No newline at end of file
@@ -1,9 +1,9 @@
 import os
-import tensorflow as tf
 import numpy as np
 import sys
 from os import listdir
 from os.path import isfile, join
+from .featureIO import *
 
 class dataloader:
     
@@ -73,40 +73,22 @@ class dataloader:
         if pindex == -1:
             pindex = np.random.choice(np.arange(self.n[pname]))
         sample = self.samples_dict[pname][pindex]
-        psize = self.sizes[pname]
-        data = np.load(self.datadir+pname+"/"+sample+".npz")
-        
-        # 3D information
-        idx = data["idx"]
-        val = data["val"]
-        
-        # 1D information
-        angles = np.stack([np.sin(data["phi"]), np.cos(data["phi"]), np.sin(data["psi"]), np.cos(data["psi"])], axis=-1)
-        obt = data["obt"].T
-        prop = data["prop"].T
-        
-        # 2D information
-        orientations = np.stack([data["omega6d"], data["theta6d"], data["phi6d"]], axis=-1)
-        orientations = np.concatenate([np.sin(orientations), np.cos(orientations)], axis=-1)
-        euler = np.concatenate([np.sin(data["euler"]), np.cos(data["euler"])], axis=-1)
-        maps = data["maps"]
-        tbt = data["tbt"].T
-        sep = seqsep(psize)
-        
-        if self.include_native_dist:
-            dist = np.load(self.datadir+pname+"/dist.npy")
+        data = load_features(self.datadir+pname+"/"+sample+".npz")
+        if self.distribution:
+            if self.include_native_dist:
+                dist = np.load(self.datadir+pname+"/dist.npy")
+            else:
+                dist = np.load(self.datadir+pname+"/dist2.npy")
         else:
-            dist = np.load(self.datadir+pname+"/dist2.npy")
+            dist = None
         
         # Get target
         lddt = np.genfromtxt(self.datadir+pname+"/"+sample+".lddt.csv", skip_header=11)[:,4]
         native = np.load(self.datadir+pname+"/native.npz")["tbt"][0]
-        estogram = get_estogram((tbt[:,:,0], native), self.digitization1)
+        estogram = get_estogram((data["tbt"][0].T, native), self.digitization1)
         
-        # Transform input distance
-        if transform:
-            tbt[:,:,0] = f(tbt[:,:,0])
-            maps = f(maps, cutoff=self.distance_cutoff)
+        # Network inputs, with the input distances transformed
+        f3d, f1d, f2d = assemble_features(data, dist, transform, self.distance_cutoff)
         
         self.cur_index += 1
         if self.cur_index == len(self.proteins):        
@@ -114,24 +96,45 @@ class dataloader:
             np.random.shuffle(self.index)
             
         if self.verbose:
-            print(angles.shape, obt.shape, prop.shape)
-            print(tbt.shape, maps.shape, euler.shape, orientations.shape, sep.shape)
+            print(f1d.shape, f2d.shape)
             
-        if self.distribution:
-            return (idx, val),\
-                    np.concatenate([angles, obt, prop], axis=-1),\
-                    np.concatenate([tbt, maps, euler, orientations, sep, dist], axis=-1),\
-                    (lddt, estogram, native)
-        else:
-            return (idx, val),\
-                    np.concatenate([angles, obt, prop], axis=-1),\
-                    np.concatenate([tbt, maps, euler, orientations, sep], axis=-1),\
-                    (lddt, estogram, native)
+        return f3d, f1d, f2d, (lddt, estogram, native)
         
 def f(X, cutoff=6, scaling=3.0):
     X_prime = np.maximum(X, np.zeros_like(X) + cutoff) - cutoff
     return np.arcsinh(X_prime)/scaling
 
+# In place version of f
+def transform_inplace(X, cutoff=6, scaling=3.0):
+    np.subtract(X, cutoff, out=X)
+    np.maximum(X, 0, out=X)
+    np.arcsinh(X, out=X)
+    np.divide(X, scaling, out=X)
+    return X
+
+# Bins of the transformed input distances in the multi-decoy distribution
+distribution_bins = np.arange(0.25,5.1,0.25)
+
+# In: feature files, Out: (nres, nres, 21) counts of their transformed input distances
+# in distribution_bins and the number of decoys counted (None, 0 without decoys).
+# Decoys are folded in one at a time, without one-hot arrays.
+def accumulate_distribution(files):
+    counts = None
+    n = 0
+    for filename in files:
+        tbt = load_tbt_channel(filename, 0)
+        if counts is None:
+            counts = np.zeros(tbt.shape+(len(distribution_bins)+1,), dtype=np.int32)
+            # Index of the first bin of every pair in the flattened counts
+            offsets = np.arange(tbt.size)*counts.shape[-1]
+        elif tbt.shape != counts.shape[:2]:
+            print("All pdbs in the input folder need to have the same size.", filename, "is skipped.")
+            continue
+        binned = np.digitize(f(tbt, cutoff=6, scaling=1.0), distribution_bins)
+        counts.reshape(-1)[offsets+binned.reshape(-1)] += 1
+        n += 1
+    return counts, n
+
 def get_estogram(XY, digitization):
     (X,Y) = XY
     residual = X-Y
@@ -140,12 +143,92 @@ def get_estogram(XY, digitization):
 
 # Sequence separtion features
 def seqsep(psize, normalizer=100, axis=-1):
-    ret = np.ones((psize, psize))
-    for i in range(psize):
-        for j in range(psize):
-            ret[i,j] = abs(i-j)*1.0/100-1.0
+    index = np.arange(psize)
+    ret = np.abs(index[:,None]-index[None,:])*1.0/normalizer-1.0
     return np.expand_dims(ret, axis)
 
+# seqsep of the static_cache_size last protein lengths, it only depends on the length
+static_cache_size = 8
+_static_seqsep = {}
+
+# In: protein length, Out: read-only float32 (nres, nres) seqsep as fed to the network,
+# computed once per length.
+def get_static_seqsep(nres):
+    if not nres in _static_seqsep:
+        if len(_static_seqsep) >= static_cache_size:
+            del _static_seqsep[next(iter(_static_seqsep))]
+        sep = seqsep(nres)[:,:,0].astype(np.float32)
+        sep.flags.writeable = False
+        _static_seqsep[nres] = sep
+    return _static_seqsep[nres]
+
+# Pools of float32 (nres, nres, channels) buffers that assemble_features writes
+# 2D inputs into, buffer_pool_size per shape for the buffer_pool_shapes last shapes.
+# A buffer is handed out again buffer_pool_size calls later, so the previous
+# input stays valid while the next one is assembled.
+buffer_pool_size = 2
+buffer_pool_shapes = 4
+_buffers = {}
+
+def get_buffer(shape):
+    if not shape in _buffers:
+        if len(_buffers) >= buffer_pool_shapes:
+            del _buffers[next(iter(_buffers))]
+        _buffers[shape] = [[np.empty(shape, dtype=np.float32) for i in range(buffer_pool_size)], 0]
+    pool = _buffers[shape]
+    buffer = pool[0][pool[1]]
+    pool[1] = (pool[1]+1) % buffer_pool_size
+    return buffer
+
+# Writes the network inputs of one decoy straight into float32 arrays, every
+# channel is transformed in place in its slot instead of being stacked and concatenated.
+# In: feature arrays (see load_features), multi-decoy distance distribution (or None),
+# whether to transform input distances and the cutoff of the maps transformation.
+# Out: (idx, val), 1D input (nres, 70) and 2D input (nres, nres, 33 or 54) from the buffer pool.
+def assemble_features(data, dist=None, transform=True, distance_cutoff=6):
+    phi = data["phi"]
+    psi = data["psi"]
+    obt = data["obt"]
+    prop = data["prop"]
+    nres = len(phi)
+    
+    # 1D information
+    f1d = np.empty((nres, 4+obt.shape[0]+prop.shape[0]), dtype=np.float32)
+    np.sin(phi, out=f1d[:,0])
+    np.cos(phi, out=f1d[:,1])
+    np.sin(psi, out=f1d[:,2])
+    np.cos(psi, out=f1d[:,3])
+    f1d[:,4:4+obt.shape[0]] = obt.T
+    f1d[:,4+obt.shape[0]:] = prop.T
+    
+    # 2D information
+    tbt = data["tbt"]
+    maps = data["maps"]
+    euler = data["euler"]
+    c_maps = tbt.shape[0]
+    c_euler = c_maps+maps.shape[-1]
+    c_6d = c_euler+2*euler.shape[-1]
+    c_sep = c_6d+6
+    channels = c_sep+1+(0 if dist is None else dist.shape[-1])
+    f2d = get_buffer((nres, nres, channels))
+    # tbt is stored (channels, nres, nres) and enters the network transposed
+    f2d[:,:,:c_maps] = tbt.T
+    f2d[:,:,c_maps:c_euler] = maps
+    if transform:
+        transform_inplace(f2d[:,:,0])
+        transform_inplace(f2d[:,:,c_maps:c_euler], cutoff=distance_cutoff)
+    np.sin(euler, out=f2d[:,:,c_euler:c_euler+euler.shape[-1]])
+    np.cos(euler, out=f2d[:,:,c_euler+euler.shape[-1]:c_6d])
+    for i, k in enumerate(["omega6d", "theta6d", "phi6d"]):
+        x = data[k]
+        np.sin(x, out=f2d[:,:,c_6d+i])
+        np.cos(x, out=f2d[:,:,c_6d+3+i])
+    f2d[:,:,c_sep] = get_static_seqsep(nres)
+    if dist is not None:
+        f2d[:,:,c_sep+1:] = dist
+    
+    return (data["idx"], data["val"]), f1d, f2d
+
 def apply_label_smoothing(x, alpha=0.2, axis=-1):
     minind = 0
     maxind = x.shape[axis]-1
@@ -162,10 +245,12 @@ def apply_label_smoothing(x, alpha=0.2, axis=-1):
     
     return true+semi_lower+semi_higher
 
+# Feature names and sizes in the order of the network inputs
+feature2D = [("distance",1), ("rosetta",9), ("distance",4), ("orientation",18), ("seqsep",1)]
+feature1D = [("angles",10), ("rosetta",4), ("ss",4), ("aa", 52)]
+
 # Getting masks
 def getMask(exclude):
-    feature2D = [("distance",1), ("rosetta",9), ("distance",4), ("orientation",18), ("seqsep",1)]
-    feature1D = [("angles",10), ("rosetta",4), ("ss",4), ("aa", 52)]
     for e in exclude:
         if e not in [i[0] for i in feature2D] and e not in [i[0] for i in feature1D]:
             print("Feature names do not exist.")
@@ -187,4 +272,21 @@ def getMask(exclude):
             if f[0] in exclude: temp.append(index)
             index+=1
     mask.append(temp)
-    return mask
\ No newline at end of file
+    return mask
+
+# Getting the feature spec (kinds of features to compute) of a network
+# given its masks (see getMask) and whether it skips the 3d convolution.
+def getFeatureSpec(masks=None, ignore3dconv=False):
+    if masks is None:
+        masks = [[], []]
+    spec = ["distance"]
+    for features, mask in [(feature1D, masks[0]), (feature2D, masks[1])]:
+        index = 0
+        for f in features:
+            used = [i for i in range(index, index+f[1]) if not i in mask]
+            if len(used) > 0 and f[0] in feature_kinds and not f[0] in spec:
+                spec.append(f[0])
+            index += f[1]
+    if not ignore3dconv:
+        spec.append("3d")
+    return spec
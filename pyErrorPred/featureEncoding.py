@@ -0,0 +1,154 @@
+import numpy as np
+
+# Compact encoding of feature files.
+# Most of the pair data is zeros: the 6D maps are only filled within 20A, the energy
+# channels of tbt only on energy graph edges and the hbond channels are binary.
+#   maps, tbt distances     float16
+#   tbt energy channels     COO: flat pair index and float32 values of the non-zero pairs
+#   tbt binary channels     bitsets (np.packbits of the flattened channel)
+#   omega6d/theta6d/phi6d   COO with one shared pair index
+#   euler                   float32
+#   idx                     (residue, x, y, z, type) packed into one integer
+# Values are stored at the float32 precision the network is fed with, except for
+# distances, which go through the transformer (see predict.transfomer) first.
+# Arrays are decoded one at a time when they are first read (see CompactFeatures),
+# single tbt channels without the others (see CompactFeatures.tbt_channel).
+
+# Value of the "encoding" metadata array of compact files
+compact_encoding = "compact"
+
+# In: number of pairs (or voxels), Out: smallest unsigned integer type indexing them
+def get_index_dtype(size):
+    return np.uint32 if size <= 2**32 else np.uint64
+
+# In: (channels, nres*nres) array, Out: flat index of the pairs non-zero in any channel
+def get_nonzero_pairs(x):
+    return np.flatnonzero(np.any(x != 0, axis=0)).astype(get_index_dtype(x.shape[-1]))
+
+# In: dictionary of feature arrays (see featurize.featurize), Out: dictionary of encoded arrays
+def encode_features(features):
+    encoded = {}
+    for k, v in features.items():
+        if k in ["maps", "euler"] or k in decoders:
+            continue
+        encoded[k] = v
+
+    if "maps" in features:
+        encoded["maps"] = features["maps"].astype(np.float16)
+    if "euler" in features:
+        encoded["euler"] = features["euler"].astype(np.float32)
+
+    if "tbt" in features:
+        tbt = features["tbt"]
+        nres = tbt.shape[-1]
+        channels = tbt[1:].reshape(tbt.shape[0]-1, nres*nres)
+        binary = [c for c in range(channels.shape[0]) if np.all((channels[c] == 0) | (channels[c] == 1))]
+        energies = [c for c in range(channels.shape[0]) if not c in binary]
+        pairs = get_nonzero_pairs(channels[energies])
+        encoded["tbt.shape"] = np.array(tbt.shape)
+        encoded["tbt.distance"] = tbt[0].astype(np.float16)
+        encoded["tbt.binary"] = np.array(binary, dtype=np.uint8)
+        encoded["tbt.bits"] = np.packbits(channels[binary] != 0, axis=-1)
+        encoded["tbt.pairs"] = pairs
+        encoded["tbt.values"] = channels[energies][:, pairs].T.astype(np.float32)
+
+    if all([k in features for k in ["omega6d", "theta6d", "phi6d"]]):
+        nres = features["omega6d"].shape[-1]
+        maps6d = np.stack([features[k].reshape(nres*nres) for k in ["omega6d", "theta6d", "phi6d"]])
+        pairs = get_nonzero_pairs(maps6d)
+        encoded["6d.nres"] = np.array(nres)
+        encoded["6d.pairs"] = pairs
+        encoded["6d.values"] = maps6d[:, pairs].T.astype(np.float32)
+
+    if "idx" in features:
+        idx = features["idx"].astype(np.uint64)
+        # Mixed radix of (residue, x, y, z, type), the grid size is that of geometry.voxelize
+        radix = np.array([24, 24, 24, int(idx[:,4].max())+1 if len(idx) > 0 else 1], dtype=np.uint64)
+        packed = idx[:,0]
+        for c in range(4):
+            packed = packed*radix[c] + idx[:,c+1]
+        nres = int(idx[:,0].max())+1 if len(idx) > 0 else 0
+        encoded["idx.radix"] = radix
+        encoded["idx.packed"] = packed.astype(get_index_dtype(nres*int(np.prod(radix))))
+    return encoded
+
+def decode_tbt(data):
+    shape = tuple(data["tbt.shape"])
+    nres = shape[-1]
+    channels = np.zeros((shape[0]-1, nres*nres), dtype=np.float32)
+    binary = data["tbt.binary"]
+    if len(binary) > 0:
+        channels[binary] = np.unpackbits(data["tbt.bits"], axis=-1, count=nres*nres)
+    energies = [c for c in range(shape[0]-1) if not c in binary]
+    channels[np.ix_(energies, data["tbt.pairs"])] = data["tbt.values"].T
+    return np.concatenate([data["tbt.distance"].astype(np.float32)[None], channels.reshape(shape[0]-1, nres, nres)])
+
+# Out: (nres, nres) float32 of one tbt channel, decoded without the other channels
+def decode_tbt_channel(data, channel):
+    shape = tuple(data["tbt.shape"])
+    nres = shape[-1]
+    if channel == 0:
+        return data["tbt.distance"].astype(np.float32)
+    binary = list(data["tbt.binary"])
+    if channel-1 in binary:
+        bits = data["tbt.bits"][binary.index(channel-1)]
+        return np.unpackbits(bits, count=nres*nres).astype(np.float32).reshape(nres, nres)
+    energies = [c for c in range(shape[0]-1) if not c in binary]
+    x = np.zeros(nres*nres, dtype=np.float32)
+    x[data["tbt.pairs"]] = data["tbt.values"][:, energies.index(channel-1)]
+    return x.reshape(nres, nres)
+
+def decode_6d(data, channel):
+    nres = int(data["6d.nres"])
+    x = np.zeros(nres*nres, dtype=np.float32)
+    x[data["6d.pairs"]] = data["6d.values"][:, channel]
+    return x.reshape(nres, nres)
+
+def decode_idx(data):
+    packed = data["idx.packed"].astype(np.uint64)
+    radix = data["idx.radix"]
+    idx = np.empty((len(packed), 5), dtype=np.uint16)
+    for c in range(3, -1, -1):
+        idx[:,c+1] = packed % radix[c]
+        packed = packed // radix[c]
+    idx[:,0] = packed
+    return idx
+
+# Feature name -> (encoded arrays it is decoded from, decoder)
+decoders = {"tbt": (["tbt.shape", "tbt.distance", "tbt.binary", "tbt.bits", "tbt.pairs", "tbt.values"], decode_tbt),
+            "omega6d": (["6d.nres", "6d.pairs", "6d.values"], lambda data: decode_6d(data, 0)),
+            "theta6d": (["6d.nres", "6d.pairs", "6d.values"], lambda data: decode_6d(data, 1)),
+            "phi6d": (["6d.nres", "6d.pairs", "6d.values"], lambda data: decode_6d(data, 2)),
+            "idx": (["idx.radix", "idx.packed"], decode_idx)}
+
+# Arrays of a compact feature file (an NpzFile or StoredFeatures) under their feature names.
+# Exposes files like np.load does, arrays are decoded when they are first read.
+class CompactFeatures:
+    def __init__(self, data):
+        self.data = data
+        self.decoded = {}
+        encoded = set([a for arrays, _ in decoders.values() for a in arrays])
+        self.files = [k for k in data.files if not k in encoded]
+        self.files += [k for k in decoders if all([a in data.files for a in decoders[k][0]])]
+
+    def __contains__(self, key):
+        return key in self.files
+
+    def __getitem__(self, key):
+        if not key in self.decoded:
+            if key in decoders:
+                self.decoded[key] = decoders[key][1](self.data)
+            elif key in ["maps", "euler"]:
+                self.decoded[key] = self.data[key].astype(np.float32)
+            else:
+                self.decoded[key] = self.data[key]
+        return self.decoded[key]
+
+    def keys(self):
+        return list(self.files)
+
+    # Out: one channel of tbt, decoded alone unless all of tbt already is
+    def tbt_channel(self, channel):
+        if "tbt" in self.decoded:
+            return self.decoded["tbt"][channel]
+        return decode_tbt_channel(self.data, channel)
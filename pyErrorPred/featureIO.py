@@ -0,0 +1,217 @@
+import numpy as np
+import os
+from os.path import isfile, isdir, join, dirname, basename
+from .featureStore import *
+from .featureEncoding import *
+from .sharedFeatures import *
+
+# Kinds of features the featurizer can compute. A feature spec is a list of them.
+# Names follow getMask, with "3d" standing for the voxel grids of the 3d convolution.
+feature_kinds = ["distance", "rosetta", "orientation", "angles", "ss", "aa", "3d"]
+
+# Groups of arrays in .features.npz files, each computed by one extractor,
+# and the feature kinds that need them (maps and tbt are always computed).
+feature_groups = {"maps": (["maps"], []),
+                  "tbt": (["tbt"], []),
+                  "voxels": (["idx", "val"], ["3d"]),
+                  "phipsi": (["phi", "psi"], ["angles"]),
+                  "6d": (["omega6d", "theta6d", "phi6d"], ["orientation"]),
+                  "euler": (["euler"], ["orientation"]),
+                  "obt": (["obt"], ["angles", "rosetta", "ss"]),
+                  "prop": (["prop"], ["aa"])}
+
+# Version of the extractor of every group. Bump it whenever the extractor
+# changes its output, so that refreshing recomputes that group only.
+feature_versions = {"maps": 1,
+                    "tbt": 1,
+                    "voxels": 1,
+                    "phipsi": 1,
+                    "6d": 1,
+                    "euler": 1,
+                    "obt": 1,
+                    "prop": 1}
+
+# Arrays of .features.npz files that are not features
+metadata_keys = ["spec", "groups", "versions", "encoding"]
+
+# Encoding of newly saved features, "dense" or "compact" (see featureEncoding)
+feature_encodings = ["dense", compact_encoding]
+_encoding = "dense"
+
+def set_encoding(encoding):
+    global _encoding
+    if not encoding in feature_encodings:
+        raise ValueError("Unknown feature encoding: "+encoding)
+    _encoding = encoding
+
+def get_encoding():
+    return _encoding
+
+# Name of the feature store in an output folder (see get_feature_path)
+store_name = "features.store"
+
+# In: output folder and store (True for store_name or the name of a *.store folder),
+# Out: folder of the FeatureStore
+def get_store_folder(outfolder, store=True):
+    return join(outfolder, store if isinstance(store, str) else store_name)
+
+# In: output folder and decoy name, Out: where its features are kept.
+# With store, features are entries of the FeatureStore <outfolder>/features.store (see get_store_folder),
+# addressed as <outfolder>/features.store/<name>, otherwise <outfolder>/<name>.features.npz files.
+# With store set to memory_name, they are handed over in shared memory (see sharedFeatures).
+def get_feature_path(outfolder, name, store=False):
+    if store:
+        return join(get_store_folder(outfolder, store), name)
+    return join(outfolder, name+".features.npz")
+
+# In: output folder and store (see get_feature_path), Out: set of decoy names with saved features.
+# Lists the folder once instead of checking every decoy.
+def list_features(outfolder, store=False):
+    if store == memory_name:
+        return set()
+    if store:
+        folder = get_store_folder(outfolder, store)
+        return set(get_store(folder).names()) if isdir(folder) else set()
+    suffix = ".features.npz"
+    with os.scandir(outfolder) as entries:
+        return set([e.name[:-len(suffix)] for e in entries if e.name.endswith(suffix)])
+
+# Paths inside a directory named *.store are entries of a FeatureStore
+def is_store_path(filename):
+    return basename(dirname(filename)).endswith(".store")
+
+# Paths inside features.memory are features in shared memory
+def is_memory_path(filename):
+    return basename(dirname(filename)) == memory_name
+
+# Returns True if features were saved at filename
+def feature_exists(filename):
+    if is_store_path(filename):
+        return get_store(dirname(filename)).has(basename(filename))
+    if is_memory_path(filename):
+        return has_shared(filename)
+    return isfile(filename)
+
+# Opens the features at filename, Out: arrays by name (an NpzFile, StoredFeatures or
+# CompactFeatures decoding them on access)
+def open_features(filename):
+    if is_store_path(filename):
+        data = get_store(dirname(filename)).load(basename(filename))
+    elif is_memory_path(filename):
+        data = load_shared(filename)
+    else:
+        data = np.load(filename)
+    if "encoding" in data.files and str(data["encoding"]) == compact_encoding:
+        return CompactFeatures(data)
+    return data
+
+# In: feature file and tbt channel, Out: (nres, nres) array of that channel.
+# Compact files only decode that channel, e.g. the distances of getDistribution.
+def load_tbt_channel(filename, channel=0):
+    data = open_features(filename)
+    if isinstance(data, CompactFeatures):
+        return data.tbt_channel(channel)
+    return data["tbt"][channel]
+
+# In: feature spec, Out: groups computed for it
+def get_groups(spec=feature_kinds):
+    return [g for g in feature_groups if len(feature_groups[g][1]) == 0 or any([k in spec for k in feature_groups[g][1]])]
+
+# Saves features computed for spec into a .features.npz file, a feature store entry or shared memory.
+# Every group present is stamped with the current version of its extractor.
+# Features are encoded as set by set_encoding unless encoding is given.
+def save_features(outfile, features, spec=feature_kinds, encoding=None):
+    encoding = _encoding if encoding is None else encoding
+    groups = [g for g in feature_groups if all([k in features for k in feature_groups[g][0]])]
+    metadata = {"spec": np.array(spec),
+                "groups": np.array(groups),
+                "versions": np.array([feature_versions[g] for g in groups])}
+    if encoding == compact_encoding:
+        metadata["encoding"] = np.array(encoding)
+        features = encode_features(features)
+    if is_store_path(outfile):
+        metadata.update(features)
+        get_store(dirname(outfile)).write(basename(outfile), metadata)
+    elif is_memory_path(outfile):
+        metadata.update(features)
+        write_shared(outfile, metadata)
+    else:
+        np.savez_compressed(outfile, **metadata, **features)
+
+# Returns the feature spec a .features.npz file was computed with.
+# Files written before specs were stored contain every feature.
+def get_spec(data):
+    if "spec" in data.files:
+        return [str(s) for s in data["spec"]]
+    return list(feature_kinds)
+
+# Returns the extractor version of every group stored in a .features.npz file.
+# Files written before versions were stored hold version 1 of their groups.
+def get_versions(data):
+    if "groups" in data.files:
+        return dict(zip([str(g) for g in data["groups"]], [int(v) for v in data["versions"]]))
+    return dict([(g, 1) for g in feature_groups if all([k in data.files for k in feature_groups[g][0]])])
+
+# Returns the groups of spec that filename lacks or holds from an older extractor version
+def get_stale_groups(filename, spec=feature_kinds):
+    groups = get_groups(spec)
+    if not feature_exists(filename):
+        return groups
+    try:
+        data = open_features(filename)
+        stored = get_spec(data)
+        versions = get_versions(data)
+    except Exception:
+        return groups
+    if not all([s in stored for s in spec]):
+        return groups
+    return [g for g in groups if versions.get(g) != feature_versions[g]]
+
+# Loads the arrays of groups from a .features.npz file as they are stored
+def load_groups(filename, groups):
+    data = open_features(filename)
+    return dict([(k, data[k]) for g in groups for k in feature_groups[g][0]])
+
+# Returns True if filename holds features computed for (at least) spec
+def has_features(filename, spec=feature_kinds):
+    if not feature_exists(filename):
+        return False
+    try:
+        stored = get_spec(open_features(filename))
+    except Exception:
+        return False
+    return all([s in stored for s in spec])
+
+# Loads a .features.npz file or feature store entry into a dictionary.
+# Channels that were not computed are filled with zeros so that every
+# network can read the file; they are masked out by models that skip them.
+# Arrays of store entries and shared memory features are read-only views of the store or segment.
+def load_features(filename):
+    data = open_features(filename)
+    features = dict([(k, data[k]) for k in data.files if not k in metadata_keys])
+    nres = features["maps"].shape[0]
+
+    # 3D information
+    if not "idx" in features:
+        features["idx"] = np.zeros((0, 5), dtype=np.uint16)
+        features["val"] = np.zeros(0, dtype=np.float16)
+
+    # 1D information
+    for k in ["phi", "psi"]:
+        if not k in features:
+            features[k] = np.zeros(nres, dtype=np.float32)
+    if not "obt" in features:
+        features["obt"] = np.zeros((14, nres))
+    if not "prop" in features:
+        features["prop"] = np.zeros((52, nres))
+
+    # 2D information
+    for k in ["omega6d", "theta6d", "phi6d"]:
+        if not k in features:
+            features[k] = np.zeros((nres, nres))
+    if not "euler" in features:
+        features["euler"] = np.zeros((nres, nres, 6))
+    tbt = features["tbt"]
+    if tbt.shape[0] < 10:
+        features["tbt"] = np.concatenate([tbt, np.zeros((10-tbt.shape[0], nres, nres), dtype=tbt.dtype)])
+    return features
@@ -0,0 +1,265 @@
+import os
+import time
+import signal
+import queue
+import multiprocessing
+from .structureIO import *
+from .featureIO import *
+from . import sharedFeatures, featureStore
+
+# Pool of featurization workers.
+# Decoys are handed out one at a time, largest first, so a huge decoy never holds up a
+# chunk of small ones behind it and the pool finishes close to total work / processes.
+# Workers are forked from the main process, so they share its imported modules instead of
+# importing the package again; the initializer only sets up the featurization stack.
+# Processes that already run threads, like the tensorflow sessions of the pipeline mode,
+# start them from a fork server instead (see get_worker_context).
+
+# In: structure (see structureIO), Out: its size in bytes, which grows with its residue count.
+# Only needs a stat of the file, the structure is not read.
+def get_structure_size(structure):
+    if isinstance(structure, str):
+        return os.path.getsize(structure)
+    return structure[5]-structure[4]
+
+# In: structures, Out: the order to featurize them in, largest first.
+# Models of a gzip file are only read quickly front to back (see structureIO.read_structure_bytes),
+# so they stay in file order as one unit sized by their total, which hands every worker
+# increasing offsets of it; plain files and references are units of their own.
+def get_featurization_order(structures):
+    units = {}
+    for i, structure in enumerate(structures):
+        key = structure[0] if not isinstance(structure, str) and structure[0].endswith(".gz") else i
+        units.setdefault(key, []).append(i)
+    sizes = dict([(key, sum([get_structure_size(structures[i]) for i in unit])) for key, unit in units.items()])
+    order = []
+    for key in sorted(units, key=lambda k: sizes[k], reverse=True):
+        unit = units[key]
+        if len(unit) > 1:
+            unit = sorted(unit, key=lambda i: structures[i][4])
+        order += unit
+    return order
+
+# Seconds between checks of the workers while no decoy finishes
+poll_interval = 1.0
+# Seconds a result may still arrive after the worker that ran the decoy exited
+lost_grace = 5.0
+
+# Queue the workers of this process report the decoys they start on, as (index, pid)
+_started = None
+
+# Out: context to start featurization workers from once this process runs threads.
+# Forking a process with running threads (e.g. of tensorflow sessions) can leave locks held
+# by them locked forever in the child. Workers, including those replacing recycled ones
+# (maxtasks), are then forked from a server process that only imported the package.
+def get_worker_context():
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["pyErrorPred"])
+    return context
+
+# Out: settings of this process the featurizers depend on. Forked workers inherit them,
+# workers of other contexts are given them by init_worker.
+def get_process_settings():
+    return {"encoding": get_encoding(),
+            "segment_prefix": sharedFeatures.segment_prefix,
+            "run_name": featureStore.run_name}
+
+def set_process_settings(settings):
+    set_encoding(settings["encoding"])
+    sharedFeatures.segment_prefix = settings["segment_prefix"]
+    featureStore.run_name = settings["run_name"]
+
+def init_worker(rosetta, started=None, settings=None):
+    global _started
+    _started = started
+    if settings is not None:
+        set_process_settings(settings)
+    # Interrupts are handled by the main process, which terminates the pool
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if rosetta:
+        from .featurize import init_rosetta
+        init_rosetta()
+
+def on_timeout(signum, frame):
+    raise TimeoutError("timed out")
+
+# Runs one featurization task in a worker.
+# The timeout raises in the featurizer once control returns to python between rosetta calls,
+# so the featurizer reports it like any other failure.
+# Features written to shared memory are handed over with the result (see sharedFeatures).
+# In: (index, featurizer, arguments, timeout in seconds or None), Out: (index, success, shared memory entry or None)
+def run_task(task):
+    index, featurizer, args, timeout = task
+    if _started is not None:
+        _started.put((index, os.getpid()))
+    if timeout:
+        signal.signal(signal.SIGALRM, on_timeout)
+        signal.alarm(int(timeout))
+    try:
+        success = featurizer(args)
+    except Exception as inst:
+        print("While processing", args[1]+":", inst)
+        success = False
+    finally:
+        if timeout:
+            signal.alarm(0)
+    return index, bool(success), take_written(args[1])
+
+# Featurization of arguments (see featurize.process) by processes workers, iterated as
+# (index of the arguments, success) in the order decoys finish.
+# At most depth decoys are handed out and not yet taken from the iteration, so with a consumer
+# that uses up the features of a decoy before taking the next one, no more than depth feature
+# sets exist at a time. The workers start when the stream is created.
+# Workers are replaced after maxtasks decoys, which caps the memory rosetta accumulates.
+# A decoy taking longer than timeout seconds fails. Workers report the decoys they start on,
+# so one whose worker died (e.g. killed for memory or crashed in rosetta) fails instead of
+# being waited for, and the worker of a decoy stuck in native code past twice the timeout,
+# where the alarm of run_task cannot interrupt it, is killed.
+# Workers are started from context (a multiprocessing context, forked from this process by default).
+class FeaturizationStream:
+    def __init__(self, featurizer, arguments, processes, depth=None, timeout=None, maxtasks=None, rosetta=True, context=None):
+        self.featurizer = featurizer
+        self.arguments = arguments
+        self.depth = len(arguments) if depth is None else max(depth, 1)
+        self.timeout = timeout
+        self.order = get_featurization_order([a[0] for a in arguments])
+        self.success = [False]*len(arguments)
+        self.finished = queue.Queue()
+        self.submitted = 0
+        self.taken = 0
+        # Indices handed out and not taken yet
+        self.outstanding = set()
+        # Decoys being featurized: index -> (pid of its worker, time it was seen starting)
+        self.running = {}
+        # Decoys whose worker exited: index -> time it was seen
+        self.exited = {}
+        # Workers seen: pid -> process, and the pids that started decoys
+        self.workers = {}
+        self.started_pids = set()
+        # Decoys given up on, whose results the pool still waits for
+        self.lost = 0
+        self.checked = time.time()
+        self.processes = processes
+        context = multiprocessing.get_context() if context is None else context
+        self.started = context.SimpleQueue()
+        self.pool = context.Pool(processes, initializer=init_worker, initargs=(rosetta, self.started, get_process_settings()), maxtasksperchild=maxtasks)
+        self.submit()
+
+    # Hands out decoys until depth of them are not taken yet
+    def submit(self):
+        while self.submitted < len(self.order) and self.submitted-self.taken < self.depth:
+            i = self.order[self.submitted]
+            self.pool.apply_async(run_task, ((i, self.featurizer, self.arguments[i], self.timeout),),
+                                  callback=self.finished.put, error_callback=lambda e, i=i: self.on_error(i, e))
+            self.outstanding.add(i)
+            self.submitted += 1
+
+    # An exception that escaped run_task, e.g. its result could not be sent back
+    def on_error(self, index, error):
+        print("While processing", self.arguments[index][1]+":", error)
+        self.finished.put((index, False, None))
+
+    # Fails a decoy whose result will not arrive
+    def lose(self, index, reason):
+        print("While processing", self.arguments[index][1]+":", reason)
+        self.running.pop(index, None)
+        self.exited.pop(index, None)
+        self.lost += 1
+        self.finished.put((index, False, None))
+
+    # Finds the decoys lost with their workers and kills workers stuck past twice the timeout.
+    # Out: False if workers keep exiting before starting any decoy (e.g. rosetta fails to initialize)
+    def check_workers(self):
+        now = time.time()
+        self.checked = now
+        while not self.started.empty():
+            index, pid = self.started.get()
+            self.started_pids.add(pid)
+            if index in self.outstanding:
+                self.running[index] = (pid, now)
+        alive = set()
+        for worker in list(self.pool._pool):
+            self.workers[worker.pid] = worker
+            if worker.exitcode is None:
+                alive.add(worker.pid)
+        for index, (pid, start) in list(self.running.items()):
+            if not index in self.outstanding:
+                del self.running[index]
+            elif not pid in alive:
+                # Exited, possibly already replaced by the pool. The result of a worker
+                # that finished its last decoy can still be on its way.
+                self.exited.setdefault(index, now)
+                if now-self.exited[index] > lost_grace:
+                    exitcode = self.workers[pid].exitcode if pid in self.workers else None
+                    self.lose(index, "its worker exited" if exitcode is None else "its worker exited with code %d" % exitcode)
+            elif self.timeout and now-start > 2*self.timeout:
+                try:
+                    os.kill(pid, signal.SIGKILL)
+                except ProcessLookupError:
+                    pass
+                self.lose(index, "not finished within %d seconds, its worker was killed" % (2*self.timeout))
+        crashed = [p for p, w in self.workers.items() if w.exitcode not in [None, 0] and not p in self.started_pids]
+        return len(crashed) <= 2*self.processes
+
+    def __iter__(self):
+        completed = False
+        try:
+            while self.taken < len(self.order):
+                self.submit()
+                if time.time()-self.checked >= poll_interval and not self.check_workers():
+                    print("Featurization workers keep exiting before starting a decoy, stopping them.")
+                    break
+                try:
+                    index, success, shared = self.finished.get(timeout=poll_interval)
+                except queue.Empty:
+                    continue
+                if not index in self.outstanding:
+                    # The result of a decoy that was given up on
+                    if shared is not None:
+                        discard_shared(self.arguments[index][1])
+                    continue
+                self.outstanding.discard(index)
+                self.running.pop(index, None)
+                self.exited.pop(index, None)
+                if success and shared is not None:
+                    receive_shared(self.arguments[index][1], shared)
+                elif not success and is_memory_path(self.arguments[index][1]):
+                    discard_shared(self.arguments[index][1])
+                self.success[index] = success
+                self.taken += 1
+                yield index, success
+            else:
+                completed = True
+        finally:
+            # Stopped early by an interrupt, the consumer or workers failing to start.
+            # A pool with lost decoys would wait for their results when closed.
+            if completed and self.lost == 0:
+                self.pool.close()
+            else:
+                self.pool.terminate()
+            self.pool.join()
+            # Shared memory of decoys not taken, including that of killed workers
+            for i in self.outstanding:
+                if is_memory_path(self.arguments[i][1]):
+                    discard_shared(self.arguments[i][1])
+            self.outstanding.clear()
+
+    # Prints the decoys that failed, Out: number of decoys featurized
+    def report(self, verbose=False):
+        failed = [get_structure_label(self.arguments[i][0]) for i in range(len(self.arguments)) if not self.success[i]]
+        if len(failed) > 0:
+            print(len(failed), "of", len(self.arguments), "decoys failed to featurize:")
+            for f in failed:
+                print("  "+f)
+        elif verbose:
+            print("Featurized", self.taken, "decoys")
+        return len(self.arguments)-len(failed)
+
+# Featurizes arguments (see FeaturizationStream) with processes workers.
+# Out: success of every task, in the order of arguments
+def run_featurization(featurizer, arguments, processes, timeout=None, maxtasks=None, rosetta=True, verbose=False):
+    stream = FeaturizationStream(featurizer, arguments, processes, timeout=timeout, maxtasks=maxtasks, rosetta=rosetta)
+    for _ in stream:
+        pass
+    stream.report(verbose)
+    return stream.success
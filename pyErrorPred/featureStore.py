@@ -0,0 +1,130 @@
+import numpy as np
+import os
+import json
+import socket
+import fcntl
+from os.path import join, isdir
+
+# Byte alignment of arrays in shard files
+alignment = 64
+
+# Worker processes inherit it, or are given it by featurePool.init_worker.
+# Worker processes forked from it inherit it.
+# The host name keeps processes of different machines sharing the folder apart.
+run_name = "%s-%d" % (socket.gethostname(), os.getpid())
+
+# Features of many decoys in a few uncompressed shard files plus an index.
+# A process appends to the shard of a free writer slot of the run (<run>-<slot>.bin) and
+# writes one line per decoy to <run>-<slot>.index holding the offset, dtype and shape of
+# each of its arrays. The slot is held with a lock on its shard until the process exits,
+# so a worker replacing a recycled one continues its shard and a run writes as many
+# shards as it has concurrent writers.
+# Shards are memory mapped for reading, so loading an array is a zero-copy slice.
+# Later lines for a name replace earlier ones; the space of replaced arrays is not reclaimed.
+class FeatureStore:
+    def __init__(self, path):
+        self.path = path
+        if not isdir(path):
+            os.makedirs(path, exist_ok=True)
+        # name -> (shard, {key: (offset, dtype, shape)})
+        self.entries = {}
+        # index file -> bytes read so far
+        self.positions = {}
+        # shard -> memory map
+        self.maps = {}
+        # (pid, slot name, locked shard file) once this process has written
+        self.writer = None
+
+    # Reads index lines written since the last call.
+    # Index files that did not grow since are not opened.
+    def update(self):
+        with os.scandir(self.path) as entries:
+            changed = [e.name for e in entries if e.name.endswith(".index") and e.stat().st_size > self.positions.get(e.name, 0)]
+        for f in sorted(changed):
+            with open(join(self.path, f), "rb") as index:
+                index.seek(self.positions.get(f, 0))
+                line = index.readline()
+                # A line without newline is still being written
+                while line.endswith(b"\n"):
+                    entry = json.loads(line)
+                    self.entries[entry["name"]] = (entry["shard"], entry["arrays"])
+                    self.positions[f] = index.tell()
+                    line = index.readline()
+
+    def names(self):
+        self.update()
+        return list(self.entries.keys())
+
+    def has(self, name):
+        if not name in self.entries:
+            self.update()
+        return name in self.entries
+
+    # Out: dictionary of read-only arrays of name, backed by the memory mapped shard
+    def load(self, name):
+        if not self.has(name):
+            raise KeyError(name+" is not in "+self.path)
+        shard, arrays = self.entries[name]
+        end = max([a[0]+int(np.prod(a[2]))*np.dtype(a[1]).itemsize for a in arrays.values()])
+        if not shard in self.maps or self.maps[shard].shape[0] < end:
+            self.maps[shard] = np.memmap(join(self.path, shard), dtype=np.uint8, mode="r")
+        data = self.maps[shard]
+        features = StoredFeatures()
+        for k, (offset, dtype, shape) in arrays.items():
+            nbytes = int(np.prod(shape))*np.dtype(dtype).itemsize
+            features[k] = data[offset:offset+nbytes].view(dtype).reshape(tuple(shape))
+        return features
+
+    # Out: (pid, slot name, shard file) of the first writer slot of the run no other process holds
+    def acquire_writer(self):
+        slot = 0
+        while True:
+            writer = "%s-%d" % (run_name, slot)
+            f = open(join(self.path, writer+".bin"), "ab")
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return os.getpid(), writer, f
+            except OSError:
+                f.close()
+                slot += 1
+
+    # Releases the writer slot of this process
+    def close(self):
+        if self.writer is not None:
+            self.writer[2].close()
+            self.writer = None
+
+    # Appends the arrays of name to the shard of this process
+    def write(self, name, arrays):
+        # A forked child shares the lock of its parent and takes a slot of its own
+        if self.writer is not None and self.writer[0] != os.getpid():
+            self.close()
+        if self.writer is None:
+            self.writer = self.acquire_writer()
+        _, writer, f = self.writer
+        shard = writer+".bin"
+        entry = {}
+        for k, a in arrays.items():
+            # Unlike np.ascontiguousarray this keeps 0-d arrays 0-d
+            a = np.asarray(a, order="C")
+            f.write(b"\0"*(-f.tell() % alignment))
+            entry[k] = (f.tell(), a.dtype.str, list(a.shape))
+            a.tofile(f)
+        f.flush()
+        # The index line is only written once the arrays are
+        with open(join(self.path, writer+".index"), "a") as f:
+            f.write(json.dumps({"name": name, "shard": shard, "arrays": entry})+"\n")
+
+# Arrays of one decoy loaded from a FeatureStore. Exposes files like np.load does for .npz files.
+class StoredFeatures(dict):
+    @property
+    def files(self):
+        return list(self.keys())
+
+# Stores opened by this process
+_stores = {}
+
+def get_store(path):
+    if not path in _stores:
+        _stores[path] = FeatureStore(path)
+    return _stores[path]
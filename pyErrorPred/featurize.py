@@ -1,6 +1,5 @@
-# Instantiate pyrosetta
+# Import pyrosetta, it is initialized on first use (see init_rosetta)
 from pyrosetta import *
-init(extra_options = "-constant_seed -mute all")
 
 # Import necessary libraries
 import numpy as np
@@ -8,8 +7,77 @@ import math
 import scipy
 import scipy.spatial
 import time
+import hashlib
+import multiprocessing
 from .pyprotein import *
 from .dataProcessingUtils import *
+from .geometry import *
+from .featureIO import *
+from .structureIO import *
+
+# Initializes pyrosetta once per process.
+# Importing the package does not, so that rosetta free featurization (pdbUtils) skips it.
+_rosetta_initialized = False
+
+def init_rosetta():
+    global _rosetta_initialized
+    if not _rosetta_initialized:
+        init(extra_options = "-constant_seed -mute all")
+        _rosetta_initialized = True
+
+# Full atom scorefunction, built once per process and shared by every decoy it featurizes
+_scorefxn = None
+
+def get_scorefxn():
+    global _scorefxn
+    if _scorefxn is None:
+        _scorefxn = get_fa_scorefxn()
+    return _scorefxn
+
+# In: pose, Out: atom table of the pose.
+# Walks the pose once and returns numpy arrays of all heavy atoms (xyz, residue index,
+# atom type channel or -1) together with per-residue index tables (see residue_atoms).
+# Every featurizer reads coordinates from this table instead of calling into the pose.
+def get_atom_table(pose):
+    nres = pose.size()
+    xyz = []
+    resi = []
+    atype = []
+    rnames = []
+    chains = []
+    index = dict([(a, np.full(nres, -1, dtype=np.int32)) for a in residue_atoms])
+    info = pose.pdb_info()
+    for i in range(1, nres+1):
+        r = pose.residue(i)
+        rname = r.name()
+        # Tip atoms are looked up with the full residue type name like get_distmaps does
+        tip = dict_3LAA_to_tip.get(rname, "CA")
+        rnames.append(rname)
+        chains.append(info.chain(i) if info else str(pose.chain(i)))
+        for j in range(1, r.nheavyatoms()+1):
+            aname = r.atom_name(j).strip()
+            if aname in ["N", "CA", "C", "CB"]:
+                index[aname][i-1] = len(xyz)
+            if aname == tip:
+                index["tip"][i-1] = len(xyz)
+            name = rname[:3]+'_'+aname
+            if aname != 'NV' and aname != 'OXT' and name in atypes:
+                atype.append(atypes[name])
+            else:
+                atype.append(-1)
+            v = r.xyz(j)
+            xyz.append((v.x, v.y, v.z))
+            resi.append(i-1)
+
+    atoms = {}
+    atoms['nres'] = nres
+    atoms['xyz'] = np.array(xyz)
+    atoms['resi'] = np.array(resi, dtype=np.int32)
+    atoms['atype'] = np.array(atype, dtype=np.int16)
+    atoms['rname'] = np.array(rnames)
+    atoms['chain'] = np.array(chains)
+    atoms.update(index)
+    return atoms
 
 # In: pose, Out: backbone-to-backbone hydrogen bonds
 def get_hbonds(pose):  
@@ -36,105 +104,72 @@ def get_hbonds(pose):
                 
     return hb_srbb, hb_lrbb
 
-# In: pose, Out: distance maps with different atoms
-def extract_multi_distance_map(pose):
-    # Get CB to CB distance map use CA if CB does not exist
-    x1 = get_distmaps(pose, atom1="CB", atom2="CB", default="CA")
-    # Get CA to CA distance map
-    x2 = get_distmaps(pose, atom1=dict_3LAA_to_tip, atom2=dict_3LAA_to_tip)
-    # Get Tip to Tip distancemap
-    x3 = get_distmaps(pose, atom1="CA", atom2=dict_3LAA_to_tip)
-    # Get Tip to CA distancemap
-    x4 = get_distmaps(pose, atom1=dict_3LAA_to_tip, atom2="CA")
-    output = np.stack([x1,x2,x3,x4], axis=-1)
-    return output
-
-# In: pose, Out: (3d-matrix with 2d energies and cb-distmap, aa sequences) 
-def extract_EnergyDistM(pose, energy_terms):
+# In: pose and its atom table, Out: (3d-matrix with 2d energies and cb-distmap, aa sequences) 
+# With rows and parent (a previous output) only the rows and columns of rows are
+# recomputed from the edges touching them, everything else is copied from parent.
+# With block the tensor is float32 and its distance channel is filled block rows at a time.
+def extract_EnergyDistM(pose, energy_terms, atoms, rows=None, parent=None, block=None):
 
     # Get the number of residues in the protein.
     length = int(pose.total_residue())
     
     # Prepare distance matrix
-    tensor = np.zeros((1+len(energy_terms)+2, length, length))
-    
-    # Obtain energy graph
-    energies = pose.energies()
-    graph = energies.energy_graph()
+    if rows is None:
+        dtype = np.float64 if block is None else np.float32
+        tensor = np.zeros((1+len(energy_terms)+2, length, length), dtype=dtype)
+    else:
+        rows = np.asarray(rows)
+        tensor = np.array(parent, dtype=np.float64)
+        tensor[:, rows] = 0
+        tensor[:, :, rows] = 0
     
     ######################################
     # Fill the dist_matrix with energies #
     ######################################
-    aas = []
-    for i in range(length):
-        index1 = i + 1
-        aas.append(pose.residue(index1).name().split(":")[0].split("_")[0])
+    aas = get_aas(atoms)
+    index1, index2, evals = get_energy_edges(pose, energy_terms, rows)
+    count = 1
+    for k in range(len(energy_terms)):
+        e = evals[:, k]
+        t = energy_terms[k]
         
-        # Get an edge iterator
-        iru = graph.get_node(index1).const_edge_list_begin()
-        irue = graph.get_node(index1).const_edge_list_end()
-        
-        # Parse the energy graph.
-        while iru!=irue:
-            # Dereference the pointer and get the other end.
-            edge = iru.__mul__()
-            
-            # Evaluate energy edge and get energy values
-            evals = [edge[e] for e in energy_terms]
-            index2 = edge.get_other_ind(index1)
+        # For hbond_bb_sc and hbond_sc, just note the presence.
+        # Otherwise record the original values.
+        if t == pyrosetta.rosetta.core.scoring.ScoreType.hbond_bb_sc or t == pyrosetta.rosetta.core.scoring.ScoreType.hbond_sc:
+            e = (e != 0.0).astype(tensor.dtype)
             
-            count = 1
-            for k in range(len(evals)):
-                e = evals[k]
-                t = energy_terms[k]
-                
-                # For hbond_bb_sc and hbond_sc, just note the presence
-                if t == pyrosetta.rosetta.core.scoring.ScoreType.hbond_bb_sc or t == pyrosetta.rosetta.core.scoring.ScoreType.hbond_sc:
-                    if e != 0.0:
-                        tensor[count, index1-1, index2-1] = 1
-                # Otherwise record the original values.
-                else:
-                    tensor[count, index1-1, index2-1] = e
-                    
-                count += 1
-            # Move pointer
-            iru.plus_plus()
-    
-    #########################################
-    # Simple transformation of energy terms #
-    #########################################
-    for i in range(1, 1+len(evals)):
-        temp = tensor[i]
-        if i == 1 or i == 2:
-            tensor[i] = np.arcsinh(np.abs(temp))/3.0
-        elif i == 3 or i==4 or i==5:
-            tensor[i] = np.tanh(temp)
+        #########################################
+        # Simple transformation of energy terms #
+        #########################################
+        # Both keep zeros, so only the edge values need to be transformed
+        if count == 1 or count == 2:
+            e = np.arcsinh(np.abs(e))/3.0
+        elif count == 3 or count == 4 or count == 5:
+            e = np.tanh(e)
+        tensor[count, index1, index2] = e
+        tensor[count, index2, index1] = e
+        count += 1
             
     #############################################
     # Use CB idstance (CA if CB does not exist) #
     # to calculate distance between residues    #
     #############################################
-    for i in range(length):
-        for j in range(length):
-            index1 = i + 1    
-            index2 = j + 1
-            # Calculate distance and store. Use CA if CB does not exist.
-            if pose.residue(index1).has("CB"):
-                vector1 = pose.residue(index1).xyz("CB")
-            else:
-                vector1 = pose.residue(index1).xyz("CA")
-            if pose.residue(index2).has("CB"):
-                vector2 = pose.residue(index2).xyz("CB")
-            else:
-                vector2 = pose.residue(index2).xyz("CA")
-            distance = vector1.distance(vector2)
-            
-            tensor[0, index1-1, index2-1] = distance #1-sigmoid(displacement, scale=10, offset=-5)
+    if block is not None:
+        fill_row_blocks(tensor[0], get_cb_distmap, atoms, block)
+    elif rows is None:
+        tensor[0] = get_cb_distmap(atoms)
+    else:
+        d = get_cb_distmap(atoms, rows)
+        tensor[0][rows] = d
+        tensor[0][:, rows] = d.T
     
     ##################################
     # Fill in the hbonds information #
     ##################################
     hbonds = get_hbonds(pose)
+    if rows is not None:
+        touched = set([int(r)+1 for r in rows])
+        hbonds = [[hb for hb in hbs if hb[0] in touched or hb[1] in touched] for hbs in hbonds]
     for hb in hbonds[0]:
         index1 = hb[0]
         index2 = hb[1]
@@ -157,14 +192,12 @@ def extract_AAs_properties_ver1(aas):
         _prop[45:, i] = meiler_features[aa]/5
     return _prop
 
-def get_coords(p):
-
-    nres = pyrosetta.rosetta.core.pose.nres_protein(p)
+def get_coords(atoms, nres):
 
     # three anchor atoms to build local reference frame
-    N = np.stack([np.array(p.residue(i).atom('N').xyz()) for i in range(1,nres+1)])
-    Ca = np.stack([np.array(p.residue(i).atom('CA').xyz()) for i in range(1,nres+1)])
-    C = np.stack([np.array(p.residue(i).atom('C').xyz()) for i in range(1,nres+1)])
+    N = atoms['xyz'][atoms['N'][:nres]]
+    Ca = atoms['xyz'][atoms['CA'][:nres]]
+    C = atoms['xyz'][atoms['C'][:nres]]
 
     # recreate Cb given N,Ca,C
     ca = -0.58273431
@@ -224,175 +257,132 @@ def get_angles(a, b, c):
 
     return np.arccos(x)
 
-def set_neighbors6D(pdict):
+# 6D maps saved to the features. dist6d, the Cb-Cb distance, is only kept in the dense
+# maps like before; the block and rows paths do not compute it, nothing reads it.
+angle6d_keys = ['omega6d', 'theta6d', 'phi6d']
 
-    N = pdict['N']
-    Ca = pdict['Ca']
-    Cb = pdict['Cb']
-    nres = pdict['nres']
-    
-    dmax = 20.0
-    
-    # fast neighbors search
-    kdCb = scipy.spatial.cKDTree(Cb)
-    indices = kdCb.query_ball_tree(kdCb, dmax)
-    
-    # indices of contacting residues
-    idx = np.array([[i,j] for i in range(len(indices)) for j in indices[i] if i != j]).T
-    idx0 = idx[0]
-    idx1 = idx[1]
+# Fills the 6D maps at the residue pairs (idx0, idx1).
+# Maps whose first row is residue offset hold rows idx0-offset.
+def set_pairs6D(maps, N, Ca, Cb, idx0, idx1, offset=0):
     
     # Cb-Cb distance matrix
-    dist6d = np.zeros((nres, nres))
-    dist6d[idx0,idx1] = np.linalg.norm(Cb[idx1]-Cb[idx0], axis=-1)
+    if 'dist6d' in maps:
+        maps['dist6d'][idx0-offset,idx1] = np.linalg.norm(Cb[idx1]-Cb[idx0], axis=-1)
 
     # matrix of Ca-Cb-Cb-Ca dihedrals
-    omega6d = np.zeros((nres, nres))
-    omega6d[idx0,idx1] = get_dihedrals(Ca[idx0], Cb[idx0], Cb[idx1], Ca[idx1])
+    maps['omega6d'][idx0-offset,idx1] = get_dihedrals(Ca[idx0], Cb[idx0], Cb[idx1], Ca[idx1])
 
     # matrix of polar coord theta
-    theta6d = np.zeros((nres, nres))
-    theta6d[idx0,idx1] = get_dihedrals(N[idx0], Ca[idx0], Cb[idx0], Cb[idx1])
+    maps['theta6d'][idx0-offset,idx1] = get_dihedrals(N[idx0], Ca[idx0], Cb[idx0], Cb[idx1])
     
     # matrix of polar coord phi
-    phi6d = np.zeros((nres, nres))
-    phi6d[idx0,idx1] = get_angles(Ca[idx0], Cb[idx0], Cb[idx1])
-    
-    pdict['dist6d'] = dist6d
-    pdict['omega6d'] = omega6d
-    pdict['theta6d'] = theta6d
-    pdict['phi6d'] = phi6d
+    maps['phi6d'][idx0-offset,idx1] = get_angles(Ca[idx0], Cb[idx0], Cb[idx1])
 
+# In: context and consecutive residue indices, Out: those rows of the 6D maps
+def get_rows6D(pdict, rows, dtype=np.float64, kd=None):
+    Cb = pdict['Cb']
+    kd = scipy.spatial.cKDTree(Cb) if kd is None else kd
+    maps = dict([(k, np.zeros((len(rows), pdict['nres']), dtype=dtype)) for k in angle6d_keys])
+    idx0, idx1 = get_row_neighbors(kd, Cb, rows, 20.0)
+    set_pairs6D(maps, pdict['N'], pdict['Ca'], Cb, idx0, idx1, rows[0] if len(rows) > 0 else 0)
+    return maps
 
-def set_neighbors3D(pdict):
+# With rows only the pairs involving rows are recomputed
+# in the maps pdict already holds (see refeaturize).
+# With block the maps are float32 and filled block rows at a time.
+def set_neighbors6D(pdict, rows=None, block=None):
 
-    # get coordinates of all non-hydrogen atoms
-    # and their types
-    xyz = []
-    types = []
-    pose = pdict['pose']
+    N = pdict['N']
+    Ca = pdict['Ca']
+    Cb = pdict['Cb']
     nres = pdict['nres']
-    for i in range(1,nres+1):
-        r = pose.residue(i)
-        rname = r.name()[:3]
-        for j in range(1,r.natoms()+1):
-            aname = r.atom_name(j).strip()
-            name = rname+'_'+aname
-            if not r.atom_is_hydrogen(j) and aname != 'NV' and aname != 'OXT' and name in atypes:
-                xyz.append(r.atom(j).xyz())
-                types.append(atypes[name])
-
-    xyz = np.array(xyz)
-    xyz_ca = pdict['Ca']
-    lfr = pdict['lfr']
-
-    # find neighbors and project onto
-    # local reference frames
-    dist = 14.0
-    kd = scipy.spatial.cKDTree(xyz)
-    kd_ca = scipy.spatial.cKDTree(xyz_ca)
-    indices = kd_ca.query_ball_tree(kd, dist)
-    idx = np.array([[i,j,types[j]] for i in range(len(indices)) for j in indices[i]])
-
-    xyz_shift = xyz[idx.T[1]] - xyz_ca[idx.T[0]]
-    xyz_new = np.sum(lfr[idx.T[0]] * xyz_shift[:,None,:], axis=-1)
-
-    #
-    # discretize
-    #
-    nbins = 24
-    width = 19.2
-
-    # total number of neighbors
-    N = idx.shape[0]
-
-    # bin size
-    h = width / (nbins-1)
-    
-    # shift all contacts to the center of the box
-    # and scale the coordinates by h
-    xyz = (xyz_new + 0.5 * width) / h
-
-    # residue indices
-    i = idx[:,0].astype(dtype=np.int16).reshape((N,1))
     
-    # atom types
-    t = idx[:,2].astype(dtype=np.int16).reshape((N,1))
-    
-    # discretized x,y,z coordinates
-    klm = np.floor(xyz).astype(dtype=np.int16)
-
-    # atom coordinates in the cell it occupies
-    d = xyz - np.floor(xyz)
-
-    # trilinear interpolation
-    klm0 = np.array(klm[:,0]).reshape((N,1))
-    klm1 = np.array(klm[:,1]).reshape((N,1))
-    klm2 = np.array(klm[:,2]).reshape((N,1))
-    
-    V000 = np.array(d[:,0] * d[:,1] * d[:,2]).reshape((N,1))
-    V100 = np.array((1-d[:,0]) * d[:,1] * d[:,2]).reshape((N,1))
-    V010 = np.array(d[:,0] * (1-d[:,1]) * d[:,2]).reshape((N,1))
-    V110 = np.array((1-d[:,0]) * (1-d[:,1]) * d[:,2]).reshape((N,1))
-
-    V001 = np.array(d[:,0] * d[:,1] * (1-d[:,2])).reshape((N,1))
-    V101 = np.array((1-d[:,0]) * d[:,1] * (1-d[:,2])).reshape((N,1))
-    V011 = np.array(d[:,0] * (1-d[:,1]) * (1-d[:,2])).reshape((N,1))
-    V111 = np.array((1-d[:,0]) * (1-d[:,1]) * (1-d[:,2])).reshape((N,1))
-
-    a000 = np.hstack([i, klm0, klm1, klm2, t, V111])
-    a100 = np.hstack([i, klm0+1, klm1, klm2, t, V011])
-    a010 = np.hstack([i, klm0, klm1+1, klm2, t, V101])
-    a110 = np.hstack([i, klm0+1, klm1+1, klm2, t, V001])
-
-    a001 = np.hstack([i, klm0, klm1, klm2+1, t, V110])
-    a101 = np.hstack([i, klm0+1, klm1, klm2+1, t, V010])
-    a011 = np.hstack([i, klm0, klm1+1, klm2+1, t, V100])
-    a111 = np.hstack([i, klm0+1, klm1+1, klm2+1, t, V000])
-
-    a = np.vstack([a000, a100, a010, a110, a001, a101, a011, a111])
+    dmax = 20.0
     
-    # make sure projected contacts fit into the box
-    b = a[(np.min(a[:,1:4],axis=-1) >= 0) & (np.max(a[:,1:4],axis=-1) < nbins) & (a[:,5]>1e-5)]
+    # fast neighbors search
+    kdCb = scipy.spatial.cKDTree(Cb)
+    if rows is not None:
+        # A dist6d of the parent would not be updated
+        pdict.pop('dist6d', None)
+        maps = {}
+        for k in angle6d_keys:
+            if k in pdict:
+                maps[k] = np.array(pdict[k])
+                maps[k][rows] = 0
+                maps[k][:, rows] = 0
+        idx0, idx1 = get_row_neighbors(kdCb, Cb, np.asarray(rows), dmax)
+        set_pairs6D(maps, N, Ca, Cb, idx0, idx1)
+        set_pairs6D(maps, N, Ca, Cb, idx1, idx0)
+    elif block is not None:
+        maps = dict([(k, np.empty((nres, nres), dtype=np.float32)) for k in angle6d_keys])
+        for start in range(0, nres, block):
+            rows = get_rows6D(pdict, np.arange(start, min(start+block, nres)), np.float32, kdCb)
+            for k in maps:
+                maps[k][start:start+block] = rows[k]
+    else:
+        maps = dict([(k, np.zeros((nres, nres))) for k in ['dist6d', 'omega6d', 'theta6d', 'phi6d']])
+        pairs = kdCb.query_pairs(dmax, output_type='ndarray')
+        # indices of contacting residues in both directions
+        idx0 = np.concatenate([pairs[:,0], pairs[:,1]])
+        idx1 = np.concatenate([pairs[:,1], pairs[:,0]])
+        set_pairs6D(maps, N, Ca, Cb, idx0, idx1)
     
-    pdict['idx'] = b[:,:5].astype(np.uint16)
-    pdict['val'] = b[:,5].astype(np.float16)
-
+    pdict.update(maps)
+
+
+# In: Dssp object and (nres, 3) CA coordinates,
+# Out: 1-based residue pairs i < j that DSSP pairs in strands and their kind
+# (1 for parallel, 2 for anti-parallel).
+# Bridge partners are connected by backbone hydrogen bonds between them or their
+# direct neighbors, which keeps their CA atoms well within 12A of each other.
+# Only those candidate pairs are queried instead of all N^2/2 residue pairs.
+def get_strand_pairs(dssp, ca, cutoff=12.0):
+    candidates = scipy.spatial.cKDTree(ca).query_pairs(cutoff, output_type='ndarray')
+    pairs = []
+    for i, j in candidates+1:
+        i, j = int(i), int(j)
+        # parallel
+        if dssp.paired(i,j,0):
+            pairs.append((i,j,1))
+        # anti-parallel
+        elif dssp.paired(i,j,1):
+            pairs.append((i,j,2))
+    pairs = np.array(pairs, dtype=np.int64).reshape((len(pairs), 3))
+    return pairs[:,0], pairs[:,1], pairs[:,2]
 
 def set_features1D(pdict):
 
     p = pdict['pose']
     nres = pdict['nres']
     
-    # beta-strand pairings
-    DSSP = pyrosetta.rosetta.core.scoring.dssp.Dssp(p)
-    bbpairs = np.zeros((nres, nres)).astype(np.uint8)
-    for i in range(1,nres+1):
-        for j in range(i+1,nres+1):
-            # parallel
-            if DSSP.paired(i,j,0):
-                bbpairs[i,j] = 1
-                bbpairs[j,i] = 1
-            # anti-parallel
-            elif DSSP.paired(i,j,1):
-                bbpairs[i,j] = 2
-                bbpairs[j,i] = 2
-    
-    abc = np.array(list("BEGHIST "), dtype='|S1').view(np.uint8)
-    dssp8 = np.array(list(DSSP.get_dssp_unreduced_secstruct()),
-                     dtype='|S1').view(np.uint8)
-    for i in range(abc.shape[0]):
-        dssp8[dssp8 == abc[i]] = i
-    dssp8[dssp8 > 7] = 7
-
-    # 3-state DSSP to integers ∈ [0..2]
-    DSSP = pyrosetta.rosetta.core.scoring.dssp.Dssp(p)
-    abc = np.array(list("EHL"), dtype='|S1').view(np.uint8)
-    dssp3 = np.array(list(DSSP.get_dssp_secstruct()), 
-                     dtype='|S1').view(np.uint8)
-    for i in range(abc.shape[0]):
-        dssp3[dssp3 == abc[i]] = i
-    dssp3[dssp3 > 2] = 2
+    # DSSP based features are only available when DSSP was computed
+    if 'dssp' in pdict:
+        DSSP = pdict['dssp']
+        
+        # beta-strand pairings
+        bbpairs = np.zeros((nres, nres)).astype(np.uint8)
+        i, j, kind = get_strand_pairs(DSSP, pdict['Ca'])
+        bbpairs[i,j] = kind
+        bbpairs[j,i] = kind
+        
+        abc = np.array(list("BEGHIST "), dtype='|S1').view(np.uint8)
+        dssp8 = np.array(list(DSSP.get_dssp_unreduced_secstruct()),
+                         dtype='|S1').view(np.uint8)
+        for i in range(abc.shape[0]):
+            dssp8[dssp8 == abc[i]] = i
+        dssp8[dssp8 > 7] = 7
+
+        # 3-state DSSP to integers ∈ [0..2]
+        abc = np.array(list("EHL"), dtype='|S1').view(np.uint8)
+        dssp3 = np.array(list(DSSP.get_dssp_secstruct()), 
+                         dtype='|S1').view(np.uint8)
+        for i in range(abc.shape[0]):
+            dssp3[dssp3 == abc[i]] = i
+        dssp3[dssp3 > 2] = 2
+        
+        pdict['dssp8'] = dssp8
+        pdict['dssp3'] = dssp3
+        pdict['bbpairs'] = bbpairs
 
     # convert letters into numbers
     alphabet = np.array(list("ARNDCQEGHILKMFPSTWYV-"), dtype='|S1').view(np.uint8)
@@ -407,20 +397,14 @@ def set_features1D(pdict):
     # termini & linear chainbreaks
     mask1d = np.ones(nres).astype(np.bool)
     mask1d[0] = mask1d[-1] = 0
-    for i in range(1,nres):
-        A = p.residue(i).atom('CA')
-        B = p.residue(i+1).atom('CA')
-        if (A.xyz() - B.xyz()).norm() > 4.0:
-            mask1d[i-1] = 0
-            mask1d[i] = 0
+    breaks = np.where(np.linalg.norm(pdict['Ca'][1:] - pdict['Ca'][:-1], axis=-1) > 4.0)[0]
+    mask1d[breaks] = 0
+    mask1d[breaks+1] = 0
 
     pdict['seq'] = seq
-    pdict['dssp8'] = dssp8
-    pdict['dssp3'] = dssp3
     pdict['phi'] = phi
     pdict['psi'] = psi
     pdict['mask1d'] = mask1d
-    pdict['bbpairs'] = bbpairs
 
 def energy_string_to_dict(energy_string):
     # given an energy_string
@@ -469,171 +453,472 @@ def get_one_body_score_terms(pose, scorefxn, score_terms):
         one_body_score_terms.append(res_scores)
     return np.array(one_body_score_terms).T
 
-def mydot(v1, v2):
-    result = 0
-    for ele in range(3):
-        result = result + v1[ele] * v2[ele]
-    return result
-
-def angle_between_vecs(v1, v2):
-    return math.acos(v1.dot(v2) / (v1.norm() * v2.norm()))
-
-def get_bond_lengths_and_angles(mypose,k):
-    # GIVEN: a pose and a residue number k
-    # RETURNS: a dictionary where keys are features
-    # and values are the values of those features
-
-    # backbone bond lenths and angles
-    # for residue k:
-    # three bonds to consider:
-    # N(k)-CA(k)
-    # CA(k)-C(k)
-    # Ca(k)-N(K+1) (except for C-term)
-    # three angles to consider:
-    # C(k-1)-N(k)-CA(k) (except for N-term)
-    # N(k)-CA(k)-C(k)
-    # CA(k)-C(k)-N(k+1) (except for C-term)
-    # not sure whether to record C(k)-N(k+1)-CA(k+1) or C(k-1)-N(k)-CA(k)
-    seqlen = len(mypose.sequence())
-    result_dict = {}
-    # gather xyz coords of all relevant atoms
-    if k > 1:
-        C_prev = mypose.residue(k-1).xyz("C")
-    N_curr = mypose.residue(k).xyz("N")
-    CA_curr = mypose.residue(k).xyz("CA")
-    C_curr = mypose.residue(k).xyz("C")
-    if k < seqlen:
-        N_next = mypose.residue(k+1).xyz("N")
-    # get relelvant atom-atom vectors
-    if k > 1:
-        CpNc = N_curr - C_prev
-    NcCAc = CA_curr - N_curr
-    CAcCc = C_curr - CA_curr
-    if k < seqlen:
-        CcNn = N_next - C_curr
-    # get relevant bond lengths
-    NcCAc_len = NcCAc.norm()
-    result_dict["NcCAc_len"] = NcCAc_len
-    CAcCc_len = CAcCc.norm()
-    result_dict["CAcCc_len"] = CAcCc_len
-    if k < seqlen:
-        CcNn_len = CcNn.norm()
-        result_dict["CcNn_len"] = CcNn_len
-    # determine angles. There are three angles to consider:
-    # C(k-1)-N(k)-CA(k) (except for N-term)
-    if k > 1:
-        CNCA = angle_between_vecs(CpNc.negated(), NcCAc)
-        result_dict["CpNcCAc"] = CNCA
-    # N(k)-CA(k)-C(k)
-    NCAC = angle_between_vecs(NcCAc.negated(), CAcCc)
-    result_dict["NcCAcCc"] = NCAC
-    # CA(k)-C(k)-N(k+1) (except for C-term)
-    if k < seqlen:
-        CACN = angle_between_vecs(CAcCc.negated(), CcNn)
-        result_dict["CAcCcNn"] = CACN
-    return result_dict
-
-def get_feature_matrix(mypose, padval=0):
-    # GIVEN: a pose and a value for when lenghts and angles don't make
-    # sense at the C and N terminus
-    # RETURNS: a 2d numpy array
-    # rows correspond to residues and columns correspond to features
-    result = []
-    column_names = ["NcCAc_len", "CAcCc_len", "CcNn_len", "CpNcCAc", "NcCAcCc", "CAcCcNn"]
-    for res_pos in range(1,len(mypose.sequence())+1):
-        feature_dict = get_bond_lengths_and_angles(mypose,res_pos)
-        data_row = []
-        # "zero padding"
-        if res_pos == 1:
-            feature_dict["CpNcCAc"] = padval
-        if res_pos == len(mypose.sequence()):
-            feature_dict["CcNn_len"] = padval
-            feature_dict["CAcCcNn"] = padval
-        for feature in column_names:
-            data_row.append(feature_dict[feature])
-        result.append(data_row)
-    return np.array(result).T
-
-def extractSS(pose):
+def get_one_body_energies(pose, score_terms):
+    # GIVEN: a scored pose and a list of score terms
+    # score_terms are names of score types (e.g. "fa_dun").
+    # RETURNS: (terms, nres) numpy array of unweighted energies
+    # read directly from the per-residue energy maps.
+    types = [pyrosetta.rosetta.core.scoring.score_type_from_name(term) for term in score_terms]
+    energy_obj = pose.energies()
+    nres = len(pose.sequence())
+    one_body_score_terms = np.zeros((len(types), nres))
+    for pos in range(1, nres + 1):
+        res_energies = energy_obj.residue_total_energies(pos)
+        one_body_score_terms[:, pos-1] = [res_energies[t] for t in types]
+    return one_body_score_terms
+
+def extractSS(dssp):
     # Secondary structure term
-    dssp = rosetta.core.scoring.dssp.Dssp(pose)
-    dssp.insert_ss_into_pose(pose)
+    secstruct = dssp.get_dssp_secstruct()
     _map = {"H":1, "L":2, "E":3}
-    SS_mat = np.zeros((4, pose.size()))
-    for ires in range(1, pose.size()+1):
-        SS = pose.secstruct(ires)
-        SS_mat[_map.get(SS, 0), ires-1] = 1
+    SS_mat = np.zeros((4, len(secstruct)))
+    for ires in range(len(secstruct)):
+        SS_mat[_map.get(secstruct[ires], 0), ires] = 1
     return SS_mat
 
-def extractOneBodyTerms(pose, padval=0):
+# Needs a pose that has already been scored with get_scorefxn() if spec includes
+# rosetta features and a Dssp object if it includes ss. Rows of feature kinds
+# missing from spec are left as zeros.
+def extractOneBodyTerms(pose, atoms, dssp, padval=0, spec=feature_kinds):
     # All torsion angles in cosine/sine space
     # No transformation required
+    nres = atoms['nres']
     
     # Get angles and and bond length
-    bond_angles_lengths_mat = get_feature_matrix(pose, padval)
     features2 = ["NcCAc_len", "CAcCc_len", "CcNn_len", "CpNcCAc", "NcCAcCc", "CAcCcNn"]
-    averages = [1.456790, 1.524227, 1.333378, 2.125835, 1.947459, 2.039060]
-    bond_angles_lengths_mat = (bond_angles_lengths_mat.T-averages).T
-    for i in range(len(features2)):
-        bond_angles_lengths_mat[i] = np.tanh(bond_angles_lengths_mat[i])
+    bond_angles_lengths_mat = np.zeros((len(features2), nres))
+    if "angles" in spec:
+        bond_angles_lengths_mat = get_feature_matrix(atoms, padval)
+        averages = [1.456790, 1.524227, 1.333378, 2.125835, 1.947459, 2.039060]
+        bond_angles_lengths_mat = (bond_angles_lengths_mat.T-averages).T
+        for i in range(len(features2)):
+            bond_angles_lengths_mat[i] = np.tanh(bond_angles_lengths_mat[i])
         
     
     # 1 body energy terms
     score_terms = ["p_aa_pp", "rama_prepro", "omega", "fa_dun"]
-    fa_scorefxn = get_fa_scorefxn()
-    energy_term_mat = get_one_body_score_terms(pose, fa_scorefxn, score_terms)
-    for i in range(len(score_terms)):
-        if score_terms[i] != "fa_dun":
-            energy_term_mat[i] = np.tanh(energy_term_mat[i])
-        else:
-            energy_term_mat[i] = np.arcsinh(energy_term_mat[i])-1
+    energy_term_mat = np.zeros((len(score_terms), nres))
+    if "rosetta" in spec:
+        energy_term_mat = get_one_body_energies(pose, score_terms)
+        for i in range(len(score_terms)):
+            if score_terms[i] != "fa_dun":
+                energy_term_mat[i] = np.tanh(energy_term_mat[i])
+            else:
+                energy_term_mat[i] = np.arcsinh(energy_term_mat[i])-1
             
     # Secondary structure term
-    SS_mat = extractSS(pose)
+    SS_mat = np.zeros((4, nres))
+    if "ss" in spec:
+        SS_mat = extractSS(dssp)
         
     return np.concatenate([bond_angles_lengths_mat, energy_term_mat, SS_mat]), features2+score_terms+["E", "L", "H"]
 
-def init_pose(pose):
+# Builds the per-decoy context shared by all extractors.
+# Only the parts needed for the feature kinds in spec are computed.
+# The pose needs to be scored with get_scorefxn() beforehand if spec includes ss.
+# block is passed on to the pair features (see featurize).
+def init_pose(pose, spec=feature_kinds, block=None):
     pdict = {}
     pdict['pose'] = pose
+    if "ss" in spec:
+        pdict['dssp'] = pyrosetta.rosetta.core.scoring.dssp.Dssp(pose)
+    pdict['atoms'] = get_atom_table(pose)
     pdict['nres'] = pyrosetta.rosetta.core.pose.nres_protein(pdict['pose'])
-    pdict['N'], pdict['Ca'], pdict['C'], pdict['Cb'] = get_coords(pdict['pose'])
-    set_lframe(pdict)
-    set_neighbors6D(pdict)
-    set_neighbors3D(pdict)
-    set_features1D(pdict)
+    pdict['N'], pdict['Ca'], pdict['C'], pdict['Cb'] = get_coords(pdict['atoms'], pdict['nres'])
+    if "3d" in spec:
+        set_lframe(pdict)
+        set_neighbors3D(pdict, block=block)
+    if "orientation" in spec:
+        set_neighbors6D(pdict, block=block)
+    if "angles" in spec:
+        set_features1D(pdict)
     return pdict
 
+# In: atom table, Out: list of 3 letter amino acid names
+def get_aas(atoms):
+    return [n.split(":")[0].split("_")[0] for n in atoms['rname']]
+
+# Rows per task when the pair features of one decoy are split across processes
+parallel_block = 64
+
+# Context of the decoy a pair feature worker computes blocks of (see start_pair_features)
+_context = None
+
+def set_context(context):
+    global _context
+    _context = context
+
+# In: (kind, start, stop), Out: that pair feature for the residues start to stop-1
+def compute_block(task):
+    kind, start, stop = task
+    rows = np.arange(start, stop)
+    if kind == "maps":
+        return extract_multi_distance_map(_context['atoms'], rows)
+    if kind == "euler":
+        return get_euler_orientation(_context['atoms'], rows=rows)
+    if kind == "6d":
+        return get_rows6D(_context, rows)
+    if kind == "3d":
+        pdict = dict(_context)
+        set_neighbors3D(pdict, rows)
+        return pdict['idx'], pdict['val']
+
+# Starts computing pair features of pdict in a pool of processes, block rows per task.
+# kinds are the pair features to compute ("maps", "euler", "6d" and "3d" for voxels).
+# Only numpy arrays are sent to the workers. Out: pool, tasks and their pending results
+def start_pair_features(pdict, kinds, block, processes):
+    context = dict([(k, pdict[k]) for k in ['atoms', 'nres', 'N', 'Ca', 'C', 'Cb', 'lfr'] if k in pdict])
+    sizes = {"maps": pdict['atoms']['nres'], "euler": pdict['atoms']['nres'], "6d": pdict['nres'], "3d": pdict['nres']}
+    tasks = [(kind, start, min(start+block, sizes[kind])) for kind in kinds for start in range(0, sizes[kind], block)]
+    pool = multiprocessing.Pool(processes, initializer=set_context, initargs=(context,))
+    result = pool.map_async(compute_block, tasks)
+    pool.close()
+    return pool, tasks, result
+
+# Waits for the blocks of start_pair_features and merges them in task order,
+# so the features do not depend on the number of processes.
+def collect_pair_features(pdict, pool, tasks, result, dtype=np.float64):
+    blocks = result.get()
+    pool.join()
+    nres = pdict['atoms']['nres']
+    features = {}
+    idx = [np.zeros((0, 5), dtype=np.uint16)]
+    val = [np.zeros(0, dtype=np.float16)]
+    for (kind, start, stop), b in zip(tasks, blocks):
+        if kind == "maps":
+            if not 'maps' in features:
+                features['maps'] = np.empty((nres, nres, 4), dtype=dtype)
+            features['maps'][start:stop] = b
+        elif kind == "euler":
+            if not 'euler' in features:
+                features['euler'] = np.empty((nres, nres, 6), dtype=dtype)
+            features['euler'][start:stop] = b
+        elif kind == "6d":
+            for k in angle6d_keys:
+                if not k in features:
+                    features[k] = np.empty((pdict['nres'], pdict['nres']), dtype=dtype)
+                features[k][start:stop] = b[k]
+        elif kind == "3d":
+            idx.append(b[0])
+            val.append(b[1])
+    if any([t[0] == "3d" for t in tasks]):
+        features['idx'] = np.concatenate(idx)
+        features['val'] = np.concatenate(val)
+    return features
+
+# Computes the features of a pose for the feature kinds in spec.
+# Rosetta scoring and DSSP are skipped when spec does not need them.
+# With block, pair maps are float32 and computed block rows at a time (see get_block_size).
+# With processes > 1 the pair maps and voxels are computed by that many worker processes
+# while rosetta features are computed here.
+# With groups only those feature groups are computed (see feature_groups).
+# Out: dictionary of arrays as stored in .features.npz files (see save_features)
+def featurize(pose, spec=feature_kinds, block=None, processes=1, groups=None):
+    groups = get_groups(spec) if groups is None else groups
+    rosetta = "rosetta" in spec or "ss" in spec
+    if ("tbt" in groups and "rosetta" in spec) or ("obt" in groups and rosetta):
+        get_scorefxn()(pose)
+
+    # What the groups need from init_pose
+    kinds = []
+    if "obt" in groups and "ss" in spec:
+        kinds.append("ss")
+    if "voxels" in groups:
+        kinds.append("3d")
+    if "6d" in groups:
+        kinds.append("orientation")
+    if "phipsi" in groups:
+        kinds.append("angles")
+    maps = "maps" in groups or ("tbt" in groups and not "rosetta" in spec)
+    
+    if processes > 1:
+        pdict = init_pose(pose, [k for k in kinds if not k in ["3d", "orientation"]])
+        if "3d" in kinds:
+            set_lframe(pdict)
+        # rt6 needs the pose, so euler orientations are only computed by the workers when vectorized
+        pair_kinds = [k for k, g in [("maps", maps), ("euler", "euler" in groups and vectorized_euler), ("6d", "6d" in groups), ("3d", "voxels" in groups)] if g]
+        pending = start_pair_features(pdict, pair_kinds, parallel_block if block is None else block, processes)
+    else:
+        pdict = init_pose(pose, kinds, block)
+    # Pair feature workers do not outlive this call, also when anything below raises
+    pool = pending[0] if processes > 1 else None
+    try:
+        atoms = pdict['atoms']
+        nres = atoms['nres']
+    
+        features = {}
+        if "tbt" in groups and "rosetta" in spec:
+            features['tbt'], _ = extract_EnergyDistM(pose, energy_terms, atoms, block=block)
+        if "phipsi" in groups:
+            features['phi'] = pdict['phi']
+            features['psi'] = pdict['psi']
+        if "obt" in groups:
+            features['obt'], _ = extractOneBodyTerms(pose, atoms, pdict.get('dssp'), spec=spec)
+        if "prop" in groups:
+            features['prop'] = extract_AAs_properties_ver1(get_aas(atoms))
+        
+        # Pair features
+        if processes > 1:
+            if "euler" in groups and not vectorized_euler:
+                features['euler'] = getEulerOrientation(pose, atoms, block=block)
+            features.update(collect_pair_features(pdict, *pending, dtype=np.float64 if block is None else np.float32))
+        else:
+            if maps and block is None:
+                features['maps'] = extract_multi_distance_map(atoms)
+            elif maps:
+                features['maps'] = fill_row_blocks(np.empty((nres, nres, 4), dtype=np.float32), extract_multi_distance_map, atoms, block)
+            if "voxels" in groups:
+                features['idx'] = pdict['idx']
+                features['val'] = pdict['val']
+            if "6d" in groups:
+                features['omega6d'] = pdict['omega6d']
+                features['theta6d'] = pdict['theta6d']
+                features['phi6d'] = pdict['phi6d']
+            if "euler" in groups:
+                features['euler'] = getEulerOrientation(pose, atoms, block=block)
+    finally:
+        if pool is not None:
+            pool.terminate()
+    if "tbt" in groups and not "rosetta" in spec:
+        # Only the distance channel
+        features['tbt'] = np.expand_dims(features['maps'][:,:,0], 0)
+    if not "maps" in groups and maps:
+        del features['maps']
+    return features
+
+# Largest distance of any heavy atom of a residue from its CB plus the CA-CB bond (arginine).
+# Bounds how far a residue's CB can be from CA atoms whose 14A environment it is part of.
+environment_margin = 8.0
+
+# In: new atom table and context, changed residues and parent features,
+# Out: sorted residues whose voxels need to be recomputed.
+# Those are the changed residues and every residue with a changed atom within the 14A
+# voxelization radius of its CA, now or in the parent. Parent coordinates are not kept,
+# so the parent side is bounded with its CB distance map.
+def get_changed_environment(pdict, changed, parent):
+    atoms = pdict['atoms']
+    moved = np.isin(atoms['resi'], changed) & (atoms['atype'] >= 0)
+    near = scipy.spatial.cKDTree(pdict['Ca']).query_ball_point(atoms['xyz'][moved], 14.0)
+    near = np.array([i for js in near for i in js], dtype=np.int64)
+    before = np.where(np.any(parent['maps'][changed,:,0] < 14.0+environment_margin, axis=0))[0]
+    return np.unique(np.concatenate([changed, near, before]))
+
+# Scores pose as spec needs and returns its context without any pair features.
+# atoms is the atom table of pose if the caller already has it.
+def init_partial(pose, spec=feature_kinds, atoms=None):
+    if "rosetta" in spec or "ss" in spec:
+        get_scorefxn()(pose)
+    pdict = {}
+    pdict['pose'] = pose
+    if "ss" in spec:
+        pdict['dssp'] = pyrosetta.rosetta.core.scoring.dssp.Dssp(pose)
+    pdict['atoms'] = get_atom_table(pose) if atoms is None else atoms
+    pdict['nres'] = pyrosetta.rosetta.core.pose.nres_protein(pdict['pose'])
+    pdict['N'], pdict['Ca'], pdict['C'], pdict['Cb'] = get_coords(pdict['atoms'], pdict['nres'])
+    if "3d" in spec:
+        set_lframe(pdict)
+    return pdict
+
+# In: parent features, context of a pose from init_partial that differs from parent
+# in the residues changed (sorted), and spec, Out: features of the pose.
+# Pair maps are recomputed in the rows and columns of changed, energies in those of
+# energy_rows and voxels of voxel_residues (by default changed and the residues whose
+# 14A environment changed). Per residue features are recomputed in full.
+def update_features(parent, pdict, changed, spec=feature_kinds, energy_rows=None, voxel_residues=None):
+    pose = pdict['pose']
+    atoms = pdict['atoms']
+    energy_rows = changed if energy_rows is None else energy_rows
+
+    features = {}
+    rows = extract_multi_distance_map(atoms, changed)
+    features['maps'] = np.array(parent['maps'])
+    features['maps'][changed] = rows
+    features['maps'][:, changed] = rows[:,:,[0,1,3,2]].transpose(1,0,2)
+    if "rosetta" in spec:
+        features['tbt'], _ = extract_EnergyDistM(pose, energy_terms, atoms, energy_rows, parent['tbt'])
+    else:
+        features['tbt'] = np.expand_dims(features['maps'][:,:,0], 0)
+    if "3d" in spec:
+        residues = get_changed_environment(pdict, changed, parent) if voxel_residues is None else voxel_residues
+        set_neighbors3D(pdict, residues)
+        # Same entries as a full voxelization, in a different order
+        keep = ~np.isin(parent['idx'][:,0], residues)
+        features['idx'] = np.concatenate([parent['idx'][keep], pdict['idx']])
+        features['val'] = np.concatenate([parent['val'][keep], pdict['val']])
+    if "angles" in spec:
+        set_features1D(pdict)
+        features['phi'] = pdict['phi']
+        features['psi'] = pdict['psi']
+    if "orientation" in spec:
+        for k in angle6d_keys:
+            pdict[k] = parent[k]
+        set_neighbors6D(pdict, changed)
+        features['omega6d'] = pdict['omega6d']
+        features['theta6d'] = pdict['theta6d']
+        features['phi6d'] = pdict['phi6d']
+        features['euler'] = np.array(parent['euler'])
+        features['euler'][changed] = get_pair_orientation(pose, atoms, rows=changed)
+        features['euler'][:, changed] = get_pair_orientation(pose, atoms, cols=changed)
+    if "angles" in spec or "rosetta" in spec or "ss" in spec:
+        features['obt'], _ = extractOneBodyTerms(pose, atoms, pdict.get('dssp'), spec=spec)
+    if "aa" in spec:
+        features['prop'] = extract_AAs_properties_ver1(get_aas(atoms))
+    return features
+
+# Incremental featurization of a pose that differs from an already featurized parent.
+# In: parent features (see featurize), 0-based indices of every residue that was mutated or
+# moved, the new pose and the spec parent was computed with.
+# Out: features of pose as computed by featurize(pose, spec).
+# Pair maps are only recomputed in the rows and columns of changed, energies only on
+# the energy graph edges touching changed and voxels only for residues whose 14A
+# environment changed. Per residue features are recomputed in full.
+def refeaturize(parent, changed, pose, spec=feature_kinds):
+    changed = np.unique(np.asarray(changed, dtype=np.int64))
+    pdict = init_partial(pose, spec)
+    if pdict['atoms']['nres'] != parent['maps'].shape[0]:
+        raise ValueError("Pose has %d residues, parent features %d" % (pdict['atoms']['nres'], parent['maps'].shape[0]))
+    return update_features(parent, pdict, changed, spec)
+
+# Intra-block features of chains that stay fixed across decoys (see featurize_fixed),
+# keyed by their coordinates. Kept per process, the oldest entries are dropped first.
+_chain_cache = {}
+chain_cache_size = 4
+
+# Pair features cached for fixed chains
+chain_cache_keys = ['maps', 'tbt', 'omega6d', 'theta6d', 'phi6d', 'euler']
+
+# In: atom table, residue indices and spec, Out: key of the coordinates and residue types
+def get_chain_key(atoms, residues, spec):
+    h = hashlib.sha1()
+    h.update(np.ascontiguousarray(atoms['xyz'][np.isin(atoms['resi'], residues)]).tobytes())
+    h.update(",".join(atoms['rname'][residues]).encode())
+    h.update(",".join(spec).encode())
+    return h.hexdigest()
+
+# In: atom table, fixed and other residues,
+# Out: fixed residues with an atom of the other residues within 14A of their CA.
+# Their voxels and energies (backbone hydrogen bonds exclude others) depend on the other chains.
+def get_interface(atoms, fixed, others):
+    near = scipy.spatial.cKDTree(get_atom_xyz(atoms, "CA")[fixed]).query_ball_point(atoms['xyz'][np.isin(atoms['resi'], others)], 14.0)
+    return np.unique(np.array([fixed[i] for js in near for i in js], dtype=np.int64))
+
+# Featurization for decoys that share fixed chains, as in binder design where the target
+# chain is identical in every decoy. The fixed-fixed blocks of the pair features and the voxels
+# of fixed residues are cached from the first decoy and only the rows and columns of the
+# other chains (and of fixed residues at the interface) are computed for the next ones.
+# Chains are pdb chain names like analyze.get_interaction_map reads.
+# Full featurizations use block and processes like featurize.
+# Out: features of pose as computed by featurize(pose, spec).
+def featurize_fixed(pose, fixed_chains, spec=feature_kinds, block=None, processes=1):
+    atoms = get_atom_table(pose)
+    nres = atoms['nres']
+    fixed = np.where(np.isin(atoms['chain'], fixed_chains))[0]
+    others = np.where(~np.isin(atoms['chain'], fixed_chains))[0]
+    if len(fixed) == 0 or len(others) == 0 or pyrosetta.rosetta.core.pose.nres_protein(pose) != nres:
+        return featurize(pose, spec, block, processes)
+    interface = get_interface(atoms, fixed, others)
+    key = get_chain_key(atoms, fixed, spec)
+
+    if not key in _chain_cache:
+        features = featurize(pose, spec, block, processes)
+        entry = dict([(k, features[k][np.ix_(fixed, fixed)]) for k in chain_cache_keys if k in features and k != 'tbt'])
+        entry['tbt'] = features['tbt'][:, fixed][:, :, fixed]
+        if "3d" in spec:
+            keep = np.isin(features['idx'][:,0], fixed)
+            entry['idx'] = features['idx'][keep]
+            entry['idx'][:,0] = np.searchsorted(fixed, entry['idx'][:,0])
+            entry['val'] = features['val'][keep]
+        # Rows that saw the other chains of this decoy
+        entry['interface'] = np.searchsorted(fixed, interface)
+        _chain_cache[key] = entry
+        if len(_chain_cache) > chain_cache_size:
+            del _chain_cache[next(iter(_chain_cache))]
+        return features
+
+    # Parent features holding the cached fixed-fixed blocks
+    entry = _chain_cache[key]
+    parent = {}
+    for k in chain_cache_keys:
+        if k in entry and k != 'tbt':
+            parent[k] = np.zeros((nres, nres)+entry[k].shape[2:], dtype=entry[k].dtype)
+            parent[k][np.ix_(fixed, fixed)] = entry[k]
+    parent['tbt'] = np.zeros((entry['tbt'].shape[0], nres, nres), dtype=entry['tbt'].dtype)
+    parent['tbt'][np.ix_(np.arange(entry['tbt'].shape[0]), fixed, fixed)] = entry['tbt']
+    if "3d" in spec:
+        parent['idx'] = np.array(entry['idx'])
+        parent['idx'][:,0] = fixed[entry['idx'][:,0]]
+        parent['val'] = entry['val']
+    recompute = np.union1d(np.union1d(others, interface), fixed[entry['interface']])
+    return update_features(parent, init_partial(pose, spec, atoms), others, spec, recompute, recompute)
+
+# In: lines of one structure of a silent file, preceded by the file header, Out: pose
+def pose_from_silent_lines(lines):
+    options = pyrosetta.rosetta.core.io.silent.SilentFileOptions()
+    silent_type = "binary" if any(["BINARY" in l for l in lines if l.startswith("REMARK")]) else "protein"
+    silent_struct = pyrosetta.rosetta.core.io.silent.SilentStructFactory.get_instance().get_silent_struct(silent_type, options)
+    silent_struct.init_from_lines(pyrosetta.rosetta.utility.vector1_std_string([l.rstrip("\n") for l in lines]),
+                                  pyrosetta.rosetta.core.io.silent.SilentFileData(options))
+    pose = Pose()
+    silent_struct.fill_pose(pose)
+    return pose
+
+# In: structure (see structureIO), Out: pose
+def load_pose(structure):
+    pose = Pose()
+    if isinstance(structure, str):
+        pose_from_file(pose, structure)
+    elif structure[2] == "silent":
+        pose = pose_from_silent_lines(read_structure_lines(structure))
+    else:
+        pyrosetta.rosetta.core.import_pose.pose_from_pdbstring(pose, "".join(read_structure_lines(structure)))
+    return pose
+
+# In: (input structure, output .features.npz, verbose) and optionally a feature spec,
+# the number of processes to split the pair features of the decoy across
+# and chains that are the same in every decoy (see featurize_fixed). Out: True on success
 def process(args):
-    filename, outfile, verbose = args
+    filename, outfile, verbose = args[:3]
+    spec = args[3] if len(args) > 3 else feature_kinds
+    processes = args[4] if len(args) > 4 else 1
+    fixed_chains = args[5] if len(args) > 5 else []
     try:
         start_time = time.time()
-        pose = Pose()
-        pose_from_file(pose, filename)
-        fa_scorefxn = get_fa_scorefxn()
-        score = fa_scorefxn(pose)
-
-        pdict = init_pose(pose)
-        
-        euler = getEulerOrientation(pose)
-        maps = extract_multi_distance_map(pose)
-        _2df, aas = extract_EnergyDistM(pose, energy_terms)
-        _1df, _ = extractOneBodyTerms(pose)
-        prop = extract_AAs_properties_ver1(aas)
-
-        np.savez_compressed(outfile,
-            idx = pdict['idx'],
-            val = pdict['val'],
-            phi = pdict['phi'],
-            psi = pdict['psi'],
-            omega6d = pdict['omega6d'],
-            theta6d = pdict['theta6d'],
-            phi6d = pdict['phi6d'],
-            tbt = _2df,
-            obt = _1df,
-            prop = prop,
-            euler = euler,
-            maps = maps)
-        if verbose: print("Processed "+filename+" (%0.2f seconds)" % (time.time() - start_time))
+        init_rosetta()
+        pose = load_pose(filename)
+        if len(fixed_chains) > 0:
+            features = featurize_fixed(pose, fixed_chains, spec, get_block_size(pose.size()), processes)
+        else:
+            features = featurize(pose, spec, get_block_size(pose.size()), processes)
+        save_features(outfile, features, spec)
+        if verbose: print("Processed "+get_structure_label(filename)+" (%0.2f seconds)" % (time.time() - start_time))
+        return True
+    except Exception as inst:
+        print("While processing", outfile+":", inst)
+        return False
+
+# Same as process for an existing output file, but only the feature groups it lacks or holds
+# from an older extractor version (see feature_versions) are recomputed, the rest is kept.
+# Features are computed for the kinds of spec and of the file together.
+def refresh(args):
+    filename, outfile, verbose = args[:3]
+    spec = args[3] if len(args) > 3 else feature_kinds
+    processes = args[4] if len(args) > 4 else 1
+    try:
+        start_time = time.time()
+        if feature_exists(outfile):
+            stored = get_spec(open_features(outfile))
+            spec = [k for k in feature_kinds if k in spec or k in stored]
+        stale = get_stale_groups(outfile, spec)
+        if len(stale) == 0:
+            return True
+        kept = [g for g in get_groups(spec) if not g in stale]
+        features = load_groups(outfile, kept) if len(kept) > 0 else {}
+        init_rosetta()
+        pose = load_pose(filename)
+        features.update(featurize(pose, spec, get_block_size(pose.size()), processes, stale))
+        save_features(outfile, features, spec)
+        if verbose: print("Refreshed "+", ".join(stale)+" of "+get_structure_label(filename)+" (%0.2f seconds)" % (time.time() - start_time))
+        return True
     except Exception as inst:
-        print("While processing", outfile+":", inst)
\ No newline at end of file
+        print("While refreshing", outfile+":", inst)
+        return False
@@ -0,0 +1,224 @@
+import numpy as np
+import scipy.spatial
+from scipy.spatial import distance_matrix
+
+# Per-residue atom index tables stored in an atom table.
+# Each of them points into atoms["xyz"] and is -1 when the residue lacks the atom.
+residue_atoms = ["N", "CA", "C", "CB", "tip"]
+
+# In: atom table and atom name, Out: (nres, 3) coordinates of that atom for every residue.
+# Residues that do not have the atom (e.g. CB of glycine) use CA instead.
+def get_atom_xyz(atoms, name="CA"):
+    index = atoms[name]
+    index = np.where(index < 0, atoms["CA"], index)
+    return atoms["xyz"][index]
+
+# In: atom table, Out: distance map between atom1 of residue i and atom2 of residue j.
+# With rows only the rows i in rows are computed, (len(rows), nres).
+def get_table_distmaps(atoms, atom1="CA", atom2="CA", rows=None):
+    xyz1 = get_atom_xyz(atoms, atom1)
+    if rows is not None:
+        xyz1 = xyz1[rows]
+    return distance_matrix(xyz1, get_atom_xyz(atoms, atom2))
+
+# In: atom table, Out: distance maps with different atoms
+# With rows only the rows i in rows are computed, (len(rows), nres, 4).
+# The columns of rows are the transpose of that with the CA-tip and tip-CA maps swapped.
+def extract_multi_distance_map(atoms, rows=None):
+    # Get CB to CB distance map use CA if CB does not exist
+    x1 = get_table_distmaps(atoms, atom1="CB", atom2="CB", rows=rows)
+    # Get Tip to Tip distancemap
+    x2 = get_table_distmaps(atoms, atom1="tip", atom2="tip", rows=rows)
+    # Get CA to Tip distancemap
+    x3 = get_table_distmaps(atoms, atom1="CA", atom2="tip", rows=rows)
+    # Get Tip to CA distancemap
+    x4 = get_table_distmaps(atoms, atom1="tip", atom2="CA", rows=rows)
+    output = np.stack([x1,x2,x3,x4], axis=-1)
+    return output
+
+# In: atom table, Out: CB to CB distance map (CA if CB does not exist)
+def get_cb_distmap(atoms, rows=None):
+    return get_table_distmaps(atoms, atom1="CB", atom2="CB", rows=rows)
+
+# In: (n, 3) vectors, Out: angles between them in radian
+def get_vector_angles(v, w):
+    x = np.sum(v*w, axis=-1)/(np.linalg.norm(v, axis=-1)*np.linalg.norm(w, axis=-1))
+    return np.arccos(np.clip(x, -1.0, 1.0))
+
+# In: atom table, Out: (6, nres) backbone bond lengths and angles.
+# Rows are N(k)-CA(k), CA(k)-C(k), C(k)-N(k+1) lengths and
+# C(k-1)-N(k)-CA(k), N(k)-CA(k)-C(k), CA(k)-C(k)-N(k+1) angles.
+# Terms that do not make sense at the termini are set to padval.
+def get_feature_matrix(atoms, padval=0):
+    N = get_atom_xyz(atoms, "N")
+    CA = get_atom_xyz(atoms, "CA")
+    C = get_atom_xyz(atoms, "C")
+    nres = N.shape[0]
+
+    result = np.zeros((6, nres)) + padval
+    result[0] = np.linalg.norm(CA-N, axis=-1)
+    result[1] = np.linalg.norm(C-CA, axis=-1)
+    result[2, :-1] = np.linalg.norm(N[1:]-C[:-1], axis=-1)
+    result[3, 1:] = get_vector_angles(C[:-1]-N[1:], CA[1:]-N[1:])
+    result[4] = get_vector_angles(N-CA, C-CA)
+    result[5, :-1] = get_vector_angles(CA[:-1]-C[:-1], N[1:]-C[:-1])
+    return result
+
+# In: (n, 3) vectors, Out: unit vectors
+def normalize(v):
+    return v/np.linalg.norm(v, axis=-1)[:,None]
+
+# In: atom table, Out: (3, nres, 3) axes and (nres, 3) origins of the backbone frames.
+# Same frame as rosetta's core::pose::motif::get_backbone_reference_frame,
+# which get_residue_pair_rt6 uses as residue stubs.
+def get_backbone_frames(atoms):
+    N = get_atom_xyz(atoms, "N")
+    CA = get_atom_xyz(atoms, "CA")
+    C = get_atom_xyz(atoms, "C")
+    e1 = normalize(C+N-2.0*CA)
+    e3 = normalize(np.cross(C-CA, N-CA))
+    e2 = normalize(np.cross(e3, e1))
+    e3 = np.cross(e1, e2)
+    return np.stack([e1, e2, e3]), CA
+
+# In: atom table, Out: (nres, nres, 6) euler angles of residue-pair orientations.
+# Vectorized version of the get_residue_pair_rt6 loop in pyprotein.get_rt6_orientation,
+# used when pyprotein.vectorized_euler is set.
+# The stub transform from residue i to j is inverse(frame_i)*frame_j, whose translation
+# and zxz euler angles (numeric::xyzTransform::euler_angles) are computed for all pairs at once.
+# Like the rt6 path, translations go through deg2rad as well.
+# With rows and/or cols only the block of pairs (rows, cols) is computed.
+def get_euler_orientation(atoms, rows=None, cols=None):
+    axes, origin = get_backbone_frames(atoms)
+    nres = origin.shape[0]
+    rows = np.arange(nres) if rows is None else np.asarray(rows)
+    cols = np.arange(nres) if cols is None else np.asarray(cols)
+    ai = axes[:,rows]
+    aj = axes[:,cols]
+
+    # Entries of the relative rotation R = Ri^T Rj; R[a][b][i,j] = axes[a][i] . axes[b][j]
+    R = [[np.dot(ai[a], aj[b].T) for b in range(3)] for a in range(3)]
+
+    # Translation expressed in the frame of residue i
+    trans = np.stack([np.dot(ai[a], origin[cols].T) - np.sum(ai[a]*origin[rows], axis=-1)[:,None] for a in range(3)], axis=-1)
+
+    # zxz euler angles. When R.zz is +-1 the first and last rotations
+    # are about the same axis, so the whole rotation goes to the first angle.
+    rot = np.zeros((len(rows), len(cols), 3))
+    degenerate = np.abs(R[2][2]) >= 1.0-1e-6
+    rot[:,:,0] = np.where(degenerate, np.arctan2(R[1][0], R[0][0]), np.arctan2(R[0][2], -R[1][2]))
+    rot[:,:,1] = np.where(degenerate, 0.0, np.arctan2(R[2][0], R[2][1]))
+    rot[:,:,2] = np.arccos(np.clip(R[2][2], -1.0, 1.0))
+    rot = np.mod(rot, 2*np.pi)
+
+    output = np.concatenate([np.deg2rad(trans), rot], axis=2)
+    output[rows[:,None] == cols[None,:]] = 0
+    return output
+
+# Fills a preallocated (nres, nres, ...) output block rows at a time with f(atoms, rows=rows),
+# so that temporaries only ever cover block rows. Values are cast to the dtype of out.
+def fill_row_blocks(out, f, atoms, block):
+    nres = out.shape[0]
+    for start in range(0, nres, block):
+        rows = np.arange(start, min(start+block, nres))
+        out[start:start+len(rows)] = f(atoms, rows=rows)
+    return out
+
+# Structures with more residues than large_threshold are featurized in large mode:
+# pair maps are float32 and computed large_block rows at a time into preallocated arrays,
+# which keeps peak memory at the size of the outputs.
+large_threshold = 1500
+large_block = 256
+
+# In: number of residues, Out: row block size to featurize with (None for dense float64)
+def get_block_size(nres):
+    return large_block if nres > large_threshold else None
+
+# In: KD tree and coordinates of CB atoms, residue indices and cutoff,
+# Out: pairs (i, j) of every residue i in rows and its neighbors j != i
+def get_row_neighbors(kd, Cb, rows, dmax):
+    neighbors = kd.query_ball_point(Cb[rows], dmax)
+    counts = np.fromiter(map(len, neighbors), dtype=np.int64, count=len(neighbors))
+    idx0 = np.repeat(rows, counts)
+    idx1 = np.concatenate(neighbors).astype(np.int64) if counts.sum() > 0 else np.zeros(0, dtype=np.int64)
+    keep = idx0 != idx1
+    return idx0[keep], idx1[keep]
+
+# With residues only the voxels of those residues are computed.
+# Residues are voxelized block at a time, which bounds the temporaries to block residues.
+def set_neighbors3D(pdict, residues=None, block=None):
+
+    # get coordinates of all typed non-hydrogen atoms
+    # and their types
+    atoms = pdict['atoms']
+    nres = pdict['nres']
+    typed = (atoms['atype'] >= 0) & (atoms['resi'] < nres)
+    xyz = atoms['xyz'][typed]
+    types = atoms['atype'][typed]
+
+    residues = np.arange(nres) if residues is None else np.asarray(residues)
+    block = max(len(residues), 1) if block is None else block
+    xyz_ca = pdict['Ca']
+    lfr = pdict['lfr']
+
+    # find neighbors and project onto
+    # local reference frames
+    dist = 14.0
+    kd = scipy.spatial.cKDTree(xyz)
+    idx = [np.zeros((0, 5), dtype=np.uint16)]
+    val = [np.zeros(0, dtype=np.float16)]
+    for start in range(0, len(residues), block):
+        chunk = residues[start:start+block]
+        kd_ca = scipy.spatial.cKDTree(xyz_ca[chunk])
+        contacts = kd_ca.sparse_distance_matrix(kd, dist, output_type='ndarray')
+        contacts = contacts[np.lexsort((contacts['j'], contacts['i']))]
+        res = chunk[contacts['i']]
+        atm = contacts['j']
+
+        xyz_shift = xyz[atm] - xyz_ca[res]
+        xyz_new = np.sum(lfr[res] * xyz_shift[:,None,:], axis=-1)
+
+        i, v = voxelize(res, types[atm], xyz_new)
+        idx.append(i)
+        val.append(v)
+
+    pdict['idx'] = np.concatenate(idx)
+    pdict['val'] = np.concatenate(val)
+
+
+# Trilinear interpolation of atoms projected onto local frames into 24^3 grids.
+# In: residue index, atom type and local coordinates of every contact,
+# Out: idx (contacts, 5) uint16 of (residue, x, y, z, type) and val (contacts,) float16
+# Every contact spreads into the 8 corners of its cell. Corners falling outside the box
+# or with negligible weight are dropped before the output arrays are written.
+def voxelize(res, types, xyz_new, nbins=24, width=19.2):
+
+    # bin size
+    h = width / (nbins-1)
+    
+    # shift all contacts to the center of the box
+    # and scale the coordinates by h
+    xyz = (xyz_new + 0.5 * width) / h
+
+    # discretized x,y,z coordinates
+    klm = np.floor(xyz).astype(dtype=np.int16)
+
+    # atom coordinates in the cell it occupies
+    d = xyz - np.floor(xyz)
+
+    # offsets of the 8 cell corners and their interpolation weights
+    corners = np.array([[0,0,0], [1,0,0], [0,1,0], [1,1,0],
+                        [0,0,1], [1,0,1], [0,1,1], [1,1,1]], dtype=np.int16)
+    V = np.where(corners[:,None,:] == 1, d[None,:,:], 1-d[None,:,:])
+    V = V[:,:,0] * V[:,:,1] * V[:,:,2]
+    klm = klm[None,:,:] + corners[:,None,:]
+    
+    # make sure projected contacts fit into the box
+    keep = (np.min(klm, axis=-1) >= 0) & (np.max(klm, axis=-1) < nbins) & (V > 1e-5)
+    
+    idx = np.empty((np.count_nonzero(keep), 5), dtype=np.uint16)
+    idx[:,0] = np.broadcast_to(res, keep.shape)[keep]
+    idx[:,1:4] = klm[keep]
+    idx[:,4] = np.broadcast_to(types, keep.shape)[keep]
+    val = V[keep].astype(np.float16)
+    return idx, val
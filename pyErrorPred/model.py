@@ -33,6 +33,7 @@ class Model:
                  partial_instance_norm=False,
                  transpose_matrix=False,
                  self_attention=False,
+                 own_graph=False,
                  verbose=False):
 
         # Defining network architecture
@@ -58,14 +59,21 @@ class Model:
         self.verbose = verbose
 
         # Reset all existing graphs and rebuild them.
+        # With own_graph, the model is built in a graph of its own instead,
+        # so that several models can be loaded at the same time.
         # Allow gpu memory growth to combat error.
-        tf.reset_default_graph()
+        if own_graph:
+            graph = tf.Graph()
+        else:
+            tf.reset_default_graph()
+            graph = tf.get_default_graph()
         self.built = False
         config = tf.ConfigProto()
         config.gpu_options.allow_growth=True
-        self.sesh = tf.Session(config=config)
-        self.ops = self.build()
-        self.sesh.run(tf.global_variables_initializer())
+        self.sesh = tf.Session(graph=graph, config=config)
+        with graph.as_default():
+            self.ops = self.build()
+            self.sesh.run(tf.global_variables_initializer())
 
         # Keep track of training parameters.
         self.e = 0
@@ -445,10 +453,15 @@ class Model:
         
         return self.sesh.run(operations, feed_dict=feed_dict)
 
+    # Saver of the variables of the model's graph
+    def get_saver(self):
+        with self.sesh.graph.as_default():
+            return tf.train.Saver(tf.all_variables())
+
     # Saving model
     def save(self, folder, flag=True):
         if self.name != None:
-            saver = tf.train.Saver(tf.all_variables())
+            saver = self.get_saver()
             os.system("mkdir "+folder)
             saver.save(self.sesh, folder+"/model.ckpt")
         if flag:
@@ -462,14 +475,14 @@ class Model:
             if self.name != None:
                 self.verbose: print("Epoch:", e)
                 folder = "%s_%d" % (self.name, self.e)
-                saver = tf.train.Saver(tf.all_variables())
+                saver = self.get_saver()
                 saver.restore(self.sesh, folder+"/model.ckpt")
                 for k in self.loss.keys():
                     self.loss[k] = np.load(folder+"/"+k+".npy").tolist()
         else:
             if self.name != None:
                 folder = self.name
-                saver = tf.train.Saver(tf.all_variables())
+                saver = self.get_saver()
                 saver.restore(self.sesh, folder+"/model.ckpt")
                                 
                 f=open(folder+"/README.md", "r")
@@ -0,0 +1,181 @@
+import numpy as np
+import time
+from .conversion import *
+from .geometry import *
+from .featureIO import *
+from .structureIO import *
+
+# Rosetta free featurization of pdb files.
+# Parses ATOM records straight into the atom table format of featurize.get_atom_table,
+# which is all the distance-only reference network needs. Nothing here imports pyrosetta.
+
+# Feature kinds that can be computed without pyrosetta
+pdb_feature_kinds = ["distance"]
+
+# SG-SG distance rosetta uses to detect disulfides (Conformation::detect_disulfides)
+disulfide_distance = 2.02
+disulfide_tolerance = 0.5
+
+# In: pdb atom name and element column, Out: True for hydrogens
+def is_hydrogen(aname, element):
+    if element != "":
+        return element == "H"
+    return aname.lstrip("0123456789")[:1] == "H"
+
+# In: lines of a pdb file, Out: list of residues (chain, 3 letter name, {atom name: xyz}, chain end flag).
+# Follows what pose_from_file keeps: the first model, standard amino acids of ATOM records,
+# the first alternate location and atoms with non-zero occupancy.
+# Residues without a complete backbone are dropped, the chain end moves to the residue before.
+def read_residues(lines):
+    residues = []
+    key = None
+    for line in lines:
+        record = line[:6]
+        if record == "ENDMDL":
+            break
+        if record.startswith("TER"):
+            if len(residues) > 0:
+                residues[-1][3] = True
+            continue
+        if record != "ATOM  ":
+            continue
+        rname = line[17:20]
+        if not rname in dict_3LAA_to_1LAA:
+            continue
+        altloc = line[16]
+        occupancy = line[54:60].strip()
+        if occupancy != "" and float(occupancy) == 0:
+            continue
+        chain = line[21]
+        if (chain, line[22:27]) != key:
+            key = (chain, line[22:27])
+            if len(residues) > 0 and residues[-1][0] != chain:
+                residues[-1][3] = True
+            residues.append([chain, rname, {}, False, altloc])
+        aname = line[12:16].strip()
+        if is_hydrogen(aname, line[76:78].strip()):
+            # Only kept to tell histidine tautomers apart
+            if rname == "HIS" and aname in ["HD1", "HE2"]:
+                residues[-1][2][aname] = None
+            continue
+        if altloc != " " and residues[-1][4] != " " and altloc != residues[-1][4]:
+            continue
+        if residues[-1][4] == " ":
+            residues[-1][4] = altloc
+        if not aname in residues[-1][2]:
+            residues[-1][2][aname] = (float(line[30:38]), float(line[38:46]), float(line[46:54]))
+    if len(residues) > 0:
+        residues[-1][3] = True
+    kept = []
+    for r in residues:
+        if all([a in r[2] for a in ["N", "CA", "C"]]):
+            kept.append(r[:4])
+        elif r[3] and len(kept) > 0:
+            # The chain now ends at the last residue kept
+            kept[-1][3] = True
+    return kept
+
+# In: list of residues from read_residues, Out: residue type names as rosetta would assign them.
+# Chain termini get the terminus patches, bonded cysteines the disulfide patch and
+# histidines protonated only at ND1 become HIS_D.
+def get_rosetta_names(residues):
+    names = [r[1] for r in residues]
+    for i in range(len(residues)):
+        if names[i] == "HIS" and "HD1" in residues[i][2] and not "HE2" in residues[i][2]:
+            names[i] = "HIS_D"
+
+    # Disulfides
+    cys = [i for i in range(len(residues)) if residues[i][1] == "CYS" and "SG" in residues[i][2]]
+    if len(cys) > 1:
+        sg = np.array([residues[i][2]["SG"] for i in cys])
+        d = np.linalg.norm(sg[:,None]-sg[None,:], axis=-1)
+        np.fill_diagonal(d, np.inf)
+        bonded = np.any(np.abs(d-disulfide_distance) < disulfide_tolerance, axis=1)
+        for k in np.where(bonded)[0]:
+            names[cys[k]] = names[cys[k]]+":disulfide"
+
+    # Termini
+    for i in range(len(residues)):
+        if i == 0 or residues[i-1][3]:
+            names[i] = names[i]+":NtermProteinFull"
+        if residues[i][3]:
+            names[i] = names[i]+":CtermProteinFull"
+    return names
+
+# In: lines of a pdb file, Out: atom table (see featurize.get_atom_table).
+# Atom types are not assigned (atype is -1), the table only serves distance features.
+def get_pdb_atom_table(lines):
+    residues = read_residues(lines)
+    rnames = get_rosetta_names(residues)
+    nres = len(residues)
+    xyz = []
+    resi = []
+    index = dict([(a, np.full(nres, -1, dtype=np.int32)) for a in residue_atoms])
+    for i in range(nres):
+        # Tip atoms are looked up with the full residue type name like get_distmaps does
+        tip = dict_3LAA_to_tip.get(rnames[i], "CA")
+        for aname, v in residues[i][2].items():
+            if v is None:
+                continue
+            if aname in ["N", "CA", "C", "CB"]:
+                index[aname][i] = len(xyz)
+            if aname == tip:
+                index["tip"][i] = len(xyz)
+            xyz.append(v)
+            resi.append(i)
+
+    atoms = {}
+    atoms['nres'] = nres
+    atoms['xyz'] = np.array(xyz).reshape(-1, 3)
+    atoms['resi'] = np.array(resi, dtype=np.int32)
+    atoms['atype'] = np.full(len(xyz), -1, dtype=np.int16)
+    atoms['rname'] = np.array(rnames)
+    atoms['chain'] = np.array([r[0] for r in residues])
+    atoms.update(index)
+    return atoms
+
+# In: pdb file name, Out: atom table
+def read_pdb(filename):
+    with open(filename) as f:
+        return get_pdb_atom_table(f)
+
+# In: structure (see structureIO), Out: atom table
+def read_structure(structure):
+    if isinstance(structure, str):
+        return read_pdb(structure)
+    if structure[2] == "silent":
+        raise ValueError("Silent files need pyrosetta")
+    return get_pdb_atom_table(read_structure_lines(structure))
+
+# Computes the features of an atom table for spec without pyrosetta.
+# With block, pair maps are float32 and computed block rows at a time (see get_block_size).
+# Out: dictionary of arrays as stored in .features.npz files (see featurize.featurize)
+def featurize_pdb(atoms, spec=pdb_feature_kinds, block=None):
+    missing = [s for s in spec if not s in pdb_feature_kinds]
+    if len(missing) > 0:
+        raise ValueError("Features need pyrosetta: "+", ".join(missing))
+    nres = atoms['nres']
+    features = {}
+    if block is None:
+        features['maps'] = extract_multi_distance_map(atoms)
+    else:
+        features['maps'] = fill_row_blocks(np.empty((nres, nres, 4), dtype=np.float32), extract_multi_distance_map, atoms, block)
+    features['tbt'] = np.expand_dims(features['maps'][:,:,0], 0)
+    return features
+
+# In: (input structure, output .features.npz, verbose) and optionally a feature spec.
+# Same as featurize.process but reads the pdb with numpy only. Decoys are not split
+# across processes, distance maps alone are cheap. Out: True on success
+def process_pdb(args):
+    filename, outfile, verbose = args[:3]
+    spec = args[3] if len(args) > 3 else pdb_feature_kinds
+    try:
+        start_time = time.time()
+        atoms = read_structure(filename)
+        features = featurize_pdb(atoms, spec, get_block_size(atoms['nres']))
+        save_features(outfile, features, spec)
+        if verbose: print("Processed "+get_structure_label(filename)+" (%0.2f seconds)" % (time.time() - start_time))
+        return True
+    except Exception as inst:
+        print("While processing", outfile+":", inst)
+        return False
@@ -3,113 +3,123 @@ import os
 import tensorflow as tf
 tf.logging.set_verbosity(tf.logging.ERROR)
 import time
+import shutil
+import multiprocessing
 from .resnet import *
 from .model import *
 from .deepLearningUtils import *
 
 # Loads in files for one prediction
-def getData(tmp, mm, outfolder):
-    data = np.load(tmp)
-        
-    # 3D information
-    idx = data["idx"]
-    val = data["val"]
+# With mm, dist is the distance distribution of the decoys (see getDistribution), read from
+# outfolder/dist.npy when not given. Out: network inputs (see assemble_features), the 2D input is a pooled buffer
+def getData(tmp, mm, outfolder, dist=None):
+    data = load_features(tmp)
+    if not mm:
+        dist = None
+    elif dist is None:
+        dist = np.load(join(outfolder,"dist.npy"))
+    return assemble_features(data, dist)
     
-    # 1D information
-    angles = np.stack([np.sin(data["phi"]), np.cos(data["phi"]), np.sin(data["psi"]), np.cos(data["psi"])], axis=-1)
-    obt = data["obt"].T
-    prop = data["prop"].T
-    
-    # 2D information
-    orientations = np.stack([data["omega6d"], data["theta6d"], data["phi6d"]], axis=-1)
-    orientations = np.concatenate([np.sin(orientations), np.cos(orientations)], axis=-1)
-    euler = np.concatenate([np.sin(data["euler"]), np.cos(data["euler"])], axis=-1)
-    maps = data["maps"]
-    tbt = data["tbt"].T
-    sep = seqsep(tbt.shape[0])
-    
-    # Transformation
-    tbt[:,:,0] = transfomer(tbt[:,:,0])
-    maps = transfomer(maps)
-    
-    if mm:
-        return (idx, val),\
-                np.concatenate([angles, obt, prop], axis=-1),\
-                np.concatenate([tbt, maps, euler, orientations, sep, np.load(join(outfolder,"dist.npy"))], axis=-1)
-    else:
-        return (idx, val),\
-                np.concatenate([angles, obt, prop], axis=-1),\
-                np.concatenate([tbt, maps, euler, orientations, sep], axis=-1)
-    
-# Sequence separtion features
-def seqsep(psize, normalizer=100, axis=-1):
-    ret = np.ones((psize, psize))
-    for i in range(psize):
-        for j in range(psize):
-            ret[i,j] = abs(i-j)*1.0/100-1.0
-    return np.expand_dims(ret, axis)
-
 def transfomer(X, cutoff=6, scaling=3.0):
     X_prime = np.maximum(X, np.zeros_like(X) + cutoff) - cutoff
     return np.arcsinh(X_prime)/scaling
 
-def getDistribution(outfolder):
+# Computes the distance distribution of all decoys of outfolder and saves it to outfolder/dist.npy.
+# With processes, decoys are counted in that many chunks in parallel. Out: the distribution
+# Raises ValueError if there are no features in outfolder.
+def getDistribution(outfolder, store=False, processes=1):
     path = outfolder
-    tbts = [np.load(path+"/"+f)["tbt"][0,:,:] for f in os.listdir(path) if isfile(join(path,f)) and ".features.npz" in f]
-    for i in range(len(tbts)-1):
-        if not tbts[i].shape == tbts[i+1].shape:
-            print("All pdbs in the input folder need to have the same size.")
-    tbt = np.array(tbts)
-    transformed = transfomer(tbt, cutoff=6, scaling=1.0)
-    digitization = np.arange(0.25,5.1,0.25)
-    binned = np.eye(len(digitization)+1)[np.digitize(transformed, digitization)]
-    normalized = np.sum(binned, axis=0)/tbt.shape[0]
+    if store:
+        files = [get_feature_path(path, n, store) for n in get_store(get_store_folder(path, store)).names()]
+    else:
+        files = [join(path, f) for f in os.listdir(path) if isfile(join(path,f)) and ".features.npz" in f]
+    if processes > 1 and len(files) > processes:
+        pool = multiprocessing.Pool(processes)
+        partial = pool.map(accumulate_distribution, [files[i::processes] for i in range(processes)])
+        pool.close()
+        pool.join()
+    else:
+        partial = [accumulate_distribution(files)]
+    partial = [p for p in partial if p[1] > 0]
+    if len(partial) == 0:
+        raise ValueError("No features to compute the distance distribution from in "+outfolder)
+    counts, n = partial[0]
+    for c, m in partial[1:]:
+        if c.shape != counts.shape:
+            print("All pdbs in the input folder need to have the same size.", m, "decoys are skipped.")
+            continue
+        counts += c
+        n += m
+    normalized = counts/n
     np.save(join(outfolder, "dist.npy"), normalized)
-    
-def predict(samples, modelpath, outfolder, noEnsemble=False, verbose=False, multimodel=False, reference=False, transpose=False):
+    return normalized
+
+# Feature masks and 3d convolution flag of the networks for each running mode
+def getModelMasks(multimodel=False, reference=False):
+    if reference and not multimodel:
+        return getMask(["rosetta", "orientation", "angles", "ss", "aa"]), True
+    return None, False
+
+# Feature spec (kinds of features to compute) of the networks for each running mode
+def getModelSpec(multimodel=False, reference=False):
+    masks, ignore3dconv = getModelMasks(multimodel, reference)
+    return getFeatureSpec(masks, ignore3dconv)
+
+# In: model path prefix, replica number and running mode, Out: the loaded network of that replica.
+# With own_graph, it is built in a graph of its own (see Model).
+def load_model(modelpath, i, multimodel=False, reference=False, own_graph=False, verbose=False):
+    masks, ignore3dconv = getModelMasks(multimodel, reference)
+    modelname = modelpath+"_rep"+str(i)
+    if verbose: print("Loading", modelname)
+    if multimodel:
+        model = Model(obt_size=70,
+                      tbt_size=54,
+                      prot_size=None,
+                      num_chunks=5,
+                      optimizer="adam",
+                      mask_weight=0.33,
+                      lddt_weight=10.0,
+                      name=modelname,
+                      own_graph=own_graph,
+                      verbose=False)
+    elif reference:
+        model = Model(obt_size=70,
+                      tbt_size=33,
+                      prot_size=None,
+                      num_chunks=5,
+                      optimizer="adam",
+                      mask_weight=0.33,
+                      lddt_weight=10.0,
+                      feature_mask = masks,
+                      ignore3dconv = ignore3dconv,
+                      name=modelname,
+                      own_graph=own_graph,
+                      verbose=False)
+    else:
+        model = Model(obt_size=70,
+                      tbt_size=33,
+                      prot_size=None,
+                      num_chunks=5,
+                      optimizer="adam",
+                      mask_weight=0.33,
+                      lddt_weight=10.0,
+                      name=modelname,
+                      own_graph=own_graph,
+                      verbose=False)
+    model.load()
+    return model
+
+def predict(samples, modelpath, outfolder, noEnsemble=False, verbose=False, multimodel=False, reference=False, transpose=False, store=False, distribution=None):
     n_models = 2 if noEnsemble else 5
+    if multimodel and distribution is None:
+        distribution = np.load(join(outfolder, "dist.npy"))
     for i in range(1, n_models):
-        modelname = modelpath+"_rep"+str(i)
-        if verbose: print("Loading", modelname)
-        if multimodel:
-            model = Model(obt_size=70,
-                          tbt_size=54,
-                          prot_size=None,
-                          num_chunks=5,
-                          optimizer="adam",
-                          mask_weight=0.33,
-                          lddt_weight=10.0,
-                          name=modelname,
-                          verbose=False)
-        elif reference:
-            masks = getMask(["rosetta", "orientation", "angles", "ss", "aa"])
-            model = Model(obt_size=70,
-                          tbt_size=33,
-                          prot_size=None,
-                          num_chunks=5,
-                          optimizer="adam",
-                          mask_weight=0.33,
-                          lddt_weight=10.0,
-                          feature_mask = masks,
-                          ignore3dconv = True,
-                          name=modelname,
-                          verbose=False)
-        else:
-            model = Model(obt_size=70,
-                          tbt_size=33,
-                          prot_size=None,
-                          num_chunks=5,
-                          optimizer="adam",
-                          mask_weight=0.33,
-                          lddt_weight=10.0,
-                          name=modelname,
-                          verbose=False)
-        model.load()
+        model = load_model(modelpath, i, multimodel, reference, verbose=verbose)
             
         for j in range(len(samples)):
             if verbose: print("Predicting for", samples[j], "(network rep"+str(i)+")") 
-            tmp = join(outfolder, samples[j]+".features.npz")
-            batch = getData(tmp, multimodel, outfolder)
+            tmp = get_feature_path(outfolder, samples[j], store)
+            batch = getData(tmp, multimodel, outfolder, distribution)
             lddt, estogram, mask = model.predict2(batch)
             if transpose:
                 estogram = (estogram + np.transpose(estogram, [1,0,2]))/2
@@ -124,6 +134,42 @@ def predict(samples, modelpath, outfolder, noEnsemble=False, verbose=False, mult
                                     lddt = lddt,
                                     estogram = estogram,
                                     mask = mask)
+
+# Networks of all replicas held in memory at once, each in its own graph, which predict
+# one decoy at a time. The replicas are averaged in memory like merge does, so no
+# per-replica files are written. Used where decoys arrive one by one (see the pipeline
+# mode of ErrorPredictor.py); the multi-decoy network needs all decoys first and is not supported.
+class Predictor:
+    def __init__(self, modelpath, noEnsemble=False, reference=False, transpose=False, verbose=False):
+        n_models = 2 if noEnsemble else 5
+        self.transpose = transpose
+        self.verbose = verbose
+        self.models = [load_model(modelpath, i, reference=reference, own_graph=True, verbose=verbose) for i in range(1, n_models)]
+
+    # In: features (see getData), Out: lddt, estogram and mask averaged over the replicas
+    def predict(self, tmp):
+        batch = getData(tmp, False, None)
+        lddt = []
+        estogram = []
+        mask = []
+        for model in self.models:
+            l, e, m = model.predict2(batch)
+            if self.transpose:
+                e = (e + np.transpose(e, [1,0,2]))/2
+                m = (m + m.T)/2
+            lddt.append(l)
+            estogram.append(e)
+            mask.append(m)
+        return np.mean(lddt, axis=0), np.mean(estogram, axis=0), np.mean(mask, axis=0)
+
+    # Predicts the features tmp and saves the result to outfile
+    def predict_sample(self, tmp, outfile):
+        if self.verbose: print("Predicting for", outfile)
+        lddt, estogram, mask = self.predict(tmp)
+        np.savez_compressed(outfile,
+                            lddt = lddt,
+                            estogram = estogram,
+                            mask = mask)
                 
 def merge(samples, outfolder, verbose=False):
     for j in range(len(samples)):
@@ -149,12 +195,16 @@ def merge(samples, outfolder, verbose=False):
                 estogram = estogram,
                 mask = mask)
                 
-def clean(samples, outfolder, noEnsemble=False, multimodel=False, verbose=False):
+def clean(samples, outfolder, noEnsemble=False, multimodel=False, verbose=False, store=False):
     if multimodel:
         os.remove(join(outfolder, "dist.npy"))
+    if store:
+        if verbose: print("Removing", get_store_folder(outfolder, store))
+        shutil.rmtree(get_store_folder(outfolder, store))
     for i in range(len(samples)):
-        if verbose: print("Removing", join(outfolder, samples[i]+".features.npz"))
-        os.remove(join(outfolder, samples[i]+".features.npz"))
+        if not store:
+            if verbose: print("Removing", join(outfolder, samples[i]+".features.npz"))
+            os.remove(join(outfolder, samples[i]+".features.npz"))
         if not noEnsemble:
             for j in range(1,5):
                 if verbose: print("Removing", join(outfolder, samples[i]+".rep"+str(j)+".npz"))
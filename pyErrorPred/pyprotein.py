@@ -2,6 +2,7 @@ import numpy as np
 import pyrosetta
 from scipy.spatial import distance, distance_matrix
 from .conversion import *
+from .geometry import *
 
 # Gets distance for various atoms given a pose
 def get_distmap_deprecated(pose, atom1="CA", atom2="CA", default="CA"):
@@ -72,25 +73,76 @@ def get_sequence(pose):
     seq=[p.residue(i).name() for i in range(1,p.size()+1)]
     return seq
 
-# Get euler angles of pairs of residues
-def getEulerOrientation(pose):
-    # Getting Euler angle of res-res oriention
-    trans_z=np.zeros((pose.size(),pose.size(),3))
-    rot_z=np.zeros((pose.size(),pose.size(),3))
-    for i in range(1,pose.size()+1):
-        for j in range(1,pose.size()+1):
-            if i == j: continue
-            rt6=pyrosetta.rosetta.core.scoring.motif.get_residue_pair_rt6(pose,i,pose,j)
-            trans_z[i-1][j-1] = np.array([rt6[1],rt6[2],rt6[3]])
-            rot_z[i-1][j-1] = np.array([rt6[4],rt6[5],rt6[6]])
-    
+# Euler orientations come from rosetta's get_residue_pair_rt6 unless vectorized_euler is set.
+# geometry.get_euler_orientation computes the same values from the atom table in one pass,
+# but stays opt-in until it has been checked against rt6 on real poses (tests/test_euler.py).
+vectorized_euler = False
+
+# In: pose and 0-based residue indices, Out: (rows, cols, 6) rt6 of the residue pairs in radian
+def get_rt6_orientation(pose, rows=None, cols=None):
+    rows = np.arange(pose.size()) if rows is None else np.asarray(rows)
+    cols = np.arange(pose.size()) if cols is None else np.asarray(cols)
+    output = np.zeros((len(rows), len(cols), 6))
+    for a in range(len(rows)):
+        for b in range(len(cols)):
+            if rows[a] == cols[b]: continue
+            rt6 = pyrosetta.rosetta.core.scoring.motif.get_residue_pair_rt6(pose, int(rows[a])+1, pose, int(cols[b])+1)
+            output[a][b] = np.array([rt6[1],rt6[2],rt6[3],rt6[4],rt6[5],rt6[6]])
     # Conversion to radian space
-    trans_z = np.deg2rad(trans_z)
-    rot_z = np.deg2rad(rot_z)
-    
-    # Getting sin and consine of respective angles
-    output = np.concatenate([trans_z, rot_z], axis=2)
-    return output
+    return np.deg2rad(output)
+
+# In: pose, its atom table and 0-based residue indices, Out: (rows, cols, 6) euler orientations,
+# from rt6 or the vectorized version as set by vectorized_euler unless use_rt6 is given
+def get_pair_orientation(pose, atoms, rows=None, cols=None, use_rt6=None):
+    use_rt6 = not vectorized_euler if use_rt6 is None else use_rt6
+    if use_rt6 or atoms is None:
+        return get_rt6_orientation(pose, rows, cols)
+    return get_euler_orientation(atoms, rows, cols)
+
+# Get euler angles of pairs of residues.
+# With block, the output is float32 and computed block rows at a time.
+def getEulerOrientation(pose, atoms=None, use_rt6=None, block=None):
+    f = lambda atoms, rows=None: get_pair_orientation(pose, atoms, rows=rows, use_rt6=use_rt6)
+    if block is None:
+        return f(atoms)
+    nres = pose.size()
+    return fill_row_blocks(np.empty((nres, nres, 6), dtype=np.float32), f, atoms, block)
+
+# Given a scored pose and a list of score types, returns its energy graph in coordinate format.
+# Output is 0-based residue indices i < j of every edge and an (edges, terms) array of
+# unweighted energies. Walking the upper edge lists visits each edge exactly once.
+# With residues (0-based) only the edges touching them are returned, as (residue, other) pairs;
+# edges between two of them show up twice.
+def get_energy_edges(pose, energy_terms, residues=None):
+    graph = pose.energies().energy_graph()
+    index1 = []
+    index2 = []
+    values = []
+    if residues is None:
+        for i in range(1, pose.size()+1):
+            node = graph.get_node(i)
+            iru = node.const_upper_edge_list_begin()
+            irue = node.const_upper_edge_list_end()
+            while iru!=irue:
+                edge = iru.__mul__()
+                index1.append(i-1)
+                index2.append(edge.get_second_node_ind()-1)
+                values.append([edge[e] for e in energy_terms])
+                iru.plus_plus()
+    else:
+        for i in residues:
+            i = int(i)+1
+            node = graph.get_node(i)
+            ir = node.const_edge_list_begin()
+            ire = node.const_edge_list_end()
+            while ir!=ire:
+                edge = ir.__mul__()
+                index1.append(i-1)
+                index2.append(edge.get_other_ind(i)-1)
+                values.append([edge[e] for e in energy_terms])
+                ir.plus_plus()
+    values = np.array(values, dtype=np.float64).reshape((len(index1), len(energy_terms)))
+    return np.array(index1, dtype=np.int32), np.array(index2, dtype=np.int32), values
 
 # Given a pose and scorefunction, returns one body and two body terms of totalE.
 def getEnergy(p, scorefxn):
@@ -99,7 +151,6 @@ def getEnergy(p, scorefxn):
     res_energy_no_two_body_z=np.zeros ( (nres) )
 
     totE=scorefxn(p)
-    energy_graph=p.energies().energy_graph()
     twobody_terms = p.energies().energy_graph().active_2b_score_types()
     onebody_weights = pyrosetta.rosetta.core.scoring.EMapVector()
     onebody_weights.assign(scorefxn.weights())
@@ -110,14 +161,14 @@ def getEnergy(p, scorefxn):
             
     for i in range(1,nres+1):
         res_energy_no_two_body_z[i-1] = p.energies().residue_total_energies(i).dot(onebody_weights)
-            
-        for j in range(1,nres+1):
-            if i == j: continue
-            edge=energy_graph.find_edge(i,j)
-            if edge is None:
-                energy=0.
-            else:
-                res_pair_energy_z[i-1][j-1]= edge.fill_energy_map().dot(scorefxn.weights())
+    
+    # Edges only carry the active two body terms, so their weighted sum is the pair energy.
+    twobody_terms = list(twobody_terms)
+    weights = np.array([scorefxn.weights()[t] for t in twobody_terms])
+    i, j, values = get_energy_edges(p, twobody_terms)
+    energy = np.dot(values, weights)
+    res_pair_energy_z[i, j] = energy
+    res_pair_energy_z[j, i] = energy
                 
     return res_energy_no_two_body_z, res_pair_energy_z
 
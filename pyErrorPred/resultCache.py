@@ -0,0 +1,150 @@
+import numpy as np
+import os
+import shutil
+import hashlib
+from os.path import join, isfile, isdir, dirname, basename
+from .featureIO import *
+from .structureIO import *
+
+# Suffixes of cache entries
+feature_entry = ".features.npz"
+prediction_entry = ".npz"
+
+# The cache is shrunk to this fraction of its maximum size when it is full, so that the
+# folder is only scanned again once that much was added
+low_water = 0.9
+# Puts after which the folder is scanned anyway, to count entries added by other runs
+rescan_interval = 1000
+
+# In: structure (a pdb file name or reference, see structureIO), Out: hash of its parsed coordinates.
+# Covers atom and residue names, chains, residue numbers, coordinates and occupancies of
+# the ATOM/HETATM records of the first model, so headers, atom serials and b-factors
+# do not change it while any change to the structure does.
+# Structures of silent files are hashed by their lines without the tag.
+def get_structure_hash(structure):
+    if not isinstance(structure, str) and structure[2] == "silent":
+        lines = [l.rsplit(None, 1)[0] for l in read_structure_lines(structure) if l.strip() != ""]
+        return hashlib.sha1("\n".join(lines).encode()).hexdigest()
+    names = []
+    values = []
+    for line in read_structure_lines(structure):
+        record = line[:6]
+        if record == "ENDMDL":
+            break
+        if record != "ATOM  " and record != "HETATM":
+            continue
+        occupancy = line[54:60].strip()
+        names.append(record+line[12:27])
+        values.append((float(line[30:38]), float(line[38:46]), float(line[46:54]), float(occupancy) if occupancy != "" else 1.0))
+    h = hashlib.sha1("\n".join(names).encode())
+    h.update(np.round(np.array(values, dtype=np.float64).reshape(-1, 4), 3).tobytes())
+    return h.hexdigest()
+
+# In: feature spec, Out: string identifying what the featurizer computes for it
+def get_featurizer_version(spec=feature_kinds):
+    versions = ",".join([g+str(feature_versions[g]) for g in get_groups(spec)])
+    return "|".join([",".join(spec), versions, get_encoding()])
+
+# In: model path prefix and number of replicas (see predict.predict), Out: string identifying them.
+# Checkpoint file names and sizes are used instead of their content, which is hundreds of MB.
+def get_model_identity(modelpath, n_models):
+    identity = [basename(modelpath)]
+    for i in range(1, n_models):
+        folder = modelpath+"_rep"+str(i)
+        if isdir(folder):
+            identity += [f+":"+str(os.path.getsize(join(folder, f))) for f in sorted(os.listdir(folder)) if isfile(join(folder, f))]
+    return "|".join(identity)
+
+def get_key(*parts):
+    return hashlib.sha1("\n".join(parts).encode()).hexdigest()
+
+# Content addressed cache of feature files and predictions shared by any number of runs.
+# Features are keyed by the hash of the parsed coordinates and the featurizer version,
+# predictions additionally by the model identity, so the same structure under another name
+# or in another folder is a hit. Entries are plain .npz files; once the folder is larger
+# than max_size bytes, the least recently used ones are removed.
+# The size of the folder is counted when it is scanned and kept up to date by put, so the
+# folder is only scanned once it is full or every rescan_interval puts.
+class ResultCache:
+    def __init__(self, path, max_size=None):
+        self.path = path
+        self.max_size = max_size
+        # Size of the folder at the last scan plus what was put since, None before the first scan
+        self.size = None
+        self.puts = 0
+        if not isdir(path):
+            os.makedirs(path, exist_ok=True)
+
+    # In: structure and feature spec, Out: key of its features
+    def get_feature_key(self, structure, spec=feature_kinds):
+        return get_key(get_structure_hash(structure), get_featurizer_version(spec))
+
+    # In: key of the features and identity of the models (see get_model_identity), Out: key of the prediction
+    def get_prediction_key(self, feature_key, model_identity):
+        return get_key(feature_key, model_identity)
+
+    # Copies the entry key to outfile (a .npz file or feature store entry).
+    # Out: True on a hit
+    def fetch(self, key, suffix, outfile):
+        entry = join(self.path, key+suffix)
+        if not isfile(entry):
+            return False
+        try:
+            if is_store_path(outfile):
+                with np.load(entry) as data:
+                    get_store(dirname(outfile)).write(basename(outfile), dict([(k, data[k]) for k in data.files]))
+            else:
+                shutil.copyfile(entry, outfile)
+            # Marks the entry as recently used
+            os.utime(entry)
+        except Exception:
+            return False
+        return True
+
+    # Adds infile (a .npz file, feature store entry or shared memory features) as the entry key
+    def put(self, key, suffix, infile):
+        if not feature_exists(infile):
+            return
+        entry = join(self.path, key+suffix)
+        # Written under a temporary name so concurrent readers never see partial entries
+        temp = join(self.path, "%s.tmp%d.npz" % (key, os.getpid()))
+        if is_store_path(infile):
+            data = get_store(dirname(infile)).load(basename(infile))
+            np.savez_compressed(temp, **data)
+        elif is_memory_path(infile):
+            np.savez_compressed(temp, **load_shared(infile))
+        else:
+            shutil.copyfile(infile, temp)
+        replaced = os.path.getsize(entry) if isfile(entry) else 0
+        added = os.path.getsize(temp)
+        os.replace(temp, entry)
+        if self.max_size is None:
+            return
+        self.puts += 1
+        if self.size is not None:
+            self.size += added-replaced
+        if self.size is None or self.size > self.max_size or self.puts >= rescan_interval:
+            self.evict()
+
+    # Scans the folder and removes the least recently used entries if it is larger than max_size,
+    # until it fits into low_water*max_size
+    def evict(self):
+        if self.max_size is None:
+            return
+        self.puts = 0
+        entries = []
+        for e in os.scandir(self.path):
+            if e.is_file() and not ".tmp" in e.name:
+                stat = e.stat()
+                entries.append((stat.st_mtime, stat.st_size, e.path))
+        size = sum([e[1] for e in entries])
+        if size > self.max_size:
+            for _, nbytes, path in sorted(entries):
+                if size <= low_water*self.max_size:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                size -= nbytes
+        self.size = size
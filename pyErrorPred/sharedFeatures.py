@@ -0,0 +1,132 @@
+import numpy as np
+import os
+import shutil
+import hashlib
+from os.path import join, dirname, basename
+from multiprocessing import shared_memory, resource_tracker
+from .featureStore import *
+
+# Features handed from featurization workers to the process predicting them in shared memory.
+# A worker writes all arrays of a decoy into one shared memory segment, laid out like the
+# entries of a FeatureStore, and only the offset, dtype and shape of each array go back with
+# its result (see featurePool.run_task). The receiving process maps the segment and reads the
+# arrays in place, so they are neither pickled, compressed nor written to disk. Once handed
+# over, the segment belongs to the receiver, which removes it with release_shared.
+# Segments are named after the receiving process and the path of the features, so the
+# receiver can also remove those of workers that died before handing them over (discard_shared).
+# When a segment does not fit into shared memory, the arrays go to an uncompressed file
+# <outfolder>/<name>.handoff.npz instead, which is handed over and removed the same way.
+# Features are addressed as <outfolder>/features.memory/<name>, a folder that is never created.
+
+# Name of the folder of shared memory features (see get_feature_path)
+memory_name = "features.memory"
+
+# Prefix of the segments received by this process. Workers inherit it, or are given it by
+# featurePool.init_worker.
+segment_prefix = "lap%d_" % os.getpid()
+
+# Segments written by this process and not handed over yet: path -> entry
+_written = {}
+# Segments handed over to this process: path -> (entry, SharedMemory or NpzFile once opened)
+_received = {}
+
+def get_segment_name(path):
+    return segment_prefix+hashlib.sha1(path.encode()).hexdigest()[:16]
+
+def get_handoff_file(path):
+    return join(dirname(dirname(path)), basename(path)+".handoff.npz")
+
+# Allocates the pages of a new segment. They are otherwise allocated when first written,
+# and writing past the capacity of /dev/shm kills the process with SIGBUS.
+# Raises OSError if they do not fit.
+def reserve_segment(shm, size):
+    if os.path.isdir("/dev/shm") and shutil.disk_usage("/dev/shm").free < size:
+        raise OSError("No space left in /dev/shm")
+    fd = getattr(shm, "_fd", -1)
+    if hasattr(os, "posix_fallocate") and fd >= 0:
+        os.posix_fallocate(fd, 0, size)
+
+# Writes arrays for path into a new segment, or the handoff file if it does not fit
+def write_shared(path, arrays):
+    arrays = dict([(k, np.asarray(a, order="C")) for k, a in arrays.items()])
+    layout = {}
+    size = 0
+    for k, a in arrays.items():
+        size += -size % alignment
+        layout[k] = (size, a.dtype.str, list(a.shape))
+        size += a.nbytes
+    _written.pop(path, None)
+    discard_shared(path)
+    name = get_segment_name(path)
+    shm = shared_memory.SharedMemory(name=name, create=True, size=max(size, 1))
+    # The receiver removes the segment, not the resource tracker of the worker when it exits
+    resource_tracker.unregister(shm._name, "shared_memory")
+    try:
+        reserve_segment(shm, size)
+    except OSError:
+        shm.close()
+        shm.unlink()
+        np.savez(get_handoff_file(path), **arrays)
+        _written[path] = ("file", get_handoff_file(path), None)
+        return
+    for k, a in arrays.items():
+        np.ndarray(a.shape, dtype=a.dtype, buffer=shm.buf, offset=layout[k][0])[...] = a
+    shm.close()
+    _written[path] = ("memory", name, layout)
+
+# Out: entry of the features written for path, which is handed over with it, or None
+def take_written(path):
+    return _written.pop(path, None)
+
+def receive_shared(path, entry):
+    release_shared(path)
+    _received[path] = (entry, None)
+
+def has_shared(path):
+    return path in _received or path in _written
+
+# Out: dictionary of read-only arrays of path, backed by its segment
+# (an NpzFile of the handoff file if it did not fit)
+def load_shared(path):
+    if not path in _received:
+        raise KeyError(path+" was not handed over to this process")
+    entry, opened = _received[path]
+    kind, name, layout = entry
+    if kind == "file":
+        if opened is None:
+            opened = np.load(name)
+            _received[path] = (entry, opened)
+        return opened
+    if opened is None:
+        opened = shared_memory.SharedMemory(name=name)
+        _received[path] = (entry, opened)
+    features = StoredFeatures()
+    for k, (offset, dtype, shape) in layout.items():
+        a = np.ndarray(tuple(shape), dtype=dtype, buffer=opened.buf, offset=offset)
+        a.flags.writeable = False
+        features[k] = a
+    return features
+
+# Removes the features handed over for path
+def release_shared(path):
+    if not path in _received:
+        return
+    entry, opened = _received.pop(path)
+    if opened is not None:
+        try:
+            opened.close()
+        except BufferError:
+            # Arrays of it are still referenced, the mapping goes away with them
+            pass
+    discard_shared(path)
+
+# Removes any segment or handoff file written for path, whether it was handed over or not
+def discard_shared(path):
+    try:
+        shm = shared_memory.SharedMemory(name=get_segment_name(path))
+        shm.close()
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+    if os.path.isfile(get_handoff_file(path)):
+        os.remove(get_handoff_file(path))
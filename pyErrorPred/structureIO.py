@@ -0,0 +1,247 @@
+import os
+import gzip
+import glob
+import zlib
+from os.path import basename
+
+# Input structures.
+# A structure is either the name of a single model .pdb file, which is read as before,
+# or a reference (path, name, kind, header, start, end) to one model of a multi-model
+# .pdb, .pdb.gz or silent file. kind is "pdb" or "silent", start and end are byte offsets
+# of the model in the (decompressed) file and header is the length of the lines at the
+# start of a silent file that every structure of it needs. Models are only read when
+# they are featurized, so enumerating a file holds none of them in memory.
+
+# Suffixes of the files structures are read from
+pdb_suffixes = [".pdb", ".pdb.gz"]
+silent_suffixes = [".silent", ".silent.gz"]
+
+def is_structure_file(filename):
+    return any([filename.endswith(s) for s in pdb_suffixes+silent_suffixes])
+
+# In: file name, Out: file name without its structure file suffix
+def strip_suffix(filename):
+    for s in pdb_suffixes+silent_suffixes:
+        if filename.endswith(s):
+            return filename[:-len(s)]
+    return filename
+
+def open_binary(filename):
+    if filename.endswith(".gz"):
+        return gzip.open(filename, "rb")
+    return open(filename, "rb")
+
+def is_glob(path):
+    return any([c in path for c in "*?["])
+
+# In: input folder, glob pattern (** matches folders recursively), structure file or list file
+# holding one path or pattern per line, Out: structure files and ignored files.
+# Folders are listed in one os.scandir pass, which needs no stat call per file on most file systems,
+# and patterns are matched without checking the matches.
+def enumerate_inputs(infolder):
+    files = []
+    ignored = []
+    if os.path.isdir(infolder):
+        with os.scandir(infolder) as entries:
+            for e in entries:
+                if e.name[0] == "." or not e.is_file():
+                    continue
+                if is_structure_file(e.name):
+                    files.append(e.path)
+                else:
+                    ignored.append(e.path)
+    elif is_glob(infolder):
+        for path in glob.iglob(infolder, recursive=True):
+            if is_structure_file(path):
+                files.append(path)
+    elif is_structure_file(infolder):
+        files.append(infolder)
+    else:
+        with open(infolder) as f:
+            for line in f:
+                line = line.strip()
+                if line == "" or line.startswith("#"):
+                    continue
+                if is_glob(line) or os.path.isdir(line):
+                    files += enumerate_inputs(line)[0]
+                elif is_structure_file(line):
+                    files.append(line)
+                else:
+                    ignored.append(line)
+    return files, ignored
+
+# In: "i/n", Out: shard (i, n) with 0 <= i < n
+def parse_shard(text):
+    i, n = [int(x) for x in text.split("/")]
+    if n < 1 or i < 0 or i >= n:
+        raise ValueError("Shard needs to be i/n with 0 <= i < n: "+text)
+    return i, n
+
+# Returns True if the structure name belongs to shard (i, n).
+# crc32 of the name is the same in every run and on every host, unlike hash().
+def in_shard(name, shard):
+    return zlib.crc32(name.encode()) % shard[1] == shard[0]
+
+# In: multi-model pdb file, Out: references to its models, named <file>.model<serial>.
+# Files without MODEL records hold one model named after the file.
+def iterate_pdb_models(filename):
+    name = strip_suffix(basename(filename))
+    offset = 0
+    start = None
+    serial = None
+    count = 0
+    with open_binary(filename) as f:
+        for line in f:
+            if line.startswith(b"MODEL"):
+                # A model not closed by ENDMDL ends where the next one starts
+                if start is not None:
+                    yield (filename, name+".model"+serial, "pdb", 0, start, offset)
+                start = offset
+                count += 1
+                fields = line.split()
+                serial = fields[1].decode() if len(fields) > 1 else str(count)
+            elif line.startswith(b"ENDMDL") and start is not None:
+                yield (filename, name+".model"+serial, "pdb", 0, start, offset)
+                start = None
+            offset += len(line)
+    if start is not None:
+        yield (filename, name+".model"+serial, "pdb", 0, start, offset)
+    if count == 0:
+        yield (filename, name, "pdb", 0, 0, offset)
+
+# In: silent file, Out: references to its structures, named by their tags.
+# Every line of a structure ends with its tag, the first one is a SCORE line.
+def iterate_silent_structures(filename):
+    offset = 0
+    header = None
+    start = None
+    tag = None
+    with open_binary(filename) as f:
+        for line in f:
+            fields = line.split()
+            # SEQUENCE and the SCORE line naming the score columns, repeated where files were appended
+            is_header = line.startswith(b"SEQUENCE") or (line.startswith(b"SCORE") and fields[-1:] == [b"description"])
+            if header is None and (is_header or line.startswith(b"REMARK")):
+                offset += len(line)
+                continue
+            if header is None:
+                header = offset
+            if is_header:
+                if tag is not None:
+                    yield (filename, tag, "silent", header, start, offset)
+                tag = None
+            elif line.startswith(b"SCORE") and len(fields) > 1 and fields[-1].decode() != tag:
+                if tag is not None:
+                    yield (filename, tag, "silent", header, start, offset)
+                tag = fields[-1].decode()
+                start = offset
+            offset += len(line)
+    if tag is not None:
+        yield (filename, tag, "silent", header, start, offset)
+
+# In: input file and whether to expand the MODEL records of plain .pdb files,
+# Out: (name, structure) of the structures in the file
+def iterate_structures(filename, models=False):
+    if filename.endswith(".pdb") and not models:
+        yield strip_suffix(basename(filename)), filename
+    elif any([filename.endswith(s) for s in silent_suffixes]):
+        for structure in iterate_silent_structures(filename):
+            yield structure[1], structure
+    else:
+        for structure in iterate_pdb_models(filename):
+            yield structure[1], structure
+
+# In: structure, Out: the file it is read from
+def get_source_file(structure):
+    if isinstance(structure, str):
+        return structure
+    return structure[0]
+
+# In: name, structure and the folder the source files are named relative to,
+# Out: the name qualified by its source file, e.g. a/x.pdb -> a_x.pdb, models of
+# a/x.pdb.gz -> a_x.pdb.gz.model1 and tags of s.silent -> s.silent.S_0001
+def qualify_name(name, structure, root):
+    source = get_source_file(structure)
+    label = os.path.relpath(source, root).replace(os.sep, "_")
+    stem = strip_suffix(basename(source))
+    if name == stem:
+        return label
+    if not isinstance(structure, str) and structure[2] == "pdb" and name.startswith(stem+".model"):
+        return label+name[len(stem):]
+    return label+"."+name
+
+# In: (name, structure) of all inputs, Out: the same with unique names.
+# Inputs from different folders, x.pdb next to x.pdb.gz or silent files reusing tags can
+# share a name, and would overwrite each other's features and predictions. Names that occur
+# more than once are qualified by their source file (see qualify_name) relative to the folder
+# those files have in common, which is the same for every shard. The same structure listed
+# twice is kept once. Raises ValueError if names still collide.
+def get_unique_names(named):
+    seen = set()
+    unique = []
+    for name, structure in named:
+        # The same file may be reached by different paths
+        key = (name, os.path.abspath(get_source_file(structure)), None if isinstance(structure, str) else structure[1:])
+        if key in seen:
+            continue
+        seen.add(key)
+        unique.append((name, structure))
+    counts = {}
+    for name, _ in unique:
+        counts[name] = counts.get(name, 0)+1
+    duplicates = [(name, structure) for name, structure in unique if counts[name] > 1]
+    if len(duplicates) == 0:
+        return unique
+    root = os.path.commonpath([os.path.dirname(os.path.abspath(get_source_file(s))) for _, s in duplicates])
+    qualified = {}
+    for name, structure in duplicates:
+        qualified[(name, structure)] = qualify_name(name, structure, root)
+    unique = [(qualified.get((name, structure), name), structure) for name, structure in unique]
+    names = set()
+    for name, structure in unique:
+        if name in names:
+            raise ValueError("Several structures are named "+name+", e.g. "+get_structure_label(structure))
+        names.add(name)
+    return unique
+
+# Open gzip files of this process. Decompressing a gzip file up to an offset takes as long as
+# reading it, so the last one read is kept open and models are read forward from it.
+_gzip_files = {}
+
+# In: structure reference, Out: lines of the structure (bytes)
+def read_structure_bytes(structure):
+    path, name, kind, header, start, end = structure
+    if path.endswith(".gz"):
+        f = _gzip_files.get(path)
+        if f is None or f.tell() > start:
+            for g in _gzip_files.values():
+                g.close()
+            _gzip_files.clear()
+            f = gzip.open(path, "rb")
+            _gzip_files[path] = f
+        data = b""
+        if header > 0:
+            with gzip.open(path, "rb") as h:
+                data = _read_range(h, 0, header)
+        f.seek(start)
+        return data+f.read(end-start)
+    with open(path, "rb") as f:
+        data = _read_range(f, 0, header) if header > 0 else b""
+        return data+_read_range(f, start, end)
+
+def _read_range(f, start, end):
+    f.seek(start)
+    return f.read(end-start)
+
+# In: structure (file name or reference), Out: its lines
+def read_structure_lines(structure):
+    if isinstance(structure, str):
+        with open(structure) as f:
+            return f.readlines()
+    return read_structure_bytes(structure).decode().splitlines(True)
+
+# Out: name of the structure for messages
+def get_structure_label(structure):
+    if isinstance(structure, str):
+        return structure
+    return structure[0]+":"+structure[1]
@@ -0,0 +1,20 @@
+import os
+import sys
+import types
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, root)
+
+# The package imports tensorflow and the networks on import. Where they are not installed,
+# its numpy only modules are imported without running pyErrorPred/__init__.py.
+try:
+    import pyErrorPred
+except ImportError:
+    for name in list(sys.modules):
+        if name == "pyErrorPred" or name.startswith("pyErrorPred."):
+            del sys.modules[name]
+    package = types.ModuleType("pyErrorPred")
+    package.__path__ = [os.path.join(root, "pyErrorPred")]
+    sys.modules["pyErrorPred"] = package
+
+samples = os.path.join(root, "samples")
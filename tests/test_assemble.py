@@ -0,0 +1,74 @@
+import numpy as np
+from pyErrorPred.deepLearningUtils import assemble_features
+
+# assemble_features against the concatenation of predict.getData it replaced.
+
+def transfomer(X, cutoff=6, scaling=3.0):
+    X_prime = np.maximum(X, np.zeros_like(X) + cutoff) - cutoff
+    return np.arcsinh(X_prime)/scaling
+
+def baseline_seqsep(psize, normalizer=100, axis=-1):
+    ret = np.ones((psize, psize))
+    for i in range(psize):
+        for j in range(psize):
+            ret[i,j] = abs(i-j)*1.0/100-1.0
+    return np.expand_dims(ret, axis)
+
+def baseline_inputs(data, dist=None):
+    angles = np.stack([np.sin(data["phi"]), np.cos(data["phi"]), np.sin(data["psi"]), np.cos(data["psi"])], axis=-1)
+    obt = data["obt"].T
+    prop = data["prop"].T
+    orientations = np.stack([data["omega6d"], data["theta6d"], data["phi6d"]], axis=-1)
+    orientations = np.concatenate([np.sin(orientations), np.cos(orientations)], axis=-1)
+    euler = np.concatenate([np.sin(data["euler"]), np.cos(data["euler"])], axis=-1)
+    maps = data["maps"]
+    tbt = data["tbt"].T
+    sep = baseline_seqsep(tbt.shape[0])
+    tbt = np.concatenate([transfomer(tbt[:,:,:1]), tbt[:,:,1:]], axis=-1)
+    maps = transfomer(maps)
+    f2d = [tbt, maps, euler, orientations, sep]+([] if dist is None else [dist])
+    return (data["idx"], data["val"]), np.concatenate([angles, obt, prop], axis=-1), np.concatenate(f2d, axis=-1)
+
+def make_data(rng, nres):
+    return {"phi": rng.uniform(-np.pi, np.pi, nres), "psi": rng.uniform(-np.pi, np.pi, nres),
+            "obt": rng.random((46, nres)), "prop": rng.random((20, nres)),
+            "tbt": np.concatenate([rng.random((1, nres, nres))*30, rng.normal(size=(9, nres, nres))]).astype(np.float32),
+            "maps": (rng.random((nres, nres, 4))*30).astype(np.float32),
+            "euler": rng.uniform(-np.pi, np.pi, (nres, nres, 6)),
+            "omega6d": rng.uniform(-np.pi, np.pi, (nres, nres)), "theta6d": rng.uniform(-np.pi, np.pi, (nres, nres)),
+            "phi6d": rng.uniform(0, np.pi, (nres, nres)),
+            "idx": np.zeros((0, 5), dtype=np.uint16), "val": np.zeros(0, dtype=np.float16)}
+
+def test_inputs_match_concatenation():
+    rng = np.random.default_rng(0)
+    data = make_data(rng, 17)
+    dist = rng.random((17, 17, 21))
+    for d in [None, dist]:
+        expected = baseline_inputs(data, d)
+        f3d, f1d, f2d = assemble_features(data, d)
+        assert f3d[0] is data["idx"] and f3d[1] is data["val"]
+        assert f1d.dtype == np.float32 and f2d.dtype == np.float32
+        assert f1d.shape == expected[1].shape == (17, 70)
+        assert f2d.shape == expected[2].shape == (17, 17, 33 if d is None else 54)
+        assert np.allclose(f1d, expected[1], rtol=1e-6, atol=1e-6)
+        assert np.allclose(f2d, expected[2], rtol=1e-6, atol=1e-6)
+
+def test_read_only_inputs_are_not_changed():
+    rng = np.random.default_rng(1)
+    data = make_data(rng, 9)
+    original = dict([(k, np.array(v)) for k, v in data.items()])
+    for v in data.values():
+        v.flags.writeable = False
+    assemble_features(data)
+    for k in data:
+        assert np.array_equal(data[k], original[k])
+
+def test_pooled_buffers_keep_previous_input():
+    rng = np.random.default_rng(2)
+    first = make_data(rng, 11)
+    second = make_data(rng, 11)
+    _, _, a = assemble_features(first)
+    kept = np.array(a)
+    _, _, b = assemble_features(second)
+    assert not b is a
+    assert np.array_equal(a, kept)
@@ -0,0 +1,47 @@
+import os
+import numpy as np
+from pyErrorPred.deepLearningUtils import accumulate_distribution
+from pyErrorPred.featureIO import save_features
+
+# accumulate_distribution against the one-hot sum of getDistribution it replaced.
+
+def transfomer(X, cutoff=6, scaling=3.0):
+    X_prime = np.maximum(X, np.zeros_like(X) + cutoff) - cutoff
+    return np.arcsinh(X_prime)/scaling
+
+def baseline_distribution(tbts):
+    tbt = np.array(tbts)
+    transformed = transfomer(tbt, cutoff=6, scaling=1.0)
+    digitization = np.arange(0.25,5.1,0.25)
+    binned = np.eye(len(digitization)+1)[np.digitize(transformed, digitization)]
+    return np.sum(binned, axis=0)/tbt.shape[0]
+
+def write_decoys(folder, tbts):
+    files = []
+    for i, tbt in enumerate(tbts):
+        filename = os.path.join(folder, "d%d.features.npz" % i)
+        save_features(filename, {"tbt": tbt[None], "maps": np.repeat(tbt[:,:,None], 4, axis=-1)}, ["distance"])
+        files.append(filename)
+    return files
+
+def test_distribution_matches_one_hot_sum(tmp_path):
+    rng = np.random.default_rng(0)
+    # Distances spanning all bins, including the first (below the cutoff) and the last
+    tbts = [(rng.random((13, 13))*200).astype(np.float32) for i in range(7)]
+    files = write_decoys(str(tmp_path), tbts)
+    counts, n = accumulate_distribution(files)
+    assert n == 7
+    assert counts.shape == (13, 13, 21)
+    assert np.array_equal(counts/n, baseline_distribution(tbts))
+    # Chunks add up to the whole
+    parts = [accumulate_distribution(files[i::3]) for i in range(3)]
+    assert np.array_equal(sum([c for c, m in parts]), counts)
+
+def test_decoys_of_other_sizes_are_skipped(tmp_path):
+    rng = np.random.default_rng(1)
+    tbts = [(rng.random((6, 6))*50).astype(np.float32) for i in range(3)]
+    files = write_decoys(str(tmp_path), tbts[:2]+[np.zeros((4, 4), dtype=np.float32)]+tbts[2:])
+    counts, n = accumulate_distribution(files)
+    assert n == 3
+    assert np.array_equal(counts/n, baseline_distribution(tbts))
+    assert accumulate_distribution([]) == (None, 0)
@@ -0,0 +1,38 @@
+import os
+import numpy as np
+import pytest
+from conftest import samples
+
+pyrosetta = pytest.importorskip("pyrosetta")
+
+# The vectorized euler orientation is only used when pyprotein.vectorized_euler is set.
+# It has to match rosetta's get_residue_pair_rt6 on the sample decoys: translations
+# within 1e-4 (after deg2rad, like rt6) and angles within 1e-4 as sine and cosine,
+# since 0 and 2pi are the same angle.
+
+def load_pose(filename):
+    from pyErrorPred.featurize import init_rosetta
+    init_rosetta()
+    return pyrosetta.pose_from_file(os.path.join(samples, filename))
+
+@pytest.mark.parametrize("filename", sorted(os.listdir(samples))[:2])
+def test_vectorized_euler_matches_rt6(filename):
+    from pyErrorPred.featurize import get_atom_table
+    from pyErrorPred.pyprotein import get_rt6_orientation
+    from pyErrorPred.geometry import get_euler_orientation
+    pose = load_pose(filename)
+    rt6 = get_rt6_orientation(pose)
+    euler = get_euler_orientation(get_atom_table(pose))
+    assert euler.shape == rt6.shape
+    assert np.allclose(euler[:,:,:3], rt6[:,:,:3], atol=1e-4)
+    assert np.allclose(np.sin(euler[:,:,3:]), np.sin(rt6[:,:,3:]), atol=1e-4)
+    assert np.allclose(np.cos(euler[:,:,3:]), np.cos(rt6[:,:,3:]), atol=1e-4)
+
+def test_row_blocks_match_rt6():
+    from pyErrorPred.featurize import get_atom_table
+    from pyErrorPred.pyprotein import get_rt6_orientation, getEulerOrientation
+    pose = load_pose(sorted(os.listdir(samples))[0])
+    atoms = get_atom_table(pose)
+    blocked = getEulerOrientation(pose, atoms, use_rt6=True, block=16)
+    assert blocked.dtype == np.float32
+    assert np.allclose(blocked, get_rt6_orientation(pose), atol=1e-5)
@@ -0,0 +1,44 @@
+import numpy as np
+from pyErrorPred.featureEncoding import *
+from pyErrorPred.featureStore import StoredFeatures
+
+def test_round_trip():
+    rng = np.random.default_rng(0)
+    nres = 12
+    tbt = np.zeros((10, nres, nres), dtype=np.float32)
+    tbt[0] = rng.random((nres, nres))*20
+    tbt[1:4][rng.random((3, nres, nres)) < 0.2] = -1.5
+    tbt[4:10] = rng.random((6, nres, nres)) < 0.1
+    orientation = np.where(rng.random((3, nres, nres)) < 0.3, rng.random((3, nres, nres)), 0).astype(np.float32)
+    idx = np.stack([rng.integers(0, nres, 50), rng.integers(0, 24, 50), rng.integers(0, 24, 50),
+                    rng.integers(0, 24, 50), rng.integers(0, 167, 50)], axis=1).astype(np.uint16)
+    features = {"tbt": tbt, "omega6d": orientation[0], "theta6d": orientation[1], "phi6d": orientation[2],
+                "idx": idx, "maps": rng.random((nres, nres, 4)).astype(np.float32),
+                "obt": rng.random((14, nres))}
+    encoded = encode_features(features)
+    decoded = CompactFeatures(StoredFeatures(encoded))
+    assert sorted(decoded.keys()) == sorted(features)
+    assert np.allclose(decoded["tbt"][0], tbt[0], atol=2e-2)
+    assert np.array_equal(decoded["tbt"][1:], tbt[1:])
+    for i, k in enumerate(["omega6d", "theta6d", "phi6d"]):
+        assert np.array_equal(decoded[k], orientation[i])
+    assert np.array_equal(decoded["idx"], idx)
+    assert np.allclose(decoded["maps"], features["maps"], atol=1e-3)
+    assert np.array_equal(decoded["obt"], features["obt"])
+
+def test_single_tbt_channels(tmp_path):
+    rng = np.random.default_rng(1)
+    nres = 9
+    tbt = np.zeros((5, nres, nres), dtype=np.float32)
+    tbt[0] = rng.random((nres, nres))*20
+    tbt[1][rng.random((nres, nres)) < 0.3] = -0.7
+    tbt[2] = rng.random((nres, nres)) < 0.2
+    tbt[3][rng.random((nres, nres)) < 0.3] = 2.5
+    encoded = encode_features({"tbt": tbt})
+    features = CompactFeatures(StoredFeatures(encoded))
+    for c in range(5):
+        channel = features.tbt_channel(c)
+        assert channel.dtype == np.float32 and channel.shape == (nres, nres)
+        assert np.allclose(channel, tbt[c], atol=2e-2 if c == 0 else 0)
+    assert not "tbt" in features.decoded
+    assert np.array_equal(features.tbt_channel(3), features["tbt"][3])
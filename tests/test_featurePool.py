@@ -0,0 +1,95 @@
+import os
+import time
+import signal
+import pytest
+import pyErrorPred.featurePool as featurePool
+from pyErrorPred.featurePool import FeaturizationStream, run_featurization
+
+# Featurizers run in the workers, the structure name tells them what to do
+
+def featurize(args):
+    name = os.path.basename(args[0])
+    if name.startswith("crash"):
+        os.kill(os.getpid(), signal.SIGKILL)
+    if name.startswith("native"):
+        # Stuck where the alarm of run_task cannot interrupt it
+        signal.pthread_sigmask(signal.SIG_BLOCK, [signal.SIGALRM])
+        time.sleep(60)
+    if name.startswith("unpicklable"):
+        return Unpicklable()
+    return not name.startswith("fail")
+
+class Unpicklable:
+    def __bool__(self):
+        raise ValueError("no truth value")
+
+def make_arguments(folder, names):
+    arguments = []
+    for i, name in enumerate(names):
+        filename = os.path.join(folder, name)
+        with open(filename, "w") as f:
+            f.write("x"*(i+1))
+        arguments.append((filename, os.path.join(folder, name+".features.npz"), False))
+    return arguments
+
+@pytest.fixture(autouse=True)
+def fast_checks(monkeypatch):
+    monkeypatch.setattr(featurePool, "poll_interval", 0.1)
+    monkeypatch.setattr(featurePool, "lost_grace", 0.5)
+
+def test_success_and_failures(tmp_path):
+    arguments = make_arguments(str(tmp_path), ["a", "fail1", "b", "c", "fail2"])
+    success = run_featurization(featurize, arguments, 2, rosetta=False)
+    assert success == [True, False, True, True, False]
+
+def test_crashed_worker_fails_its_decoy(tmp_path):
+    arguments = make_arguments(str(tmp_path), ["a", "crash", "b", "c"])
+    start = time.time()
+    success = run_featurization(featurize, arguments, 2, maxtasks=1, rosetta=False)
+    assert success == [True, False, True, True]
+    assert time.time()-start < 30
+
+def test_decoy_stuck_in_native_code_is_killed(tmp_path):
+    arguments = make_arguments(str(tmp_path), ["native", "a"])
+    start = time.time()
+    success = run_featurization(featurize, arguments, 2, timeout=1, rosetta=False)
+    assert success == [False, True]
+    assert time.time()-start < 30
+
+def test_exception_escaping_the_task(tmp_path):
+    arguments = make_arguments(str(tmp_path), ["unpicklable", "a"])
+    success = run_featurization(featurize, arguments, 1, rosetta=False)
+    assert success == [False, True]
+
+def test_depth_bounds_outstanding_decoys(tmp_path):
+    arguments = make_arguments(str(tmp_path), ["a%d" % i for i in range(8)])
+    stream = FeaturizationStream(featurize, arguments, 2, depth=3, rosetta=False)
+    taken = []
+    for index, success in stream:
+        assert len(stream.outstanding) <= 3
+        taken.append(index)
+    assert sorted(taken) == list(range(8))
+    # Largest first
+    assert taken[0] in [7, 6]
+
+# Workers of a fork server only imported the package, settings of this process are passed on
+def featurize_settings(args):
+    from pyErrorPred import featureIO, featureStore, sharedFeatures
+    return args[2] == (featureIO.get_encoding(), sharedFeatures.segment_prefix, featureStore.run_name)
+
+def test_workers_of_other_contexts_get_the_settings(tmp_path, monkeypatch):
+    import multiprocessing
+    from pyErrorPred import featureIO, featureStore, sharedFeatures
+    monkeypatch.setattr(featureIO, "_encoding", "compact")
+    monkeypatch.setattr(sharedFeatures, "segment_prefix", "lapsettings_")
+    monkeypatch.setattr(featureStore, "run_name", "host-settings")
+    expected = ("compact", "lapsettings_", "host-settings")
+    arguments = [(filename, output, expected) for filename, output, _ in make_arguments(str(tmp_path), ["a", "b"])]
+    # The package may not import without its dependencies, conftest registers it then
+    monkeypatch.setenv("PYTHONPATH", os.path.dirname(os.path.abspath(__file__)))
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload(["conftest"])
+    stream = FeaturizationStream(featurize_settings, arguments, 2, maxtasks=1, rosetta=False, context=context)
+    for _ in stream:
+        pass
+    assert stream.success == [True, True]
@@ -0,0 +1,59 @@
+import os
+import numpy as np
+from pyErrorPred.featureStore import *
+
+def test_round_trip(tmp_path):
+    arrays = {"maps": np.random.random((5, 5, 4)).astype(np.float32),
+              "idx": np.arange(15, dtype=np.uint16).reshape(5, 3),
+              "spec": np.array(["distance", "3d"]),
+              "scalar": np.array(3)}
+    FeatureStore(str(tmp_path)).write("d1", arrays)
+    loaded = FeatureStore(str(tmp_path)).load("d1")
+    assert sorted(loaded.files) == sorted(arrays)
+    for k in arrays:
+        assert loaded[k].dtype == arrays[k].dtype
+        assert loaded[k].shape == arrays[k].shape
+        assert np.array_equal(loaded[k], arrays[k])
+        assert not loaded[k].flags.writeable
+
+def test_last_write_wins(tmp_path):
+    store = FeatureStore(str(tmp_path))
+    store.write("d1", {"a": np.zeros(3)})
+    store.write("d2", {"a": np.ones(2)})
+    store.write("d1", {"a": np.arange(4)})
+    reader = FeatureStore(str(tmp_path))
+    assert sorted(reader.names()) == ["d1", "d2"]
+    assert np.array_equal(reader.load("d1")["a"], np.arange(4))
+    assert np.array_equal(reader.load("d2")["a"], np.ones(2))
+
+def test_zero_dimensional_arrays(tmp_path):
+    FeatureStore(str(tmp_path)).write("d1", {"version": np.array(3, dtype=np.int32), "spec": np.array("distance")})
+    loaded = FeatureStore(str(tmp_path)).load("d1")
+    assert loaded["version"].shape == () and loaded["version"] == 3
+    assert loaded["spec"].shape == () and str(loaded["spec"]) == "distance"
+
+def test_writer_slots(tmp_path):
+    first = FeatureStore(str(tmp_path))
+    second = FeatureStore(str(tmp_path))
+    first.write("d1", {"a": np.zeros(3)})
+    second.write("d2", {"a": np.ones(3)})
+    assert first.writer[1] != second.writer[1]
+    # A writer replacing a finished one continues its shard
+    first.close()
+    third = FeatureStore(str(tmp_path))
+    third.write("d3", {"a": np.arange(3)})
+    assert sorted([f for f in os.listdir(str(tmp_path)) if f.endswith(".bin")]) == sorted([second.writer[1]+".bin", third.writer[1]+".bin"])
+    reader = FeatureStore(str(tmp_path))
+    assert sorted(reader.names()) == ["d1", "d2", "d3"]
+    assert np.array_equal(reader.load("d1")["a"], np.zeros(3))
+    assert np.array_equal(reader.load("d3")["a"], np.arange(3))
+
+def test_update_reads_new_lines_only(tmp_path):
+    store = FeatureStore(str(tmp_path))
+    reader = FeatureStore(str(tmp_path))
+    store.write("d1", {"a": np.zeros(3)})
+    assert reader.names() == ["d1"]
+    positions = dict(reader.positions)
+    store.write("d2", {"a": np.ones(3)})
+    assert sorted(reader.names()) == ["d1", "d2"]
+    assert all([reader.positions[f] > p for f, p in positions.items()])
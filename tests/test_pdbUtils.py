@@ -0,0 +1,93 @@
+import os
+import numpy as np
+import pytest
+from conftest import samples
+from pyErrorPred.pdbUtils import get_pdb_atom_table, read_pdb, featurize_pdb, process_pdb
+from pyErrorPred.featureIO import open_features
+
+# Atom tables read from pdb lines, and a channel by channel check against the pose path.
+
+def atom_line(serial, aname, rname, chain, resnum, xyz, occupancy=1.0, altloc=" ", element=None):
+    element = aname[0] if element is None else element
+    return "ATOM  %5d %-4s%s%3s %s%4d    %8.3f%8.3f%8.3f%6.2f%6.2f          %2s\n" % (
+        serial, aname if len(aname) == 4 else " "+aname, altloc, rname, chain, resnum, xyz[0], xyz[1], xyz[2], occupancy, 0.0, element)
+
+def residue_lines(rname, chain, resnum, origin, extra=[]):
+    x = np.array(origin, dtype=np.float64)
+    atoms = [("N", x), ("CA", x+[1.5, 0, 0]), ("C", x+[2.0, 1.4, 0]), ("CB", x+[1.5, -1.0, 1.0])]
+    return [atom_line(0, a, rname, chain, resnum, v) for a, v in atoms+extra]
+
+def test_atom_table_names_and_indices():
+    lines = []
+    lines += residue_lines("HIS", "A", 1, [0, 0, 0], [("NE2", np.array([3.0, -2.0, 2.0])), ("HD1", np.array([3.0, -2.0, 3.0]))])
+    lines += residue_lines("CYS", "A", 2, [4, 0, 0], [("SG", np.array([5.0, 0.0, 2.0]))])
+    lines += ["TER\n"]
+    lines += residue_lines("CYS", "B", 1, [4, 0, 3], [("SG", np.array([5.0, 0.0, 4.0]))])
+    # Zero occupancy, second alternate location and missing backbone are not read
+    lines += [atom_line(0, "CB", "GLY", "B", 2, [9, 9, 9], occupancy=0.0)]
+    lines += residue_lines("ALA", "B", 3, [8, 0, 3])
+    lines += [atom_line(0, "CB", "ALA", "B", 3, [50, 50, 50], altloc="B")]
+    lines += [atom_line(0, "CA", "LYS", "B", 4, [12, 0, 3])]
+    atoms = get_pdb_atom_table(lines)
+    assert atoms['nres'] == 4
+    assert list(atoms['rname']) == ["HIS_D:NtermProteinFull", "CYS:disulfide:CtermProteinFull",
+                                    "CYS:disulfide:NtermProteinFull", "ALA:CtermProteinFull"]
+    assert list(atoms['chain']) == ["A", "A", "B", "B"]
+    assert np.all(atoms['atype'] == -1)
+    # Hydrogens only tell tautomers apart
+    assert len(atoms['xyz']) == 4+1+4+1+4+1+4
+    for name, residue, xyz in [("CA", 0, [1.5, 0, 0]), ("CB", 3, [9.5, -1.0, 4.0]), ("N", 2, [4, 0, 3])]:
+        assert np.allclose(atoms['xyz'][atoms[name][residue]], xyz)
+    # Tips are looked up with the full residue type name, so patched residues use CA
+    assert np.all(atoms['tip'] == atoms['CA'])
+    assert np.all(atoms['resi'][atoms['CA']] == np.arange(4))
+
+def test_atom_table_of_samples():
+    for filename in sorted(os.listdir(samples)):
+        atoms = read_pdb(os.path.join(samples, filename))
+        with open(os.path.join(samples, filename)) as f:
+            nca = len([l for l in f if l.startswith("ATOM") and l[12:16] == " CA "])
+        assert atoms['nres'] == nca
+        assert np.all(atoms['CA'] >= 0) and np.all(atoms['N'] >= 0) and np.all(atoms['C'] >= 0)
+        assert atoms['rname'][0].endswith(":NtermProteinFull")
+        assert atoms['rname'][-1].endswith(":CtermProteinFull")
+
+def test_block_features_match_dense():
+    atoms = read_pdb(os.path.join(samples, sorted(os.listdir(samples))[0]))
+    dense = featurize_pdb(atoms)
+    blocked = featurize_pdb(atoms, block=32)
+    assert blocked['maps'].dtype == np.float32
+    assert np.allclose(dense['maps'], blocked['maps'], atol=1e-3)
+    assert np.array_equal(dense['tbt'][0], dense['maps'][:,:,0])
+
+# Features of process_pdb and process (pyrosetta) on the sample decoys.
+# Coordinates are written with 3 decimals and rosetta keeps them as read, so distance
+# channels agree within 1e-3 A (float32 in the files). Residue order and residue type
+# names, including HIS_D, disulfides and terminus patches, have to be identical.
+tolerance = 1e-3
+
+@pytest.mark.parametrize("filename", sorted(os.listdir(samples)))
+def test_channels_match_pose_path(filename, tmp_path):
+    pytest.importorskip("pyrosetta")
+    from pyErrorPred.featurize import process, load_pose, init_rosetta, get_atom_table
+    path = os.path.join(samples, filename)
+    rosetta = str(tmp_path / "rosetta.features.npz")
+    plain = str(tmp_path / "pdb.features.npz")
+    assert process((path, rosetta, False, ["distance"]))
+    assert process_pdb((path, plain, False, ["distance"]))
+    expected = open_features(rosetta)
+    features = open_features(plain)
+    assert features['maps'].shape == expected['maps'].shape
+    for c in range(expected['maps'].shape[-1]):
+        assert np.allclose(features['maps'][:,:,c], expected['maps'][:,:,c], atol=tolerance), "maps channel %d" % c
+    assert np.allclose(features['tbt'][0], expected['tbt'][0], atol=tolerance)
+
+    init_rosetta()
+    pose_atoms = get_atom_table(load_pose(path))
+    atoms = read_pdb(path)
+    assert list(atoms['rname']) == list(pose_atoms['rname'])
+    assert list(atoms['chain']) == list(pose_atoms['chain'])
+    for name in ["N", "CA", "C", "CB", "tip"]:
+        assert np.array_equal(atoms[name] < 0, pose_atoms[name] < 0), name
+        present = atoms[name] >= 0
+        assert np.allclose(atoms['xyz'][atoms[name][present]], pose_atoms['xyz'][pose_atoms[name][present]], atol=tolerance), name
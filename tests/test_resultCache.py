@@ -0,0 +1,34 @@
+import os
+import numpy as np
+from pyErrorPred.resultCache import *
+from conftest import samples
+
+sample = os.path.join(samples, "tag0137.relaxed.al.pdb")
+
+def rewrite(filename, change):
+    with open(sample) as f:
+        lines = [change(l) if l.startswith("ATOM") else l for l in f]
+    with open(filename, "w") as f:
+        f.writelines(lines)
+
+def test_hash_ignores_bfactors_and_serials(tmp_path):
+    original = get_structure_hash(sample)
+    renumbered = str(tmp_path/"renumbered.pdb")
+    rewrite(renumbered, lambda l: l[:6]+"%5d" % 99999+l[11:60]+" 55.00"+l[66:])
+    assert get_structure_hash(renumbered) == original
+    moved = str(tmp_path/"moved.pdb")
+    rewrite(moved, lambda l: l[:30]+"%8.3f" % (float(l[30:38])+0.1)+l[38:])
+    assert get_structure_hash(moved) != original
+
+def test_put_fetch_and_eviction(tmp_path):
+    infile = str(tmp_path/"in.npz")
+    np.savez(infile, a=np.random.random(1000))
+    size = os.path.getsize(infile)
+    cache = ResultCache(str(tmp_path/"cache"), 5*size)
+    for i in range(20):
+        cache.put("k%d" % i, prediction_entry, infile)
+    entries = os.listdir(str(tmp_path/"cache"))
+    assert len(entries) <= 5
+    assert "k19.npz" in entries
+    assert cache.fetch("k19", prediction_entry, str(tmp_path/"out.npz"))
+    assert not cache.fetch("k0", prediction_entry, str(tmp_path/"out.npz"))
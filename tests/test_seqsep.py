@@ -0,0 +1,22 @@
+import numpy as np
+from pyErrorPred.deepLearningUtils import seqsep, get_static_seqsep
+
+# Vectorized seqsep against the double loop it replaced.
+
+def baseline_seqsep(psize, normalizer=100, axis=-1):
+    ret = np.ones((psize, psize))
+    for i in range(psize):
+        for j in range(psize):
+            ret[i,j] = abs(i-j)*1.0/100-1.0
+    return np.expand_dims(ret, axis)
+
+def test_seqsep_matches_loop():
+    for n in [1, 7, 150]:
+        assert np.array_equal(seqsep(n), baseline_seqsep(n))
+
+def test_static_seqsep_is_cached_and_read_only():
+    sep = get_static_seqsep(40)
+    assert sep.dtype == np.float32 and sep.shape == (40, 40)
+    assert np.array_equal(sep, baseline_seqsep(40)[:,:,0].astype(np.float32))
+    assert not sep.flags.writeable
+    assert get_static_seqsep(40) is sep
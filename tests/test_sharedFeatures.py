@@ -0,0 +1,28 @@
+import os
+import numpy as np
+from pyErrorPred.featureIO import *
+
+def test_round_trip_and_release(tmp_path):
+    path = get_feature_path(str(tmp_path), "d1", memory_name)
+    assert is_memory_path(path)
+    features = {"maps": np.random.random((6, 6, 4)).astype(np.float32),
+                "tbt": np.random.random((10, 6, 6)).astype(np.float32)}
+    save_features(path, features, ["distance"])
+    receive_shared(path, take_written(path))
+    assert has_features(path, ["distance"])
+    loaded = load_features(path)
+    for k in features:
+        assert np.array_equal(loaded[k], features[k])
+        assert not loaded[k].flags.writeable
+    del loaded
+    release_shared(path)
+    assert not feature_exists(path)
+    assert not os.path.exists(os.path.join("/dev/shm", get_segment_name(path)))
+    assert os.listdir(str(tmp_path)) == []
+
+def test_discard_before_handover(tmp_path):
+    path = get_feature_path(str(tmp_path), "d2", memory_name)
+    save_features(path, {"maps": np.zeros((3, 3, 4)), "tbt": np.zeros((10, 3, 3))})
+    take_written(path)
+    discard_shared(path)
+    assert not os.path.exists(os.path.join("/dev/shm", get_segment_name(path)))
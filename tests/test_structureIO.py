@@ -0,0 +1,104 @@
+import gzip
+import os
+from pyErrorPred.structureIO import *
+from conftest import samples
+
+sample = os.path.join(samples, "tag0137.relaxed.al.pdb")
+
+def read_atoms(filename, count):
+    with open(filename) as f:
+        return [l for l in f if l.startswith("ATOM")][:count]
+
+def write_models(filename, models):
+    opener = gzip.open if filename.endswith(".gz") else open
+    with opener(filename, "wt") as f:
+        f.write("REMARK test\n")
+        for serial, lines in models:
+            f.write("MODEL     %4d\n" % serial)
+            f.writelines(lines)
+            f.write("ENDMDL\n")
+        f.write("END\n")
+
+def test_pdb_models(tmp_path):
+    atoms = read_atoms(sample, 30)
+    models = [(1, atoms[:10]), (2, atoms[10:20]), (7, atoms[20:30])]
+    filename = str(tmp_path/"x.pdb")
+    write_models(filename, models)
+    structures = list(iterate_structures(filename, models=True))
+    assert [n for n, _ in structures] == ["x.model1", "x.model2", "x.model7"]
+    for (_, structure), (_, lines) in zip(structures, models):
+        read = read_structure_lines(structure)
+        assert read[0].startswith("MODEL")
+        assert read[1:] == lines
+
+def test_pdb_without_models(tmp_path):
+    filename = str(tmp_path/"y.pdb")
+    with open(sample) as f, open(filename, "w") as g:
+        g.write(f.read())
+    assert list(iterate_structures(filename)) == [("y", filename)]
+    (name, structure), = iterate_structures(filename, models=True)
+    assert name == "y"
+    assert read_structure_lines(structure) == read_structure_lines(filename)
+
+def write_silent(filename):
+    header = ["SEQUENCE: AAA\n", "SCORE: score description\n"]
+    lines = header[:]
+    for tag in ["S_0001", "S_0002"]:
+        lines += ["SCORE: 1.0 "+tag+"\n", "REMARK BINARY "+tag+"\n", "L1 "+tag+"\n", "L2 "+tag+"\n"]
+    # Appended file repeating the header
+    lines += header
+    lines += ["SCORE: 2.0 S_0003\n", "L1 S_0003\n"]
+    with open(filename, "w") as f:
+        f.writelines(lines)
+    return header
+
+def test_silent_tags(tmp_path):
+    filename = str(tmp_path/"decoys.silent")
+    header = write_silent(filename)
+    structures = list(iterate_structures(filename))
+    assert [n for n, _ in structures] == ["S_0001", "S_0002", "S_0003"]
+    for name, structure in structures:
+        lines = read_structure_lines(structure)
+        assert lines[:2] == header
+        assert all([l.split()[-1] == name for l in lines[2:]])
+    assert len(read_structure_lines(structures[1][1])) == 6
+    assert len(read_structure_lines(structures[2][1])) == 4
+
+def test_gzip_out_of_order(tmp_path):
+    atoms = read_atoms(sample, 40)
+    models = [(i+1, atoms[4*i:4*i+4]) for i in range(10)]
+    filename = str(tmp_path/"z.pdb.gz")
+    write_models(filename, models)
+    structures = [s for _, s in iterate_structures(filename)]
+    for i in [5, 2, 9, 0, 0, 7]:
+        assert read_structure_lines(structures[i])[1:] == models[i][1]
+
+def test_pdb_models_without_endmdl(tmp_path):
+    atoms = read_atoms(sample, 12)
+    filename = str(tmp_path/"w.pdb")
+    with open(filename, "w") as f:
+        f.write("MODEL        1\n")
+        f.writelines(atoms[:4])
+        f.write("MODEL        2\n")
+        f.writelines(atoms[4:8])
+        f.write("ENDMDL\n")
+        f.write("MODEL        3\n")
+        f.writelines(atoms[8:])
+    structures = list(iterate_structures(filename, models=True))
+    assert [n for n, _ in structures] == ["w.model1", "w.model2", "w.model3"]
+    for (_, structure), lines in zip(structures, [atoms[:4], atoms[4:8], atoms[8:]]):
+        assert read_structure_lines(structure)[1:] == lines
+
+def test_unique_names(tmp_path):
+    for folder in ["a", "b"]:
+        os.makedirs(str(tmp_path/folder))
+        with open(str(tmp_path/folder/"x.pdb"), "w") as f:
+            f.writelines(read_atoms(sample, 5))
+    a, b = str(tmp_path/"a"/"x.pdb"), str(tmp_path/"b"/"x.pdb")
+    named = list(iterate_structures(a))+list(iterate_structures(b))+list(iterate_structures(a))
+    assert [n for n, _ in get_unique_names(named)] == ["a_x.pdb", "b_x.pdb"]
+
+def test_shards():
+    names = ["decoy%d" % i for i in range(100)]
+    shards = [[n for n in names if in_shard(n, (i, 3))] for i in range(3)]
+    assert sorted(sum(shards, [])) == sorted(names)
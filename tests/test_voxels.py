@@ -0,0 +1,103 @@
+import numpy as np
+import scipy.spatial
+from pyErrorPred.geometry import get_row_neighbors, set_neighbors3D, voxelize
+
+# set_neighbors3D and get_row_neighbors against the loops they replaced.
+
+def get_frames(rng, nres):
+    q, _ = np.linalg.qr(rng.normal(size=(nres, 3, 3)))
+    return q
+
+# The voxels of the baseline set_neighbors3D, from its atoms, types, CA atoms and frames
+def baseline_voxels(xyz, types, xyz_ca, lfr):
+    kd = scipy.spatial.cKDTree(xyz)
+    kd_ca = scipy.spatial.cKDTree(xyz_ca)
+    indices = kd_ca.query_ball_tree(kd, 14.0)
+    idx = np.array([[i,j,types[j]] for i in range(len(indices)) for j in indices[i]])
+    xyz_shift = xyz[idx.T[1]] - xyz_ca[idx.T[0]]
+    xyz_new = np.sum(lfr[idx.T[0]] * xyz_shift[:,None,:], axis=-1)
+    nbins = 24
+    width = 19.2
+    N = idx.shape[0]
+    h = width / (nbins-1)
+    xyz = (xyz_new + 0.5 * width) / h
+    i = idx[:,0].astype(dtype=np.int16).reshape((N,1))
+    t = idx[:,2].astype(dtype=np.int16).reshape((N,1))
+    klm = np.floor(xyz).astype(dtype=np.int16)
+    d = xyz - np.floor(xyz)
+    klm0 = np.array(klm[:,0]).reshape((N,1))
+    klm1 = np.array(klm[:,1]).reshape((N,1))
+    klm2 = np.array(klm[:,2]).reshape((N,1))
+    V000 = np.array(d[:,0] * d[:,1] * d[:,2]).reshape((N,1))
+    V100 = np.array((1-d[:,0]) * d[:,1] * d[:,2]).reshape((N,1))
+    V010 = np.array(d[:,0] * (1-d[:,1]) * d[:,2]).reshape((N,1))
+    V110 = np.array((1-d[:,0]) * (1-d[:,1]) * d[:,2]).reshape((N,1))
+    V001 = np.array(d[:,0] * d[:,1] * (1-d[:,2])).reshape((N,1))
+    V101 = np.array((1-d[:,0]) * d[:,1] * (1-d[:,2])).reshape((N,1))
+    V011 = np.array(d[:,0] * (1-d[:,1]) * (1-d[:,2])).reshape((N,1))
+    V111 = np.array((1-d[:,0]) * (1-d[:,1]) * (1-d[:,2])).reshape((N,1))
+    a = np.vstack([np.hstack([i, klm0, klm1, klm2, t, V111]),
+                   np.hstack([i, klm0+1, klm1, klm2, t, V011]),
+                   np.hstack([i, klm0, klm1+1, klm2, t, V101]),
+                   np.hstack([i, klm0+1, klm1+1, klm2, t, V001]),
+                   np.hstack([i, klm0, klm1, klm2+1, t, V110]),
+                   np.hstack([i, klm0+1, klm1, klm2+1, t, V010]),
+                   np.hstack([i, klm0, klm1+1, klm2+1, t, V100]),
+                   np.hstack([i, klm0+1, klm1+1, klm2+1, t, V000])])
+    b = a[(np.min(a[:,1:4],axis=-1) >= 0) & (np.max(a[:,1:4],axis=-1) < nbins) & (a[:,5]>1e-5)]
+    return b[:,:5].astype(np.uint16), b[:,5].astype(np.float16)
+
+def sort_voxels(idx, val):
+    order = np.lexsort(idx.T[::-1])
+    return idx[order], val[order]
+
+def make_pdict(rng, nres=40, natoms=300):
+    xyz = rng.uniform(0, 30, size=(natoms, 3))
+    resi = np.sort(rng.integers(0, nres+2, size=natoms))
+    atype = rng.integers(-1, 167, size=natoms)
+    atoms = {"xyz": xyz, "resi": resi, "atype": atype}
+    return {"atoms": atoms, "nres": nres, "Ca": rng.uniform(0, 30, size=(nres, 3)), "lfr": get_frames(rng, nres)}
+
+def test_voxels_match_baseline():
+    rng = np.random.default_rng(0)
+    pdict = make_pdict(rng)
+    atoms = pdict["atoms"]
+    typed = (atoms["atype"] >= 0) & (atoms["resi"] < pdict["nres"])
+    expected = sort_voxels(*baseline_voxels(atoms["xyz"][typed], atoms["atype"][typed], pdict["Ca"], pdict["lfr"]))
+    for block in [None, 7]:
+        set_neighbors3D(pdict, block=block)
+        idx, val = sort_voxels(pdict["idx"], pdict["val"])
+        assert idx.dtype == np.uint16 and val.dtype == np.float16
+        assert np.array_equal(idx, expected[0])
+        assert np.array_equal(val, expected[1])
+
+def test_voxels_of_residues():
+    rng = np.random.default_rng(1)
+    pdict = make_pdict(rng)
+    set_neighbors3D(pdict)
+    full = sort_voxels(pdict["idx"], pdict["val"])
+    residues = np.array([3, 4, 20])
+    set_neighbors3D(pdict, residues)
+    keep = np.isin(full[0][:,0], residues)
+    idx, val = sort_voxels(pdict["idx"], pdict["val"])
+    assert np.array_equal(idx, full[0][keep])
+    assert np.array_equal(val, full[1][keep])
+
+def test_voxelize_drops_corners_outside_the_box():
+    idx, val = voxelize(np.array([0, 1]), np.array([5, 6]), np.array([[0.0, 0.0, 0.0], [9.7, 0.0, 0.0]]))
+    assert np.all(idx[idx[:,0] == 1][:,1] < 24)
+    assert np.all(idx[:,4] == np.where(idx[:,0] == 0, 5, 6))
+    assert np.isclose(val[idx[:,0] == 0].astype(np.float64).sum(), 1.0, atol=1e-2)
+
+def test_row_neighbors_match_baseline():
+    rng = np.random.default_rng(2)
+    Cb = rng.uniform(0, 40, size=(60, 3))
+    kd = scipy.spatial.cKDTree(Cb)
+    rows = np.arange(10, 25)
+    idx0, idx1 = get_row_neighbors(kd, Cb, rows, 20.0)
+    expected = set([(i, j) for i in rows for j in kd.query_ball_point(Cb[i], 20.0) if i != j])
+    assert idx0.dtype == np.int64 and idx1.dtype == np.int64
+    assert len(idx0) == len(expected)
+    assert set(zip(idx0.tolist(), idx1.tolist())) == expected
+    idx0, idx1 = get_row_neighbors(kd, Cb, np.array([], dtype=np.int64), 20.0)
+    assert len(idx0) == 0 and len(idx1) == 0